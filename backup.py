@@ -0,0 +1,139 @@
+"""
+Online backup and restore of the mess database.
+
+Snapshots are taken with SQLite's incremental backup API, a few pages at a
+time, so the bot keeps writing while a backup is running. Each snapshot is
+integrity-checked, gzip-compressed and rotated in BACKUP_DIR.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+from config import BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP
+
+BACKUP_PREFIX = 'mess-'
+BACKUP_SUFFIX = '.db.gz'
+REQUIRED_TABLES = {'Users', 'Off_Requests', 'Payments'}
+
+
+class BackupError(Exception):
+    """Raised when a snapshot fails verification."""
+
+
+def _verify(path):
+    """Check that the database at path is intact and has the bot's tables."""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != 'ok':
+            raise BackupError(f"Integrity check failed: {result}")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = REQUIRED_TABLES - tables
+        if missing:
+            raise BackupError(f"Missing tables: {', '.join(sorted(missing))}")
+    finally:
+        conn.close()
+
+
+def _copy_online(src_path, dst_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """Copy src_path into dst_path using the online backup API in small steps."""
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst, pages=pages, sleep=sleep)
+    finally:
+        dst.close()
+        src.close()
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Return snapshot paths in backup_dir, newest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [
+        name for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)
+    ]
+    # Timestamped names sort chronologically
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def rotate_backups(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Delete all but the newest `keep` snapshots and return the deleted paths."""
+    removed = list_backups(backup_dir)[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def create_backup(db_path='mess.db', backup_dir=BACKUP_DIR, keep=BACKUP_KEEP,
+                  pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """Take a verified, compressed snapshot of db_path and return its path."""
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    archive_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{timestamp}{BACKUP_SUFFIX}")
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=backup_dir)
+    os.close(fd)
+    try:
+        _copy_online(db_path, tmp_path, pages=pages, sleep=sleep)
+        _verify(tmp_path)
+
+        # Write to a partial file first so a crash never leaves a truncated snapshot
+        partial_path = archive_path + '.part'
+        with open(tmp_path, 'rb') as raw, gzip.open(partial_path, 'wb') as packed:
+            shutil.copyfileobj(raw, packed)
+        os.replace(partial_path, archive_path)
+    finally:
+        os.remove(tmp_path)
+
+    rotate_backups(backup_dir, keep)
+    return archive_path
+
+
+def restore_backup(archive_path, db_path='mess.db'):
+    """Restore a compressed snapshot into db_path after verifying it."""
+    if not os.path.isfile(archive_path):
+        raise BackupError(f"Snapshot not found: {archive_path}")
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(db_path)))
+    os.close(fd)
+    try:
+        with gzip.open(archive_path, 'rb') as packed, open(tmp_path, 'wb') as raw:
+            shutil.copyfileobj(packed, raw)
+        _verify(tmp_path)
+
+        # Copy through the backup API so open connections see a consistent database
+        _copy_online(tmp_path, db_path, pages=-1, sleep=0)
+        _verify(db_path)
+    finally:
+        os.remove(tmp_path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Back up or restore mess.db")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    subparsers.add_parser('create', help="Take a new snapshot")
+    subparsers.add_parser('list', help="List existing snapshots")
+    restore_parser = subparsers.add_parser('restore', help="Restore a snapshot into mess.db")
+    restore_parser.add_argument('snapshot')
+    args = parser.parse_args()
+
+    if args.action == 'create':
+        print(create_backup())
+    elif args.action == 'list':
+        for path in list_backups():
+            print(path)
+    elif args.action == 'restore':
+        restore_backup(args.snapshot)
+        # Same follow-up as /backup restore: migrate the schema and drop messages sent before
+        from database import init_database
+        from outbox import discard_unsent
+        init_database()
+        discard_unsent("Restored from a backup")
+        print(f"Restored {args.snapshot}")
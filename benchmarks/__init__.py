@@ -0,0 +1,5 @@
+"""
+Benchmarks and capacity tools for the Mess Management Bot.
+
+Run them from the repository root with `python -m benchmarks.<module>`.
+"""
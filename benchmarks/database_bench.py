@@ -0,0 +1,203 @@
+"""
+Microbenchmarks for the database.py hot paths and the admin queries.
+
+Each benchmark runs against a freshly seeded synthetic mess.db at every
+requested size and reports per-call timings as JSON:
+
+    python -m benchmarks.database_bench --sizes 100,1000,5000 --output base.json
+    python -m benchmarks.database_bench --compare base.json new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+import database
+from benchmarks.seed import seed_database
+from handlers.admin_handlers import _render_offs
+from tenants import pool
+
+BENCH_START = date(2025, 1, 1)
+
+
+def _summarize(name, users, samples):
+    samples_us = sorted(ns / 1000 for ns in samples)
+    return {
+        'benchmark': name,
+        'users': users,
+        'iterations': len(samples_us),
+        'mean_us': round(statistics.fmean(samples_us), 2),
+        'median_us': round(statistics.median(samples_us), 2),
+        'p95_us': round(samples_us[min(len(samples_us) - 1, int(len(samples_us) * 0.95))], 2),
+        'min_us': round(samples_us[0], 2),
+    }
+
+
+def _time(func, *args):
+    start = time.perf_counter_ns()
+    func(*args)
+    return time.perf_counter_ns() - start
+
+
+def run_benchmarks(users, days, iterations, rng):
+    """Seed a database with `users` users in the current directory and time every hot path."""
+    if os.path.exists('mess.db'):
+        pool.close_idle('mess.db')
+        os.remove('mess.db')
+    database.init_database()
+    usernames = seed_database('mess.db', users=users, days=days, seed=rng.randrange(1 << 30))
+    telegram_ids = [str(100000 + i) for i in range(users)]
+    results = []
+
+    def bench(name, step):
+        step(0)  # warm up caches and imports
+        results.append(_summarize(name, users, [step(i) for i in range(iterations)]))
+
+    bench('parse_off_dates', lambda i: _time(database.parse_off_dates, '2025-05-01 to 2025-05-31,2025-06-02'))
+    bench('check_mobile_by_telegram_id',
+          lambda i: _time(database.check_mobile_by_telegram_id, rng.choice(telegram_ids)))
+    bench('get_user_offs', lambda i: _time(database.get_user_offs, rng.choice(usernames)))
+
+    # Off requests go to dates after the seeded history so they never hit the duplicate check
+    future = BENCH_START + timedelta(days=days + 1)
+    added = []
+
+    def add_step(i):
+        username = rng.choice(usernames)
+        off_date = (future + timedelta(days=i)).isoformat()
+        elapsed = _time(database.add_off_request, username, off_date, 'lunch')
+        added.append((username, off_date))
+        return elapsed
+    bench('add_off_request', add_step)
+
+    conn = sqlite3.connect('mess.db')
+    off_ids = [
+        conn.execute('SELECT id FROM Off_Requests WHERE username = ? AND date = ?', pair).fetchone()[0]
+        for pair in added
+    ]
+    conn.close()
+    remaining_ids = iter(off_ids)
+    bench('delete_off_request', lambda i: _time(database.delete_off_request, next(remaining_ids)))
+
+    # Conversion is measured inside a transaction that is rolled back afterwards
+    conn = database.connect()
+    cursor = conn.cursor()
+
+    def convert_step(i):
+        username = rng.choice(usernames)
+        cursor.execute('UPDATE Users SET meal_credits = 4 WHERE username = ?', (username,))
+        return _time(database.auto_convert_credits_to_days, cursor, username)
+    bench('auto_convert_credits_to_days', convert_step)
+    conn.rollback()
+    conn.close()
+
+    # Admin queries, as run by the owner commands
+    bench('admin_viewoffs', lambda i: _time(_render_offs, (BENCH_START + timedelta(days=rng.randrange(days))).isoformat()))
+
+    def admin_query(sql, params=()):
+        def step(i):
+            conn = database.connect()
+            start = time.perf_counter_ns()
+            pd.read_sql_query(sql, conn, params=params)
+            elapsed = time.perf_counter_ns() - start
+            conn.close()
+            return elapsed
+        return step
+    bench('admin_listusers', admin_query(
+        'SELECT username, name, mobile, telegram_id, subscription_start, subscription_end FROM Users'))
+    bench('admin_showdb_offs', admin_query('SELECT * FROM Off_Requests ORDER BY date DESC'))
+    bench('admin_showdb_payments', admin_query('SELECT * FROM Payments ORDER BY payment_date DESC'))
+    bench('admin_convertallcredits_select', admin_query('SELECT username FROM Users WHERE meal_credits >= ?', (2,)))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(base_path, new_path, threshold):
+    """Print per-benchmark median changes and return the number of regressions."""
+    with open(base_path) as f:
+        base = {(r['benchmark'], r['users']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'benchmark':34} {'users':>6} {'base us':>10} {'new us':>10} {'change':>8}")
+    for result in new:
+        old = base.get((result['benchmark'], result['users']))
+        if not old:
+            continue
+        change = result['median_us'] / old['median_us'] - 1 if old['median_us'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{result['benchmark']:34} {result['users']:6d} {old['median_us']:10.1f} "
+              f"{result['median_us']:10.1f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark database.py hot paths")
+    parser.add_argument('--sizes', default='100,1000,5000', help="Comma-separated user counts")
+    parser.add_argument('--days', type=int, default=90, help="Days of seeded off history")
+    parser.add_argument('--iterations', type=int, default=200, help="Timed calls per benchmark")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write JSON results here instead of stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="Compare two result files")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Median slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    rng = random.Random(args.seed)
+    results = []
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for size in (int(s) for s in args.sizes.split(',')):
+                print(f"Benchmarking {size} users...", file=sys.stderr)
+                results.extend(run_benchmarks(size, args.days, args.iterations, rng))
+        finally:
+            os.chdir(original_dir)
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'days': args.days,
+            'iterations': args.iterations,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+A local stand-in for the Telegram Bot API.
+
+Implements just enough of getMe, getUpdates, sendMessage, editMessageText,
+answerCallbackQuery and deleteWebhook for the bot to run unmodified against
+it. Tests inject updates with push_update() and observe replies through
+on_reply.
+"""
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'Mess Bot', 'username': 'mess_test_bot'}
+
+
+class FakeBotAPI:
+    """Minimal HTTP/1.1 Bot API server running on the current event loop."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.calls = {}
+        self.errors = 0
+        self.on_reply = None  # called as on_reply(method, chat_id, params) for outgoing messages
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_updates = asyncio.Event()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/bot'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    ###########
+    # UPDATES #
+    ###########
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+    def _message(self, chat_id, text, from_user):
+        message = {
+            'message_id': self._next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': from_user,
+            'text': text,
+        }
+        self._next_message_id += 1
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    def push_update(self, update):
+        """Queue a raw update dict for the next getUpdates call and return its update_id."""
+        update['update_id'] = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._new_updates.set()
+        return update['update_id']
+
+    def push_text(self, user_id, text):
+        """Queue a text message (or command) sent by user_id."""
+        return self.push_update({'message': self._message(user_id, text, self._user(user_id))})
+
+    def push_callback(self, user_id, data):
+        """Queue an inline keyboard tap by user_id with callback data."""
+        return self.push_update({'callback_query': {
+            'id': str(self._next_update_id),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': self._message(user_id, 'Select meal to off:', BOT_USER),
+        }})
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        timeout = float(params.get('timeout', 0) or 0)
+        # Drop updates the bot has confirmed by advancing the offset
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit', 100) or 100)
+        return self._updates[:limit]
+
+    ###########
+    # METHODS #
+    ###########
+
+    async def _call(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('deleteWebhook', 'setMyCommands', 'answerCallbackQuery'):
+            return True
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = int(params['chat_id'])
+            if self.on_reply:
+                self.on_reply(method, chat_id, params)
+            return self._message(chat_id, params.get('text', params.get('caption', '')), BOT_USER)
+        raise KeyError(method)
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method = path.rsplit('/', 1)[-1]
+                params = self._parse_body(headers.get('content-type', ''), body)
+                try:
+                    payload = {'ok': True, 'result': await self._call(method, params)}
+                    status = '200 OK'
+                except KeyError:
+                    self.errors += 1
+                    payload = {'ok': False, 'error_code': 404, 'description': f'Not Found: {method}'}
+                    status = '404 Not Found'
+
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n'.encode('latin-1') + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_body(content_type, body):
+        if not body:
+            return {}
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+        # Multipart uploads (documents) are accepted but their fields are not parsed
+        return {}
@@ -0,0 +1,214 @@
+"""
+End-to-end load test of the bot against a local fake Bot API server.
+
+The real Application from bot.py polls benchmarks.fake_bot_api over HTTP,
+so every update goes through PTB's dispatch, the handlers, database.py and
+the outgoing sendMessage calls. Simulated users run concurrently:
+
+    * /offmess conversations: command, date reply and a meal button tap
+    * /status bursts: several /status commands sent back to back
+    * the owner repeatedly running /viewoffs
+
+Throughput, p50/p99 latency per step and error counts are reported:
+
+    python -m benchmarks.load_test --users 500 --concurrency 50 --rounds 5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import database
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.seed import seed_database
+from bot import build_application
+from outbox import start_sender, stop_sender
+from clock import get_clock
+
+OWNER_ID = 1
+FIRST_USER_ID = 100000  # seed_database gives user i the telegram_id 100000 + i
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class LoadTest:
+    """Drives simulated users against a running bot and collects per-step latencies."""
+
+    def __init__(self, api, timeout):
+        self.api = api
+        self.timeout = timeout
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        self.handler_errors = 0
+        self.rejected = 0
+        self._replies = defaultdict(asyncio.Queue)
+        api.on_reply = self._on_reply
+
+    def _on_reply(self, method, chat_id, params):
+        self._replies[chat_id].put_nowait((time.perf_counter(), params.get('text', '')))
+
+    async def on_error(self, update, context):
+        self.handler_errors += 1
+
+    async def _expect(self, step, chat_id, sent_at):
+        """Wait for the next reply in chat_id and record its latency under step."""
+        try:
+            received_at, text = await asyncio.wait_for(self._replies[chat_id].get(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[step] += 1
+            return None
+        self.latencies[step].append(received_at - sent_at)
+        return text
+
+    async def _send(self, step, user_id, text):
+        sent_at = time.perf_counter()
+        self.api.push_text(user_id, text)
+        return await self._expect(step, user_id, sent_at)
+
+    async def offmess_user(self, user_id, rounds, first_day):
+        """Mark lunch off on consecutive future dates, one conversation per round."""
+        for i in range(rounds):
+            off_date = (first_day + timedelta(days=i)).isoformat()
+            if await self._send('offmess', user_id, '/offmess') is None:
+                continue
+            if await self._send('offmess_date', user_id, off_date) is None:
+                continue
+            sent_at = time.perf_counter()
+            self.api.push_callback(user_id, 'lunch')
+            reply = await self._expect('offmess_tap', user_id, sent_at)
+            if reply is not None and not reply.startswith('Mess off confirmed'):
+                self.rejected += 1
+
+    async def status_user(self, user_id, rounds, burst):
+        """Send bursts of /status without waiting between commands."""
+        for _ in range(rounds):
+            sent_at = time.perf_counter()
+            for _ in range(burst):
+                self.api.push_text(user_id, '/status')
+            for _ in range(burst):
+                await self._expect('status', user_id, sent_at)
+
+    async def owner(self, rounds, dates):
+        for i in range(rounds):
+            await self._send('viewoffs', OWNER_ID, f'/viewoffs {dates[i % len(dates)].isoformat()}')
+
+    def report(self, elapsed):
+        steps = {}
+        for step in sorted(set(self.latencies) | set(self.timeouts)):
+            samples = self.latencies.get(step, [])
+            steps[step] = {
+                'replies': len(samples),
+                'timeouts': self.timeouts.get(step, 0),
+                'p50_ms': round(_percentile(samples, 0.50) * 1000, 2) if samples else None,
+                'p99_ms': round(_percentile(samples, 0.99) * 1000, 2) if samples else None,
+            }
+        replies = sum(len(samples) for samples in self.latencies.values())
+        expected = replies + sum(self.timeouts.values())
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'replies': replies,
+            'throughput_rps': round(replies / elapsed, 1) if elapsed else None,
+            'error_rate': round(
+                (sum(self.timeouts.values()) + self.handler_errors + self.rejected) / expected, 4
+            ) if expected else 0.0,
+            'handler_errors': self.handler_errors,
+            'rejected_offs': self.rejected,
+            'api_errors': self.api.errors,
+            'api_calls': dict(sorted(self.api.calls.items())),
+            'steps': steps,
+        }
+
+
+async def run_load_test(users, concurrency, rounds, burst, timeout, seed):
+    """Seed mess.db in the current directory, start the bot against a fake API and run all scenarios."""
+    database.init_database()
+    seed_database('mess.db', users=users, seed=seed)
+    rng = random.Random(seed)
+
+    api = FakeBotAPI()
+    await api.start()
+    application = build_application(token='123456:LOADTEST', owner_telegram_id=str(OWNER_ID), base_url=api.base_url)
+    test = LoadTest(api, timeout)
+    application.add_error_handler(test.on_error)
+
+    await application.initialize()
+    await application.start()
+    await start_sender(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    # Off users and /status users are disjoint so their replies never interleave in one chat
+    user_ids = rng.sample(range(FIRST_USER_ID, FIRST_USER_ID + users), min(users, 2 * concurrency))
+    off_users, status_users = user_ids[:concurrency], user_ids[concurrency:]
+    first_day = get_clock().today() + timedelta(days=1)
+    view_dates = [first_day + timedelta(days=i) for i in range(rounds)]
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(test.offmess_user(user_id, rounds, first_day) for user_id in off_users),
+            *(test.status_user(user_id, rounds, burst) for user_id in status_users),
+            test.owner(rounds * 4, view_dates),
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        await application.updater.stop()
+        await stop_sender(application)
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+    return test.report(elapsed)
+
+
+def _print_report(report):
+    print(f"{report['replies']} replies in {report['elapsed_s']:.2f}s "
+          f"({report['throughput_rps']} replies/s), error rate {report['error_rate']:.2%}")
+    print(f"handler errors {report['handler_errors']}, rejected offs {report['rejected_offs']}, "
+          f"API errors {report['api_errors']}")
+    print(f"{'step':14} {'replies':>8} {'timeouts':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for step, stats in report['steps'].items():
+        p50 = f"{stats['p50_ms']:9.2f}" if stats['p50_ms'] is not None else f"{'-':>9}"
+        p99 = f"{stats['p99_ms']:9.2f}" if stats['p99_ms'] is not None else f"{'-':>9}"
+        print(f"{step:14} {stats['replies']:8d} {stats['timeouts']:9d} {p50} {p99}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot against a local fake Bot API")
+    parser.add_argument('--users', type=int, default=500, help="Users seeded into mess.db")
+    parser.add_argument('--concurrency', type=int, default=50, help="Simultaneous /offmess users (and as many /status users)")
+    parser.add_argument('--rounds', type=int, default=5, help="Conversations or bursts per simulated user")
+    parser.add_argument('--burst', type=int, default=5, help="/status commands per burst")
+    parser.add_argument('--timeout', type=float, default=10.0, help="Seconds to wait for a reply")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(run_load_test(args.users, args.concurrency, args.rounds,
+                                               args.burst, args.timeout, args.seed))
+        finally:
+            os.chdir(original_dir)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+    sys.exit(1 if report['error_rate'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Synthetic mess.db generation for benchmarks.
+
+Seeding is deterministic for a given seed so results can be compared
+across commits.
+"""
+
+import random
+import sqlite3
+from datetime import date, timedelta
+
+FIRST_NAMES = [
+    'Aarav', 'Vivaan', 'Aditya', 'Vihaan', 'Arjun', 'Sai', 'Reyansh', 'Krishna', 'Ishaan', 'Rohan',
+    'Ananya', 'Diya', 'Saanvi', 'Aadhya', 'Pari', 'Anika', 'Navya', 'Riya', 'Meera', 'Kavya',
+]
+LAST_NAMES = [
+    'Sharma', 'Verma', 'Patel', 'Gupta', 'Singh', 'Kumar', 'Reddy', 'Iyer', 'Nair', 'Joshi',
+    'Kulkarni', 'Deshmukh', 'Mehta', 'Shah', 'Rao', 'Das', 'Bose', 'Pillai', 'Yadav', 'Mishra',
+]
+MEALS = ['lunch', 'dinner', 'both']
+
+
+def seed_database(path, users=500, days=90, off_rate=0.1, payments_per_user=3,
+                  start=date(2025, 1, 1), seed=42):
+    """Fill the database at path with synthetic users, off history and payments.
+
+    The schema must already exist (see database.init_database). Returns the
+    list of seeded usernames.
+    """
+    rng = random.Random(seed)
+    counters = {}
+    user_rows = []
+    off_rows = []
+    payment_rows = []
+    for i in range(users):
+        first = rng.choice(FIRST_NAMES)
+        counters[first] = counters.get(first, 0) + 1
+        username = f'@{first}{counters[first]}'
+        sub_start = start + timedelta(days=rng.randrange(30))
+        sub_end = sub_start + timedelta(days=days + rng.randrange(30))
+        user_rows.append((
+            username, f'{first} {rng.choice(LAST_NAMES)}', f'9{i:09d}', str(100000 + i),
+            sub_start.isoformat(), sub_end.isoformat(), rng.randrange(2)
+        ))
+        for day in range(days):
+            if rng.random() < off_rate:
+                off_rows.append((username, (start + timedelta(days=day)).isoformat(), rng.choice(MEALS)))
+        for _ in range(payments_per_user):
+            paid = start + timedelta(days=rng.randrange(days))
+            payment_rows.append((username, paid.isoformat(), rng.choice([1, 7, 30])))
+
+    conn = sqlite3.connect(path)
+    conn.executemany('''
+        INSERT INTO Users (username, name, mobile, telegram_id, subscription_start, subscription_end, meal_credits)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', user_rows)
+    conn.executemany('INSERT INTO Off_Requests (username, date, meal) VALUES (?, ?, ?)', off_rows)
+    conn.executemany('INSERT INTO Payments (username, payment_date, days_added) VALUES (?, ?, ?)', payment_rows)
+    conn.executemany(
+        'INSERT OR REPLACE INTO Username_Counters (prefix, last_number) VALUES (?, ?)',
+        counters.items()
+    )
+    conn.commit()
+    conn.close()
+    return [row[0] for row in user_rows]
@@ -0,0 +1,346 @@
+"""
+Accelerated-clock simulation of a mess over a month or a year.
+
+Synthetic students mark meals off, plan trips ahead, cancel offs and renew
+their subscriptions day by day through database.py and the same cutoff
+checks the handlers use, while an injected Clock jumps through the
+simulated days. At the end the report shows how the database grew, how
+many Payments rows were written, query latencies on the final data and any
+credit or subscription anomalies:
+
+    python -m benchmarks.simulate --users 500 --period month
+    python -m benchmarks.simulate --users 500 --period year --json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import date, datetime, time as dtime, timedelta
+
+import database
+from benchmarks.database_bench import _summarize, _time
+from benchmarks.seed import FIRST_NAMES, LAST_NAMES
+from clock import Clock, get_clock, set_clock
+from config import AUTO_CONVERT_THRESHOLD, CREDITS_PER_DAY
+from handlers.admin_handlers import _render_offs
+from utils import check_thresholds
+
+PERIODS = {'month': 30, 'year': 365}
+PLAN_DAYS = 30  # Length of each subscription purchase
+
+
+class SimulatedTime:
+    """A time source the simulation moves forward explicitly."""
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def set(self, day, hour):
+        self.now = self.tz.localize(datetime.combine(day, dtime(hour))).timestamp()
+
+
+class Behaviour:
+    """Daily probabilities for the synthetic students."""
+
+    def __init__(self, off_rate=0.08, trip_rate=0.02, cancel_rate=0.05, renew_rate=0.9):
+        self.off_rate = off_rate  # Marks today's lunch or dinner off
+        self.trip_rate = trip_rate  # Plans 1-3 days fully off within the next week
+        self.cancel_rate = cancel_rate  # Cancels one of their upcoming offs
+        self.renew_rate = renew_rate  # Renews when the subscription runs out
+
+
+class Simulation:
+    """Drives synthetic students through the period one day at a time."""
+
+    def __init__(self, users, days, start, behaviour, rng):
+        self.days = days
+        self.start = start
+        self.behaviour = behaviour
+        self.rng = rng
+        self.time = SimulatedTime(get_clock().tz)
+        self.users = []
+        self.lapsed = set()
+        self.renewal_days = {}  # Days added by simulated /updatepayment, per user
+        self.growth = []
+        self.actions = {'offs': 0, 'rejected_offs': 0, 'cancels': 0, 'renewals': 0, 'lapses': 0}
+        self._create_users(users)
+
+    def _create_users(self, count):
+        # Subscriptions start on staggered days so renewals spread over the month
+        rows = []
+        for i in range(count):
+            first = self.rng.choice(FIRST_NAMES)
+            sub_start = self.start - timedelta(days=self.rng.randrange(PLAN_DAYS))
+            sub_end = sub_start + timedelta(days=PLAN_DAYS - 1)
+            rows.append((f'{first} {self.rng.choice(LAST_NAMES)}', f'9{i:09d}',
+                         sub_start.isoformat(), sub_end.isoformat(), []))
+        self.users = [username for username, *_ in database.import_users(rows)]
+
+    def _subscription_ends(self):
+        conn = database.connect()
+        ends = dict(conn.execute('SELECT username, subscription_end FROM Users').fetchall())
+        conn.close()
+        return ends
+
+    def _mark_off(self, username, date_str, meal):
+        # Same gate as /offmess: only meals whose cutoff has not passed are offered
+        _, lunch_allowed, dinner_allowed = check_thresholds(date_str)
+        allowed = {'lunch': lunch_allowed, 'dinner': dinner_allowed, 'both': lunch_allowed and dinner_allowed}
+        if not allowed[meal]:
+            return
+        success, _ = database.add_off_request(username, date_str, meal)
+        self.actions['offs' if success else 'rejected_offs'] += 1
+
+    def _cancel_off(self, username):
+        # Same filter as /canceloff: a 'both' off is cancellable while either meal is
+        clock = get_clock()
+        cancellable = [
+            off_id for off_id, date_str, meal in database.get_user_offs(username)
+            if any(clock.can_change(m, date_str) for m in (['lunch', 'dinner'] if meal == 'both' else [meal]))
+        ]
+        if cancellable:
+            database.delete_off_request(self.rng.choice(cancellable))
+            self.actions['cancels'] += 1
+
+    def _renew(self, username, current_end):
+        # Mirrors /updatepayment
+        new_end = (datetime.strptime(current_end, '%Y-%m-%d') + timedelta(days=PLAN_DAYS)).strftime('%Y-%m-%d')
+        with database.write_transaction() as cursor:
+            cursor.execute("UPDATE Users SET subscription_end = ? WHERE username = ?", (new_end, username))
+            cursor.execute(
+                "INSERT INTO Payments (username, payment_date, days_added) VALUES (?, ?, ?)",
+                (username, get_clock().today_str(), PLAN_DAYS)
+            )
+        self.renewal_days[username] = self.renewal_days.get(username, 0) + PLAN_DAYS
+        self.actions['renewals'] += 1
+
+    def run_day(self, day):
+        rng, behaviour = self.rng, self.behaviour
+        today = day.isoformat()
+        ends = self._subscription_ends()
+        active = [u for u in self.users if u not in self.lapsed and ends[u] >= today]
+
+        # Morning: offs for today's meals and trips planned for the coming week
+        self.time.set(day, 8)
+        for username in active:
+            if rng.random() < behaviour.off_rate:
+                self._mark_off(username, today, rng.choice(['lunch', 'dinner']))
+            if rng.random() < behaviour.trip_rate:
+                first = day + timedelta(days=rng.randint(1, 7))
+                for offset in range(rng.randint(1, 3)):
+                    self._mark_off(username, (first + timedelta(days=offset)).isoformat(), 'both')
+
+        # Afternoon, after the lunch cutoff: cancellations
+        self.time.set(day, 14)
+        for username in active:
+            if rng.random() < behaviour.cancel_rate:
+                self._cancel_off(username)
+
+        # Evening: subscriptions ending today are renewed or lapse
+        self.time.set(day, 20)
+        for username in active:
+            if ends[username] == today:
+                if rng.random() < behaviour.renew_rate:
+                    self._renew(username, ends[username])
+                else:
+                    self.lapsed.add(username)
+                    self.actions['lapses'] += 1
+
+        self.growth.append(self._snapshot(day, len(active)))
+
+    def _snapshot(self, day, active):
+        conn = database.connect()
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        offs = conn.execute('SELECT COUNT(*) FROM Off_Requests').fetchone()[0]
+        payments = conn.execute('SELECT COUNT(*) FROM Payments').fetchone()[0]
+        conn.close()
+        return {'date': day.isoformat(), 'db_bytes': page_count * page_size, 'off_rows': offs,
+                'payment_rows': payments, 'active_users': active}
+
+    def run(self):
+        for i in range(self.days):
+            self.run_day(self.start + timedelta(days=i))
+
+    ###########
+    # REPORTS #
+    ###########
+
+    def query_latencies(self, iterations):
+        """Time the user and owner read paths against the end-of-period data."""
+        users = self.users
+        last_day = self.start + timedelta(days=self.days - 1)
+        with database.write_transaction() as cursor:
+            cursor.executemany('UPDATE Users SET telegram_id = ? WHERE username = ?',
+                               [(str(100000 + i), username) for i, username in enumerate(users)])
+
+        def status_queries(username):
+            conn = database.connect()
+            conn.execute('SELECT name, subscription_start, subscription_end, meal_credits FROM Users '
+                         'WHERE username = ?', (username,)).fetchone()
+            conn.execute('SELECT date, meal FROM Off_Requests WHERE username = ? AND date >= ? ORDER BY date',
+                         (username, last_day.isoformat())).fetchall()
+            conn.close()
+
+        def table_read(sql):
+            conn = database.connect()
+            conn.execute(sql).fetchall()
+            conn.close()
+
+        rng = self.rng
+        timings = {
+            'check_mobile_by_telegram_id':
+                lambda: _time(database.check_mobile_by_telegram_id, str(100000 + rng.randrange(len(users)))),
+            'status_queries': lambda: _time(status_queries, rng.choice(users)),
+            'get_user_offs': lambda: _time(database.get_user_offs, rng.choice(users)),
+            'admin_viewoffs': lambda: _time(
+                _render_offs, (self.start + timedelta(days=rng.randrange(self.days))).isoformat()),
+            'admin_showdb_offs': lambda: _time(table_read, 'SELECT * FROM Off_Requests ORDER BY date DESC'),
+            'admin_showdb_payments': lambda: _time(table_read, 'SELECT * FROM Payments ORDER BY payment_date DESC'),
+        }
+        results = []
+        for name, step in timings.items():
+            step()
+            results.append(_summarize(name, len(users), [step() for _ in range(iterations)]))
+        return results
+
+    def anomalies(self):
+        """Check credits and subscriptions against what the students actually did."""
+        conn = database.connect()
+        users = {
+            username: (sub_start, sub_end, credits)
+            for username, sub_start, sub_end, credits in conn.execute(
+                'SELECT username, subscription_start, subscription_end, meal_credits FROM Users')
+        }
+        held = dict(conn.execute(
+            "SELECT username, SUM(CASE WHEN meal = 'both' THEN 2 ELSE 1 END) FROM Off_Requests GROUP BY username"
+        ).fetchall())
+        paid_days = dict(conn.execute('SELECT username, SUM(days_added) FROM Payments GROUP BY username').fetchall())
+        outside = conn.execute('''
+            SELECT o.username, o.date, o.meal FROM Off_Requests o JOIN Users u ON u.username = o.username
+            WHERE o.date < u.subscription_start OR o.date > u.subscription_end
+        ''').fetchall()
+        duplicates = conn.execute('''
+            SELECT username, date FROM Off_Requests GROUP BY username, date
+            HAVING COUNT(*) > 1 AND (SUM(meal = 'both') > 0 OR COUNT(DISTINCT meal) < COUNT(*))
+        ''').fetchall()
+        conn.close()
+
+        found = {
+            'negative_credits': [],
+            'unconverted_credits': [],
+            'credit_drift': [],
+            'offs_outside_subscription': [f'{u} {d} {m}' for u, d, m in outside],
+            'duplicate_offs': [f'{u} {d}' for u, d in duplicates],
+            'end_before_start': [],
+        }
+        for username, (sub_start, sub_end, credits) in users.items():
+            if credits < 0:
+                found['negative_credits'].append(f'{username} {credits}')
+            if credits >= max(AUTO_CONVERT_THRESHOLD, CREDITS_PER_DAY):
+                found['unconverted_credits'].append(f'{username} {credits}')
+            if sub_end < sub_start:
+                found['end_before_start'].append(f'{username} {sub_start} > {sub_end}')
+            # Every credit from an off still on record is either unspent or was converted into days
+            converted_days = paid_days.get(username, 0) - self.renewal_days.get(username, 0)
+            expected = held.get(username, 0)
+            actual = credits + converted_days * CREDITS_PER_DAY
+            if actual != expected:
+                found['credit_drift'].append(f'{username} holds {expected} credits of offs, accounted {actual}')
+        return found
+
+    def report(self, latency_iterations):
+        first, last = self.growth[0], self.growth[-1]
+        return {
+            'users': len(self.users),
+            'days': self.days,
+            'start': self.start.isoformat(),
+            'actions': self.actions,
+            'growth': {
+                'db_bytes': last['db_bytes'],
+                'db_bytes_per_day': round((last['db_bytes'] - first['db_bytes']) / max(1, self.days - 1)),
+                'off_rows': last['off_rows'],
+                'payment_rows': last['payment_rows'],
+                'active_users': last['active_users'],
+                'daily': self.growth,
+            },
+            'latencies': self.query_latencies(latency_iterations),
+            'anomalies': self.anomalies(),
+        }
+
+
+def _print_report(report):
+    growth = report['growth']
+    print(f"Simulated {report['users']} users for {report['days']} days from {report['start']}")
+    print("Actions: " + ', '.join(f"{key} {value}" for key, value in report['actions'].items()))
+
+    print(f"\n{'date':10} {'db KiB':>8} {'offs':>8} {'payments':>9} {'active':>7}")
+    daily = growth['daily']
+    step = 1 if len(daily) <= 31 else 7
+    for row in daily[::step] + ([daily[-1]] if (len(daily) - 1) % step else []):
+        print(f"{row['date']:10} {row['db_bytes'] / 1024:8.0f} {row['off_rows']:8d} "
+              f"{row['payment_rows']:9d} {row['active_users']:7d}")
+    print(f"Growth: {growth['db_bytes_per_day'] / 1024:.1f} KiB/day")
+
+    print(f"\n{'query':30} {'median us':>10} {'p95 us':>10}")
+    for result in report['latencies']:
+        print(f"{result['benchmark']:30} {result['median_us']:10.1f} {result['p95_us']:10.1f}")
+
+    print("\nAnomalies:")
+    for name, examples in report['anomalies'].items():
+        print(f"  {name}: {len(examples)}")
+        for example in examples[:3]:
+            print(f"    {example}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a month or a year of mess use on an accelerated clock")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--period', choices=PERIODS, default='month')
+    parser.add_argument('--days', type=int, help="Simulate this many days instead of --period")
+    parser.add_argument('--start', type=date.fromisoformat, help="First simulated day (default: today)")
+    parser.add_argument('--off-rate', type=float, default=0.08)
+    parser.add_argument('--trip-rate', type=float, default=0.02)
+    parser.add_argument('--cancel-rate', type=float, default=0.05)
+    parser.add_argument('--renew-rate', type=float, default=0.9)
+    parser.add_argument('--latency-iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help="Print the full report as JSON")
+    args = parser.parse_args()
+
+    behaviour = Behaviour(args.off_rate, args.trip_rate, args.cancel_rate, args.renew_rate)
+    days = args.days or PERIODS[args.period]
+    start = args.start or get_clock().today()
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            database.init_database()
+            simulation = Simulation(args.users, days, start, behaviour, random.Random(args.seed))
+            previous = set_clock(Clock(time_source=simulation.time))
+            try:
+                simulation.time.set(start, 0)
+                simulation.run()
+                report = simulation.report(args.latency_iterations)
+            finally:
+                set_clock(previous)
+        finally:
+            os.chdir(original_dir)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+    sys.exit(1 if any(report['anomalies'].values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
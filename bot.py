@@ -1,6 +1,10 @@
 from telegram import Update
-from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram.ext import (
+    Application, CommandHandler, ConversationHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
+)
 import os
+from datetime import time
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from database import init_database
 from handlers import (
@@ -15,25 +19,85 @@ from handlers import (
     canceloff, cancel_off_handler,
     
     # Admin handlers
-    add_user_command, list_users_command, view_offs_command, 
-    update_payment_command, broadcast_command, show_database_command,
-    update_credits_command, convert_all_credits_command
+    add_user_command, import_users_command, list_users_command, find_user_command, view_offs_command, 
+    update_payment_command, cache_stats_command, broadcast_command, show_database_command,
+    update_credits_command, convert_all_credits_command, closure_command, bulk_off_command, month_report_command,
+
+    # Backup handlers
+    backup_command, backup_job,
+
+    # Analytics handlers
+    trends_command, user_stats_command, forecast_command, snapshot_job, forecast_job,
+
+    # Reminder handlers
+    expiry_reminder_job,
+
+    # Diagnostics handlers
+    profile_command, slow_queries_command,
+
+    # Tenant handlers
+    route_tenant, add_mess_command, mess_command
 )
+from config import (
+    BACKUP_INTERVAL_HOURS, METRICS_HOST, METRICS_PORT, HEADCOUNT_HOST, HEADCOUNT_PORT, SNAPSHOT_HOUR, FORECAST_HOUR, TIMEZONE,
+    API_POOL_SIZE, API_KEEPALIVE_CONNECTIONS, API_KEEPALIVE_SECONDS, API_CONNECT_TIMEOUT, API_READ_TIMEOUT,
+    API_WRITE_TIMEOUT, API_POOL_TIMEOUT, POLL_TIMEOUT, POLL_KEEPALIVE_SECONDS, POLL_CONNECT_TIMEOUT,
+    POLL_READ_TIMEOUT, POLL_WRITE_TIMEOUT, POLL_POOL_TIMEOUT, EXPIRY_REMINDER_HOUR
+)
+from metrics import MeteredRequest, instrument_handlers, start_metrics_server
+from headcount_server import start_headcount_server
+from tenants import registry, use_tenant
+from shared_state import leader_only
+from outbox import start_sender, stop_sender, prune_outbox_job
+from idempotency import skip_duplicates, prune_results_job
 
 # Load environment variables
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 OWNER_TELEGRAM_ID = os.getenv('OWNER_TELEGRAM_ID')
 
-def main():
-    init_database()
-    application = Application.builder().token(BOT_TOKEN).build()
+def build_application(token=BOT_TOKEN, owner_telegram_id=OWNER_TELEGRAM_ID, base_url=None, persistence=None):
+    """Create the Application with every handler and job registered.
+    
+    base_url points the bot at a different Bot API server, e.g. a local fake for load tests.
+    Callers that start the application without run_polling() also call start_sender/stop_sender.
+    persistence keeps conversations outside the process, as scale-out workers do.
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        # Sends share a pool of kept-alive connections; polling holds one long-lived connection of its own
+        .request(MeteredRequest(
+            connection_pool_size=API_POOL_SIZE, keepalive_connections=API_KEEPALIVE_CONNECTIONS,
+            keepalive_seconds=API_KEEPALIVE_SECONDS, connect_timeout=API_CONNECT_TIMEOUT,
+            read_timeout=API_READ_TIMEOUT, write_timeout=API_WRITE_TIMEOUT, pool_timeout=API_POOL_TIMEOUT
+        ))
+        .get_updates_request(MeteredRequest(
+            connection_pool_size=1, keepalive_seconds=POLL_KEEPALIVE_SECONDS, connect_timeout=POLL_CONNECT_TIMEOUT,
+            read_timeout=POLL_READ_TIMEOUT, write_timeout=POLL_WRITE_TIMEOUT, pool_timeout=POLL_POOL_TIMEOUT
+        ))
+        # Deliver queued messages while the bot runs
+        .post_init(start_sender)
+        .post_stop(stop_sender)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if persistence:
+        builder = builder.persistence(persistence)
+    application = builder.build()
+    
+    # Store owner Telegram ID; they own the default mess and manage all others
+    application.bot_data['owner_telegram_id'] = owner_telegram_id
+    registry.configure(owner_telegram_id)
     
-    # Store owner Telegram ID
-    application.bot_data['owner_telegram_id'] = OWNER_TELEGRAM_ID
+    # Drop re-delivered updates and double taps, then route every update to the caller's mess
+    application.add_handler(TypeHandler(Update, skip_duplicates), group=-3)
+    application.add_handler(TypeHandler(Update, route_tenant), group=-1)
     
     # Conversation handler for /start
     start_conv = ConversationHandler(
+        name='start',
+        persistent=persistence is not None,
         entry_points=[CommandHandler('start', start)],
         states={
             MOBILE: [MessageHandler(filters.TEXT & ~filters.COMMAND, mobile_handler)],
@@ -43,6 +107,8 @@ def main():
     
     # Conversation handler for /offmess
     offmess_conv = ConversationHandler(
+        name='offmess',
+        persistent=persistence is not None,
         entry_points=[CommandHandler('offmess', offmess)],
         states={
             OFF_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, off_date_handler)],
@@ -54,6 +120,8 @@ def main():
     
     # Conversation handler for /canceloff
     canceloff_conv = ConversationHandler(
+        name='canceloff',
+        persistent=persistence is not None,
         entry_points=[CommandHandler('canceloff', canceloff)],
         states={
             CANCEL_OFF: [CallbackQueryHandler(cancel_off_handler)],
@@ -67,20 +135,84 @@ def main():
     application.add_handler(offmess_conv)
     application.add_handler(canceloff_conv)
     application.add_handler(CommandHandler('adduser', add_user_command))
+    application.add_handler(CommandHandler('importusers', import_users_command))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension('csv') & filters.CaptionRegex(r'^/importusers'),
+        import_users_command
+    ))
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('status', status_command))
     
     # Register admin handlers
     application.add_handler(CommandHandler('listusers', list_users_command))
+    application.add_handler(CommandHandler('finduser', find_user_command))
     application.add_handler(CommandHandler('viewoffs', view_offs_command))
     application.add_handler(CommandHandler('updatepayment', update_payment_command))
     application.add_handler(CommandHandler('updatecredits', update_credits_command))
     application.add_handler(CommandHandler('broadcast', broadcast_command))
     application.add_handler(CommandHandler('showdb', show_database_command))
+    application.add_handler(CommandHandler('cachestats', cache_stats_command))
     application.add_handler(CommandHandler('convertallcredits', convert_all_credits_command))
+    application.add_handler(CommandHandler('closure', closure_command))
+    application.add_handler(CommandHandler('bulkoff', bulk_off_command))
+    application.add_handler(CommandHandler('monthreport', month_report_command))
+    application.add_handler(CommandHandler('backup', backup_command))
+    application.add_handler(CommandHandler('trends', trends_command))
+    application.add_handler(CommandHandler('userstats', user_stats_command))
+    application.add_handler(CommandHandler('forecast', forecast_command))
+    application.add_handler(CommandHandler('profile', profile_command))
+    application.add_handler(CommandHandler('slowqueries', slow_queries_command))
+    application.add_handler(CommandHandler('mess', mess_command))
+    application.add_handler(CommandHandler('addmess', add_mess_command))
+    
+    # Scheduled jobs; with several workers only the holder of each job's lease runs it
+    backup_interval = BACKUP_INTERVAL_HOURS * 3600
+    application.job_queue.run_repeating(
+        leader_only(backup_job, 'backup', ttl=backup_interval * 1.5), interval=backup_interval, name='backup'
+    )
+    application.job_queue.run_daily(
+        leader_only(snapshot_job, 'snapshot', ttl=86400 * 1.5), time=time(SNAPSHOT_HOUR, tzinfo=ZoneInfo(TIMEZONE)),
+        name='snapshot'
+    )
+    application.job_queue.run_daily(
+        leader_only(forecast_job, 'forecast', ttl=86400 * 1.5), time=time(FORECAST_HOUR, tzinfo=ZoneInfo(TIMEZONE)),
+        name='forecast'
+    )
+    application.job_queue.run_daily(
+        leader_only(expiry_reminder_job, 'expiry_reminders', ttl=86400 * 1.5),
+        time=time(EXPIRY_REMINDER_HOUR, tzinfo=ZoneInfo(TIMEZONE)), name='expiry_reminders'
+    )
+    application.job_queue.run_repeating(
+        leader_only(prune_results_job, 'prune_update_results', ttl=3600 * 1.5), interval=3600, name='prune_update_results'
+    )
+    application.job_queue.run_repeating(
+        leader_only(prune_outbox_job, 'prune_outbox', ttl=3600 * 1.5), interval=3600, name='prune_outbox'
+    )
+    
+    # Time every handler
+    instrument_handlers(application)
+    return application
+
+def main():
+    application = build_application()
+    
+    # Create or migrate the database of every mess
+    for tenant in registry.tenants():
+        with use_tenant(tenant):
+            init_database()
+    
+    # Expose metrics locally
+    if METRICS_PORT:
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+        print(f"Metrics available at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    
+    # Serve headcounts to kitchen screens
+    if HEADCOUNT_PORT:
+        start_headcount_server(HEADCOUNT_HOST, HEADCOUNT_PORT)
+        print(f"Headcounts available at http://{HEADCOUNT_HOST}:{HEADCOUNT_PORT}/headcount/today")
     
     print("Bot is running...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.run_polling(allowed_updates=Update.ALL_TYPES, timeout=POLL_TIMEOUT)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Mess-local clock and meal cutoff checks.
+
+The timezone is resolved once and today's cutoff instants are computed once
+per day, so "can this meal still be changed" is a pair of integer comparisons.
+Pass a custom time source to Clock and install it with set_clock to drive the
+bot from a fixed or accelerated clock in tests and simulations.
+"""
+
+import time
+from datetime import date, datetime, time as dtime
+import pytz
+from config import TIMEZONE, LUNCH_CUTOFF_HOUR, DINNER_CUTOFF_HOUR
+
+MEALS = ('lunch', 'dinner')
+
+
+def format_hour(hour):
+    """Format a 24h hour as e.g. '11 AM' or '5 PM'."""
+    suffix = 'AM' if hour < 12 else 'PM'
+    return f"{hour % 12 or 12} {suffix}"
+
+
+class Clock:
+    """Current time in the mess timezone with precomputed daily cutoffs."""
+
+    def __init__(self, time_source=time.time, tz_name=TIMEZONE,
+                 lunch_cutoff_hour=LUNCH_CUTOFF_HOUR, dinner_cutoff_hour=DINNER_CUTOFF_HOUR):
+        self.tz = pytz.timezone(tz_name)
+        self.cutoff_hours = {'lunch': lunch_cutoff_hour, 'dinner': dinner_cutoff_hour}
+        self._time_source = time_source
+        self._day_start = 0
+        self._day_end = 0
+        self._day_ordinal = 0
+        self._day_str = ''
+        self._cutoffs = {}
+
+    def _local_instant(self, day, hour=0):
+        return int(self.tz.localize(datetime.combine(day, dtime(hour))).timestamp())
+
+    def _refresh(self):
+        """Return the current timestamp, recomputing today's instants when the day rolls over."""
+        ts = int(self._time_source())
+        if not self._day_start <= ts < self._day_end:
+            day = datetime.fromtimestamp(ts, self.tz).date()
+            self._day_start = self._local_instant(day)
+            self._day_end = self._local_instant(date.fromordinal(day.toordinal() + 1))
+            self._day_ordinal = day.toordinal()
+            self._day_str = day.strftime('%Y-%m-%d')
+            self._cutoffs = {meal: self._local_instant(day, hour) for meal, hour in self.cutoff_hours.items()}
+        return ts
+
+    def timestamp(self):
+        return self._time_source()
+
+    def now(self):
+        """Current time as an aware datetime in the mess timezone."""
+        return datetime.fromtimestamp(self._time_source(), self.tz)
+
+    def today(self):
+        self._refresh()
+        return date.fromordinal(self._day_ordinal)
+
+    def today_str(self):
+        self._refresh()
+        return self._day_str
+
+    def resolve_date(self, date_str):
+        """Return 'today' or a YYYY-MM-DD string as YYYY-MM-DD, or None if invalid."""
+        if date_str.strip().lower() == 'today':
+            return self.today_str()
+        try:
+            return datetime.strptime(date_str.strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            return None
+
+    def can_change(self, meal, date_str):
+        """Whether meal ('lunch', 'dinner' or 'both') on date_str can still be marked or cancelled."""
+        ts = self._refresh()
+        ordinal = date.fromisoformat(date_str).toordinal()
+        if ordinal != self._day_ordinal:
+            return ordinal > self._day_ordinal
+        meals = MEALS if meal == 'both' else (meal,)
+        return all(ts < self._cutoffs[m] for m in meals)
+
+    def cutoff_text(self):
+        """Human readable cutoffs, e.g. '11 AM for lunch, 5 PM for dinner'."""
+        return ', '.join(f"{format_hour(hour)} for {meal}" for meal, hour in self.cutoff_hours.items())
+
+
+_clock = Clock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """Install a different clock, e.g. a fixed or accelerated one, and return the previous one."""
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
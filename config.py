@@ -11,6 +11,108 @@ AUTO_CONVERT_THRESHOLD = 2  # Convert as soon as user has enough for 1 day
 # Maximum meal credits a user can accumulate before forced conversion
 MAX_CREDITS = 30  # Prevent users from accumulating too many credits
 
+# Timezone of the mess, used for dates and meal cutoffs
+TIMEZONE = 'Asia/Kolkata'
+
 # Time thresholds for marking meals off
 LUNCH_CUTOFF_HOUR = 11  # Cannot mark lunch off after 11 AM
 DINNER_CUTOFF_HOUR = 17  # Cannot mark dinner off after 5 PM
+
+# Multi-mess tenancy
+TENANTS_DB = 'tenants.db'  # Registry of messes, their owners and members
+TENANT_DB_DIR = 'messes'  # Directory holding the database file of each added mess
+TENANT_POOL_SIZE = 32  # Idle database connections kept open across all messes
+
+# Write transactions (ConnectionPool.transaction)
+DB_BUSY_TIMEOUT_MS = 1000  # How long one attempt waits for another writer to release the lock
+DB_WRITE_RETRIES = 5  # Further attempts before a write fails with "database is locked"
+DB_RETRY_BACKOFF_SECONDS = 0.05  # Pause before the first retry, doubled for each further one
+DB_WRITE_MAX_WAIT_MS = 2000  # Most a write waits for the lock over all its attempts; handlers block the event loop meanwhile
+
+# Outbox of outgoing messages, delivered by a background sender
+OUTBOX_BATCH_SIZE = 50  # Messages sent per mess in one round
+OUTBOX_POLL_SECONDS = 2  # How often the sender checks for due retries when nothing wakes it
+OUTBOX_MAX_ATTEMPTS = 8  # Attempts before a message is given up and marked failed
+OUTBOX_BACKOFF_SECONDS = 1  # Delay before the first retry, doubled for each further attempt
+OUTBOX_MAX_BACKOFF_SECONDS = 300  # Longest delay between attempts
+OUTBOX_CLAIM_SECONDS = 60  # After this, a message claimed by a sender that died is sent again
+OUTBOX_MAX_PER_SECOND = 25  # Most messages the sender sends in any second, across all messes
+OUTBOX_FAILED_RETENTION_DAYS = 7  # How long messages that could not be delivered stay in the table
+OUTBOX_BULK_PER_SECOND = 20  # Pace of broadcasts and reminders, below Telegram's limit of about 30 messages a second
+
+# Bot API connections: sends (replies and the outbox) and getUpdates polling use separate pools
+API_POOL_SIZE = 64  # Concurrent send connections, at least OUTBOX_BATCH_SIZE so a batch never waits for one
+API_KEEPALIVE_CONNECTIONS = 16  # Idle send connections kept open for reuse
+API_KEEPALIVE_SECONDS = 60  # How long an idle send connection is kept open
+API_CONNECT_TIMEOUT = 5.0  # Seconds to open a connection
+API_READ_TIMEOUT = 10.0  # Seconds to wait for a response
+API_WRITE_TIMEOUT = 10.0  # Seconds to send a request
+API_POOL_TIMEOUT = 5.0  # Seconds a send waits for a free connection
+POLL_TIMEOUT = 30  # Seconds Telegram holds a getUpdates call open while there are no updates
+POLL_KEEPALIVE_SECONDS = 120  # Longer than POLL_TIMEOUT, so polling keeps one connection
+POLL_CONNECT_TIMEOUT = 5.0
+POLL_READ_TIMEOUT = 10.0  # Added to POLL_TIMEOUT for each getUpdates call
+POLL_WRITE_TIMEOUT = 5.0
+POLL_POOL_TIMEOUT = 1.0
+
+# Longest date ranges owner commands accept in one command
+CLOSURE_MAX_DAYS = 62  # /closure
+BULK_OFF_MAX_DAYS = 62  # /bulkoff
+
+# Duplicate updates (re-deliveries and double taps) are answered from the first result
+IDEMPOTENCY_TTL_SECONDS = 600  # How long every handled update is remembered in memory
+IDEMPOTENCY_CACHE_SIZE = 10000  # Most updates remembered in memory
+IDEMPOTENCY_RETENTION_HOURS = 48  # How long results of state-changing updates are kept in STATE_DB
+
+# Number of rendered /viewoffs, /status and headcount endpoint responses kept in memory
+RESPONSE_CACHE_SIZE = 256
+
+# Local Prometheus metrics endpoint (set METRICS_PORT = None to disable)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+
+# Local read-only headcount endpoint for kitchen screens (set HEADCOUNT_PORT = None to disable)
+HEADCOUNT_HOST = '127.0.0.1'
+HEADCOUNT_PORT = 9109
+
+# On-demand profiling
+PROFILE_DIR = 'profiles'  # Where /profile writes pstats files
+PROFILE_MAX_SECONDS = 3600  # Longest timed profile session allowed
+
+# Statements slower than this get their query plan captured for /slowqueries
+SLOW_QUERY_MS = 50
+
+# Database backups
+BACKUP_DIR = 'backups'  # Directory where compressed snapshots are kept
+BACKUP_KEEP = 7  # Number of snapshots to keep before the oldest is deleted
+BACKUP_PAGES_PER_STEP = 64  # Pages copied per backup step (small steps keep writers unblocked)
+BACKUP_STEP_SLEEP = 0.005  # Seconds to pause between backup steps
+BACKUP_INTERVAL_HOURS = 24  # How often the scheduled backup job runs
+BACKUP_SEND_TO_OWNER = False  # Send each scheduled snapshot to the owner as a document
+
+# Nightly columnar attendance snapshot for /trends and /userstats
+SNAPSHOT_DIR = 'snapshots'  # Each mess keeps its snapshots in a subdirectory named after it
+SNAPSHOT_DAYS = 365  # Days of history in a snapshot, ending on the day it is built
+SNAPSHOT_HOUR = 23  # Mess-local hour of the nightly build, after the day's cutoffs
+
+# Headcount forecast behind /forecast, retrained nightly
+FORECAST_DAYS = 14  # Days ahead precomputed, and the most /forecast shows
+FORECAST_HISTORY_DAYS = 180  # History the first training reads
+FORECAST_DECAY = 0.99  # Weight kept per day of age, so habits from months ago fade
+FORECAST_PRIOR_WEIGHT = 4  # Meals of mess-wide behaviour assumed for a user with no history
+FORECAST_HOUR = 23  # Mess-local hour of the nightly training, after the dinner cutoff
+
+# Daily subscription expiry reminders
+EXPIRY_REMINDER_DAYS = 3  # Users are reminded from this many days before their subscription ends
+EXPIRY_GRACE_DAYS = 7  # ...until this many days after it ended
+EXPIRY_REMINDER_HOUR = 9  # Mess-local hour the reminders and the owner's digest go out
+
+# Scale-out mode (python scaleout.py router|worker)
+STATE_DB = 'state.db'  # Conversations, job leases and cache invalidations shared by workers
+STATE_FLUSH_SECONDS = 5  # How often workers write conversation state to STATE_DB
+INVALIDATION_RETENTION_SECONDS = 3600  # How long invalidations are kept for workers to apply
+WEBHOOK_HOST = '0.0.0.0'  # Where the router receives Telegram's webhook calls
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/telegram'
+WORKER_HOST = '127.0.0.1'  # Worker i listens on WORKER_HOST:WORKER_BASE_PORT + i
+WORKER_BASE_PORT = 8600
@@ -1,10 +1,29 @@
+import json
+import re
 import sqlite3
 from datetime import datetime, timedelta
+from clock import get_clock
 from config import CREDITS_PER_DAY, AUTO_CONVERT_THRESHOLD, MAX_CREDITS
+from user_index import index_user
+from response_cache import invalidate_offs, invalidate_user, invalidate_mess
+from metrics import track_db
+from tenants import get_tenant, pool
+from outbox import enqueue, enqueue_many
 
+def connect():
+    """Open a connection to the current mess's database, reusing a pooled one when available."""
+    return pool.acquire(get_tenant().db_path)
+
+def write_transaction():
+    """Write transaction on the current mess's database; use as `with write_transaction() as cursor:`."""
+    return pool.transaction(get_tenant().db_path)
+
+@track_db
 def init_database():
-    conn = sqlite3.connect('mess.db')
-    cursor = conn.cursor()
+    with write_transaction() as cursor:
+        _create_tables(cursor)
+
+def _create_tables(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS Users (
             username TEXT PRIMARY KEY,
@@ -22,6 +41,10 @@ def init_database():
     columns = [column[1] for column in cursor.fetchall()]
     if 'meal_credits' not in columns:
         cursor.execute("ALTER TABLE Users ADD COLUMN meal_credits INTEGER DEFAULT 0")
+    # Day the user was last reminded that their subscription is ending
+    if 'expiry_reminded_on' not in columns:
+        cursor.execute("ALTER TABLE Users ADD COLUMN expiry_reminded_on DATE")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON Users (subscription_end)")
     
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS Off_Requests (
@@ -38,155 +61,629 @@ def init_database():
             username TEXT NOT NULL,
             payment_date DATE NOT NULL,
             days_added INTEGER NOT NULL,
+            source TEXT NOT NULL DEFAULT 'payment',
             FOREIGN KEY (username) REFERENCES Users(username)
         )
     ''')
-    conn.commit()
-    conn.close()
+    
+    # Tell converted credits apart from purchased days ('payment' or 'credits')
+    cursor.execute("PRAGMA table_info(Payments)")
+    if 'source' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE Payments ADD COLUMN source TEXT NOT NULL DEFAULT 'payment'")
+    
+    # Meals the mess is closed for; subscribers are credited when a closure is added
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Closures (
+            date DATE NOT NULL,
+            meal TEXT NOT NULL,
+            PRIMARY KEY (date, meal)
+        )
+    ''')
+    # Closed meals each user was credited for, which the monthly settlement counts
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Closure_Credits'")
+    backfill = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Closure_Credits (
+            username TEXT NOT NULL,
+            date DATE NOT NULL,
+            meal TEXT NOT NULL,
+            PRIMARY KEY (date, meal, username)
+        )
+    ''')
+    if backfill:
+        # Earlier closures were not recorded per user; the best estimate is today's subscriptions
+        cursor.execute('''
+            INSERT INTO Closure_Credits (username, date, meal)
+            SELECT u.username, c.date, c.meal
+            FROM Closures c
+            JOIN Users u ON c.date BETWEEN u.subscription_start AND u.subscription_end
+            WHERE NOT EXISTS (
+                SELECT 1 FROM Off_Requests o
+                WHERE o.username = u.username AND o.date = c.date AND (o.meal = c.meal OR o.meal = 'both')
+            )
+        ''')
+    
+    # Demand forecast (see forecast.py): decayed off counts per user, weekday and meal,
+    # the precomputed headcounts /forecast serves, and how far training has got
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Forecast_Stats (
+            username TEXT NOT NULL,
+            weekday INTEGER NOT NULL,
+            meal TEXT NOT NULL,
+            served REAL NOT NULL,
+            offs REAL NOT NULL,
+            PRIMARY KEY (username, weekday, meal)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Forecasts (
+            date DATE NOT NULL,
+            meal TEXT NOT NULL,
+            active INTEGER NOT NULL,
+            filed_offs INTEGER NOT NULL,
+            expected REAL,
+            PRIMARY KEY (date, meal)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Forecast_State (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            trained_through DATE NOT NULL,
+            built_at REAL NOT NULL
+        )
+    ''')
+    
+    # Highest number handed out per username prefix, so new usernames need no scans
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Username_Counters (
+            prefix TEXT PRIMARY KEY,
+            last_number INTEGER NOT NULL
+        )
+    ''')
+    # Messages waiting for the background sender (see outbox.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            edit_message_id INTEGER,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_until REAL,
+            failed_at REAL,
+            last_error TEXT,
+            batch_id INTEGER
+        )
+    ''')
+    cursor.execute("PRAGMA table_info(Outbox)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'edit_message_id' not in columns:
+        cursor.execute("ALTER TABLE Outbox ADD COLUMN edit_message_id INTEGER")
+    if 'batch_id' not in columns:
+        cursor.execute("ALTER TABLE Outbox ADD COLUMN batch_id INTEGER")
+    # Bulk sends whose undelivered messages are reported to report_chat_id once all are done
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Outbox_Batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_chat_id TEXT NOT NULL,
+            label TEXT NOT NULL,
+            total INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_chat ON Outbox (chat_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_off_requests_date ON Off_Requests (date, username)")
+    cursor.execute("SELECT COUNT(*) FROM Username_Counters")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("SELECT username FROM Users")
+        counters = _username_numbers(row[0] for row in cursor.fetchall())
+        cursor.executemany(
+            "INSERT INTO Username_Counters (prefix, last_number) VALUES (?, ?)",
+            counters.items()
+        )
 
+@track_db
 def add_user(name, mobile, subscription_start, subscription_end, off_dates=None):
     """Add a user and optional off dates."""
     first_name = name.split()[0]
-    cursor = sqlite3.connect('mess.db').cursor()
-    cursor.execute('SELECT COUNT(*) FROM Users WHERE username LIKE ?', (f'@%{first_name}%',))
-    count = cursor.fetchone()[0]
-    username = f'@{first_name}{count + 1}'
     
     try:
-        cursor.execute('''
-            INSERT INTO Users (username, name, mobile, subscription_start, subscription_end, meal_credits)
-            VALUES (?, ?, ?, ?, ?, 0)
-        ''', (username, name, mobile, subscription_start, subscription_end))
-        
-        if off_dates:
-            for date, meal in off_dates:
-                cursor.execute('''
-                    INSERT INTO Off_Requests (username, date, meal)
-                    VALUES (?, ?, ?)
-                ''', (username, date, meal))
-                
-                # Add meal credits for initial off dates
-                meal_credit = 2 if meal == 'both' else 1
-                cursor.execute('''
-                    UPDATE Users SET meal_credits = meal_credits + ?
-                    WHERE username = ?
-                ''', (meal_credit, username))
-        
-        cursor.connection.commit()
-        return username
+        with write_transaction() as cursor:
+            username = _allocate_username(cursor, first_name)
+            cursor.execute('''
+                INSERT INTO Users (username, name, mobile, subscription_start, subscription_end, meal_credits)
+                VALUES (?, ?, ?, ?, ?, 0)
+            ''', (username, name, mobile, subscription_start, subscription_end))
+            
+            if off_dates:
+                for date, meal in off_dates:
+                    cursor.execute('''
+                        INSERT INTO Off_Requests (username, date, meal)
+                        VALUES (?, ?, ?)
+                    ''', (username, date, meal))
+                    
+                    # Add meal credits for initial off dates
+                    meal_credit = 2 if meal == 'both' else 1
+                    cursor.execute('''
+                        UPDATE Users SET meal_credits = meal_credits + ?
+                        WHERE username = ?
+                    ''', (meal_credit, username))
     except sqlite3.IntegrityError:
-        cursor.connection.close()
         return None
-    finally:
-        cursor.connection.close()
+    
+    index_user(username, name)
+    invalidate_user(username)
+    for date, _ in off_dates or []:
+        invalidate_offs(username, date)
+    return username
+
+def _username_numbers(usernames):
+    """Return the highest number used per username prefix, e.g. {'John': 3}."""
+    counters = {}
+    for username in usernames:
+        match = re.fullmatch(r'@(.+?)(\d+)', username)
+        if match:
+            prefix, number = match.group(1), int(match.group(2))
+            counters[prefix] = max(counters.get(prefix, 0), number)
+    return counters
+
+def _allocate_username(cursor, first_name):
+    """Reserve the next free username for first_name from Username_Counters."""
+    while True:
+        cursor.execute('''
+            INSERT INTO Username_Counters (prefix, last_number) VALUES (?, 1)
+            ON CONFLICT(prefix) DO UPDATE SET last_number = last_number + 1
+            RETURNING last_number
+        ''', (first_name,))
+        username = f'@{first_name}{cursor.fetchone()[0]}'
+        # Skip numbers taken by usernames that were created outside the counter
+        cursor.execute('SELECT 1 FROM Users WHERE username = ?', (username,))
+        if not cursor.fetchone():
+            return username
+
+def _load_username_counters(cursor):
+    """Load the username counters and the set of taken usernames into memory."""
+    cursor.execute('SELECT prefix, last_number FROM Username_Counters')
+    counters = dict(cursor.fetchall())
+    cursor.execute('SELECT username FROM Users')
+    taken = {row[0] for row in cursor.fetchall()}
+    return counters, taken
+
+def _next_username(first_name, counters, taken):
+    """Allocate the next free username for first_name and record it in the index."""
+    number = counters.get(first_name, 0) + 1
+    while f'@{first_name}{number}' in taken:
+        number += 1
+    username = f'@{first_name}{number}'
+    counters[first_name] = number
+    taken.add(username)
+    return username
 
+@track_db
+def import_users(users):
+    """Add many users with their off dates in a single transaction.
+
+    users is an iterable of (name, mobile, subscription_start, subscription_end, off_dates).
+    Off dates follow the add_off_request rule that closed meals cannot be marked off.
+    Returns one (username, error, skipped off dates) triple per user, with exactly one of
+    username and error set.
+    """
+    users = list(users)
+    off_days = {date for *_, off_dates in users for date, _ in off_dates or []}
+    # The counters and mobiles are read under the write lock so concurrent imports cannot collide
+    with write_transaction() as cursor:
+        counters, taken = _load_username_counters(cursor)
+        cursor.execute('SELECT mobile FROM Users')
+        mobiles = {row[0] for row in cursor.fetchall()}
+        cursor.execute('SELECT date, meal FROM Closures WHERE date IN (SELECT value FROM json_each(?))',
+                       (json.dumps(sorted(off_days)),))
+        closed = {}
+        for date, closed_meal in cursor.fetchall():
+            closed.setdefault(date, set()).add(closed_meal)
+
+        results = []
+        user_rows = []
+        off_rows = []
+        for name, mobile, subscription_start, subscription_end, off_dates in users:
+            if mobile in mobiles:
+                results.append((None, "Mobile number already exists.", []))
+                continue
+            mobiles.add(mobile)
+            username = _next_username(name.split()[0], counters, taken)
+
+            # Credits for initial off dates are written with the user row instead of separate updates
+            skipped = [(date, meal) for date, meal in off_dates or []
+                       if meal in closed.get(date, ()) or (meal == 'both' and date in closed)]
+            off_dates = [off for off in off_dates or [] if off not in skipped]
+            meal_credits = sum(2 if meal == 'both' else 1 for _, meal in off_dates)
+            user_rows.append((username, name, mobile, subscription_start, subscription_end, meal_credits))
+            off_rows.extend((username, date, meal) for date, meal in off_dates)
+            results.append((username, None, skipped))
+
+        cursor.executemany('''
+            INSERT INTO Users (username, name, mobile, subscription_start, subscription_end, meal_credits)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', user_rows)
+        cursor.executemany('''
+            INSERT INTO Off_Requests (username, date, meal)
+            VALUES (?, ?, ?)
+        ''', off_rows)
+        cursor.executemany('''
+            INSERT INTO Username_Counters (prefix, last_number) VALUES (?, ?)
+            ON CONFLICT(prefix) DO UPDATE SET last_number = MAX(last_number, excluded.last_number)
+        ''', counters.items())
+    for username, name, *_ in user_rows:
+        index_user(username, name)
+    if user_rows:
+        # New subscribers change the headcount of every date they cover
+        invalidate_mess()
+    return results
+
+@track_db
 def check_mobile(mobile):
-    conn = sqlite3.connect('mess.db')
+    conn = connect()
     cursor = conn.cursor()
     cursor.execute('SELECT username, name, telegram_id FROM Users WHERE mobile = ?', (mobile,))
     user = cursor.fetchone()
     conn.close()
     return user
 
+@track_db
 def check_mobile_by_telegram_id(telegram_id):
-    conn = sqlite3.connect('mess.db')
+    conn = connect()
     cursor = conn.cursor()
     cursor.execute('SELECT username, name, telegram_id FROM Users WHERE telegram_id = ?', (telegram_id,))
     user = cursor.fetchone()
     conn.close()
     return user
 
-def update_telegram_id(mobile, telegram_id):
-    conn = sqlite3.connect('mess.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE Users SET telegram_id = ? WHERE mobile = ?', (telegram_id, mobile))
-    conn.commit()
-    conn.close()
+@track_db
+def update_telegram_id(mobile, telegram_id, notify=None):
+    """Link a Telegram account; notify is an optional (chat_id, text) queued in the same transaction."""
+    with write_transaction() as cursor:
+        cursor.execute('UPDATE Users SET telegram_id = ? WHERE mobile = ?', (telegram_id, mobile))
+        if notify:
+            enqueue(cursor, *notify)
 
-def add_off_request(username, date, meal):
-    """Add an off request for a user's meal"""
-    conn = sqlite3.connect('mess.db')
-    cursor = conn.cursor()
-    
-    # Check if the user already has this meal off on this date
-    cursor.execute(
-        "SELECT id FROM Off_Requests WHERE username = ? AND date = ? AND (meal = ? OR meal = 'both')",
-        (username, date, meal)
-    )
-    existing = cursor.fetchone()
-    
-    if existing:
-        conn.close()
-        return False, "You already have this meal marked as off for this date."
+@track_db
+def add_off_request(username, date, meal, notify=None):
+    """Add an off request for a user's meal.
+
+    notify is an optional (chat_id, text[, parse_mode, edit_message_id]) queued in the outbox
+    in the same transaction, so the confirmation is sent if and only if the request was added.
+    """
+    # The duplicate check and the insert run under one write lock, so double taps cannot both succeed
+    with write_transaction() as cursor:
+        # Check if the user already has this meal off on this date
+        cursor.execute(
+            "SELECT id FROM Off_Requests WHERE username = ? AND date = ? AND (meal = ? OR meal = 'both')",
+            (username, date, meal)
+        )
+        existing = cursor.fetchone()
     
-    # If user has one meal off and is requesting both, update existing record
-    credits_to_add = 0
-    if meal == 'both':
+        if existing:
+            return False, "You already have this meal marked as off for this date."
+        
+        # Closed meals are credited to every subscriber already
         cursor.execute(
-            "SELECT id, meal FROM Off_Requests WHERE username = ? AND date = ?",
-            (username, date)
+            "SELECT meal FROM Closures WHERE date = ? AND (meal = ? OR ? = 'both')",
+            (date, meal, meal)
         )
-        existing_meal = cursor.fetchone()
-        if existing_meal:
-            # Only add 1 more credit since they already have 1 meal off
-            credits_to_add = 1
-            # Delete the existing record as we'll create a new 'both' record
-            cursor.execute("DELETE FROM Off_Requests WHERE id = ?", (existing_meal[0],))
+        closed = cursor.fetchone()
+        if closed:
+            return False, f"The mess is closed for {closed[0]} on this date."
+    
+        # If user has one meal off and is requesting both, update existing record
+        credits_to_add = 0
+        if meal == 'both':
+            cursor.execute(
+                "SELECT id, meal FROM Off_Requests WHERE username = ? AND date = ?",
+                (username, date)
+            )
+            existing_meal = cursor.fetchone()
+            if existing_meal:
+                # Only add 1 more credit since they already have 1 meal off
+                credits_to_add = 1
+                # Delete the existing record as we'll create a new 'both' record
+                cursor.execute("DELETE FROM Off_Requests WHERE id = ?", (existing_meal[0],))
+            else:
+                credits_to_add = 2  # Both meals = 2 credits
         else:
-            credits_to_add = 2  # Both meals = 2 credits
-    else:
-        credits_to_add = 1  # Single meal = 1 credit
+            credits_to_add = 1  # Single meal = 1 credit
     
-    # Add the off request
-    cursor.execute(
-        "INSERT INTO Off_Requests (username, date, meal) VALUES (?, ?, ?)",
-        (username, date, meal)
-    )
+        # Add the off request
+        cursor.execute(
+            "INSERT INTO Off_Requests (username, date, meal) VALUES (?, ?, ?)",
+            (username, date, meal)
+        )
     
-    # Add meal credits
-    cursor.execute(
-        "UPDATE Users SET meal_credits = meal_credits + ? WHERE username = ?",
-        (credits_to_add, username)
-    )
+        # Add meal credits
+        cursor.execute(
+            "UPDATE Users SET meal_credits = meal_credits + ? WHERE username = ?",
+            (credits_to_add, username)
+        )
     
-    # After adding credits, check if we should auto-convert to subscription days
-    auto_convert_credits_to_days(cursor, username)
+        # After adding credits, check if we should auto-convert to subscription days
+        converted = auto_convert_credits_to_days(cursor, username)
+        if notify:
+            enqueue(cursor, *notify)
     
-    conn.commit()
-    conn.close()
+    invalidate_offs(username, date)
+    if converted:
+        # The subscription grew, which changes the headcount of the added days
+        invalidate_user(username)
     return True, "Meal off request added successfully."
 
+@track_db
 def get_user_offs(username):
     """Fetch all off requests for a user."""
-    conn = sqlite3.connect('mess.db')
+    conn = connect()
     cursor = conn.cursor()
     cursor.execute('SELECT id, date, meal FROM Off_Requests WHERE username = ?', (username,))
     offs = cursor.fetchall()
     conn.close()
     return offs
 
-def delete_off_request(off_id):
-    """Delete an off request by ID."""
-    conn = sqlite3.connect('mess.db')
-    cursor = conn.cursor()
+@track_db
+def delete_off_request(off_id, notify=None):
+    """Delete an off request by ID; notify is an optional (chat_id, text[, parse_mode, edit_message_id])
+    queued in the same transaction."""
+    with write_transaction() as cursor:
+        # First get the meal type so we know how many credits to remove
+        cursor.execute("SELECT username, date, meal FROM Off_Requests WHERE id = ?", (off_id,))
+        result = cursor.fetchone()
+        if result:
+            username, date, meal = result
+            credits_to_deduct = 2 if meal == 'both' else 1
+        
+            # Deduct the credits
+            cursor.execute(
+                "UPDATE Users SET meal_credits = MAX(0, meal_credits - ?) WHERE username = ?",
+                (credits_to_deduct, username)
+            )
+    
+        # Delete the off request
+        cursor.execute('DELETE FROM Off_Requests WHERE id = ?', (off_id,))
+        if notify:
+            enqueue(cursor, *notify)
     
-    # First get the meal type so we know how many credits to remove
-    cursor.execute("SELECT username, meal FROM Off_Requests WHERE id = ?", (off_id,))
-    result = cursor.fetchone()
     if result:
-        username, meal = result
-        credits_to_deduct = 2 if meal == 'both' else 1
+        invalidate_offs(username, date)
+
+@track_db
+def add_bulk_off_requests(usernames, start_date, end_date, meal, notify=None, confirm=None):
+    """Mark meal off on every date from start_date to end_date for many users in one transaction.
+
+    usernames is a list of usernames, or None for every user subscribed during the range.
+    Each user-day follows the add_off_request rules: a meal already off or closed is skipped,
+    and 'both' replaces a single-meal off for the missing credit. Credits are converted to
+    days once per user at the end. notify is an optional text queued in the outbox for every
+    user who got an off. confirm is an optional function of the result returning a
+    (chat_id, text[, parse_mode, edit_message_id]) queued in the same transaction. Returns
+    (users marked, offs added, credits added, days added, skipped (username, date, reason)
+    triples, unknown usernames).
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    days = (datetime.strptime(end_date, '%Y-%m-%d') - start).days + 1
+    dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    
+    with write_transaction() as cursor:
+        if usernames is None:
+            cursor.execute(
+                'SELECT username, telegram_id FROM Users WHERE subscription_start <= ? AND subscription_end >= ?',
+                (end_date, start_date)
+            )
+        else:
+            cursor.execute(
+                'SELECT username, telegram_id FROM Users WHERE lower(username) IN (SELECT lower(value) FROM json_each(?))',
+                (json.dumps(usernames),)
+            )
+        users = dict(cursor.fetchall())
+        found = {username.lower() for username in users}
+        unknown = [username for username in usernames or [] if username.lower() not in found]
         
-        # Deduct the credits
-        cursor.execute(
-            "UPDATE Users SET meal_credits = MAX(0, meal_credits - ?) WHERE username = ?",
-            (credits_to_deduct, username)
-        )
+        # Everything the rules look at, read once for the whole range
+        cursor.execute('SELECT id, username, date, meal FROM Off_Requests WHERE date BETWEEN ? AND ?', (start_date, end_date))
+        held = {}
+        for off_id, username, date, off_meal in cursor.fetchall():
+            if username in users:
+                held.setdefault((username, date), {})[off_meal] = off_id
+        cursor.execute('SELECT date, meal FROM Closures WHERE date BETWEEN ? AND ?', (start_date, end_date))
+        closed = {}
+        for date, closed_meal in cursor.fetchall():
+            closed.setdefault(date, set()).add(closed_meal)
+        
+        replaced, inserts, credits, skipped = [], [], {}, []
+        for username in users:
+            for date in dates:
+                offs = held.get((username, date), {})
+                if meal in offs or 'both' in offs or (meal == 'both' and len(offs) == 2):
+                    skipped.append((username, date, "already off"))
+                    continue
+                closed_meals = closed.get(date, set())
+                if meal in closed_meals or (meal == 'both' and closed_meals):
+                    skipped.append((username, date, "mess closed"))
+                    continue
+                if meal == 'both':
+                    # A single meal already off was credited; the 'both' row replaces it
+                    replaced.extend((off_id,) for off_id in offs.values())
+                    earned = 2 - len(offs)
+                else:
+                    earned = 1
+                inserts.append((username, date, meal))
+                credits[username] = credits.get(username, 0) + earned
+        
+        cursor.executemany('DELETE FROM Off_Requests WHERE id = ?', replaced)
+        cursor.executemany('INSERT INTO Off_Requests (username, date, meal) VALUES (?, ?, ?)', inserts)
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS Credited_Users (username TEXT PRIMARY KEY, credits INTEGER)')
+        cursor.execute('DELETE FROM temp.Credited_Users')
+        cursor.executemany('INSERT INTO temp.Credited_Users (username, credits) VALUES (?, ?)', credits.items())
+        cursor.execute('''
+            UPDATE Users SET meal_credits = COALESCE(meal_credits, 0) + cc.credits
+            FROM temp.Credited_Users cc WHERE Users.username = cc.username
+        ''')
+        days_added = _auto_convert_credited(cursor)
+        if notify:
+            enqueue_many(cursor, [(users[username], notify) for username in credits if users[username]])
+        result = len(credits), len(inserts), sum(credits.values()), days_added, skipped, unknown
+        if confirm:
+            enqueue(cursor, *confirm(result))
+    
+    if inserts:
+        invalidate_mess()
+    return result
+
+@track_db
+def add_closure(start_date, end_date, meal='both'):
+    """Close the mess for meal ('lunch', 'dinner' or 'both') on every date from start_date to end_date.
+
+    Each subscriber active on a newly closed meal gets one credit for it, unless an off
+    request already credited them, and credits are converted to days under the
+    auto_convert_credits_to_days rules. Meals closed before are skipped, so repeating a
+    closure credits nothing. Each credit is recorded in Closure_Credits. Returns (meals closed,
+    users credited, credits added, days added).
+    """
+    meals = ['lunch', 'dinner'] if meal == 'both' else [meal]
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    days = (datetime.strptime(end_date, '%Y-%m-%d') - start).days + 1
+    closures = [((start + timedelta(days=i)).strftime('%Y-%m-%d'), m) for i in range(days) for m in meals]
+    
+    with write_transaction() as cursor:
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO Closures (date, meal) VALUES {", ".join(["(?, ?)"] * len(closures))}
+            RETURNING date, meal
+        ''', [value for closure in closures for value in closure])
+        new_closures = cursor.fetchall()
+        if not new_closures:
+            return 0, 0, 0, 0
+        
+        # One credit per subscriber and newly closed meal, computed for all users at once
+        new_values = ", ".join(["(?, ?)"] * len(new_closures))
+        params = [value for closure in new_closures for value in closure]
+        cursor.execute(f'''
+            WITH New_Closures (date, meal) AS (VALUES {new_values})
+            INSERT INTO Closure_Credits (username, date, meal)
+            SELECT u.username, c.date, c.meal
+            FROM Users u
+            JOIN New_Closures c ON c.date BETWEEN u.subscription_start AND u.subscription_end
+            WHERE NOT EXISTS (
+                SELECT 1 FROM Off_Requests o
+                WHERE o.username = u.username AND o.date = c.date AND (o.meal = c.meal OR o.meal = 'both')
+            )
+        ''', params)
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS Credited_Users (username TEXT PRIMARY KEY, credits INTEGER)')
+        cursor.execute('DELETE FROM temp.Credited_Users')
+        cursor.execute(f'''
+            WITH New_Closures (date, meal) AS (VALUES {new_values})
+            INSERT INTO temp.Credited_Users (username, credits)
+            SELECT cc.username, COUNT(*)
+            FROM Closure_Credits cc JOIN New_Closures c ON c.date = cc.date AND c.meal = cc.meal
+            GROUP BY cc.username
+        ''', params)
+        cursor.execute('''
+            UPDATE Users SET meal_credits = COALESCE(meal_credits, 0) + cc.credits
+            FROM temp.Credited_Users cc WHERE Users.username = cc.username
+        ''')
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(credits), 0) FROM temp.Credited_Users')
+        users_credited, credits_added = cursor.fetchone()
+        days_added = _auto_convert_credited(cursor)
     
-    # Delete the off request
-    cursor.execute('DELETE FROM Off_Requests WHERE id = ?', (off_id,))
-    conn.commit()
+    invalidate_mess()
+    return len(new_closures), users_credited, credits_added, days_added
+
+def _auto_convert_credited(cursor):
+    """Apply the auto_convert_credits_to_days rules to every user in temp.Credited_Users at once."""
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS Closure_Conversions (username TEXT PRIMARY KEY, days INTEGER)')
+    cursor.execute('DELETE FROM temp.Closure_Conversions')
+    cursor.execute('''
+        INSERT INTO temp.Closure_Conversions (username, days)
+        SELECT username,
+               CASE WHEN meal_credits > :max_credits THEN meal_credits / :per_day
+                    ELSE MAX(1, (meal_credits - (:threshold - 1)) / :per_day) END
+        FROM Users
+        WHERE username IN (SELECT username FROM temp.Credited_Users)
+          AND meal_credits >= :threshold AND meal_credits >= :per_day
+    ''', {'max_credits': MAX_CREDITS, 'per_day': CREDITS_PER_DAY, 'threshold': AUTO_CONVERT_THRESHOLD})
+    today = get_clock().today_str()
+    cursor.execute('''
+        UPDATE Users
+        SET subscription_end = date(COALESCE(Users.subscription_end, :today), '+' || cc.days || ' days'),
+            meal_credits = meal_credits - cc.days * :per_day
+        FROM temp.Closure_Conversions cc WHERE Users.username = cc.username
+    ''', {'today': today, 'per_day': CREDITS_PER_DAY})
+    cursor.execute('''
+        INSERT INTO Payments (username, payment_date, days_added, source)
+        SELECT username, ?, days, 'credits' FROM temp.Closure_Conversions
+    ''', (today,))
+    cursor.execute('SELECT COALESCE(SUM(days), 0) FROM temp.Closure_Conversions')
+    return cursor.fetchone()[0]
+
+@track_db
+def get_closures(start_date, end_date=None):
+    """Return the closed (date, meal) pairs from start_date (to end_date), in date order."""
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT date, meal FROM Closures WHERE date >= ? AND date <= ? ORDER BY date, meal',
+        (start_date, end_date or '9999-12-31')
+    )
+    closures = cursor.fetchall()
+    conn.close()
+    return closures
+
+@track_db
+def get_headcount(date):
+    """Return {'lunch': n, 'dinner': n} of active subscribers eating on date; None for a closed meal."""
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        WITH Active AS (
+            SELECT username FROM Users WHERE subscription_start <= :date AND subscription_end >= :date
+        ), Offs AS (
+            SELECT username, MAX(meal IN ('lunch', 'both')) AS lunch, MAX(meal IN ('dinner', 'both')) AS dinner
+            FROM Off_Requests WHERE date = :date GROUP BY username
+        )
+        SELECT COUNT(*) - COALESCE(SUM(Offs.lunch), 0), COUNT(*) - COALESCE(SUM(Offs.dinner), 0)
+        FROM Active LEFT JOIN Offs USING (username)
+    ''', {'date': date})
+    lunch, dinner = cursor.fetchone()
+    cursor.execute('SELECT meal FROM Closures WHERE date = ?', (date,))
+    closed = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return {
+        'lunch': None if 'lunch' in closed else lunch,
+        'dinner': None if 'dinner' in closed else dinner,
+    }
+
+@track_db
+def get_offs_on(date):
+    """Return (username, name, meal) of every off request on date, as /viewoffs lists them."""
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT DISTINCT o.username, u.name, o.meal
+        FROM Off_Requests o
+        JOIN Users u ON o.username = u.username
+        WHERE o.date = ?
+    ''', (date,))
+    offs = cursor.fetchall()
     conn.close()
+    return offs
+
+def claim_expiry_reminders(cursor, first, last, today):
+    """Mark users whose subscription ends between first and last as reminded today.
+
+    Returns them as (username, name, telegram_id, subscription_end). Users already
+    reminded today are skipped, so a job that runs twice sends each reminder once.
+    """
+    cursor.execute('''
+        UPDATE Users SET expiry_reminded_on = :today
+        WHERE subscription_end BETWEEN :first AND :last
+          AND (expiry_reminded_on IS NULL OR expiry_reminded_on < :today)
+        RETURNING username, name, telegram_id, subscription_end
+    ''', {'first': first, 'last': last, 'today': today})
+    return sorted(cursor.fetchall(), key=lambda row: (row[3], row[0]))
 
 def parse_off_dates(off_dates_str):
     """Parse off dates (single or range) and return list of (date, meal)."""
@@ -215,18 +712,18 @@ def parse_off_dates(off_dates_str):
     return result
 
 def auto_convert_credits_to_days(cursor, username):
-    """Automatically convert meal credits to subscription days when threshold is reached"""
+    """Automatically convert meal credits to subscription days when threshold is reached; returns the days added"""
     # Get current credits
     cursor.execute("SELECT meal_credits, subscription_end FROM Users WHERE username = ?", (username,))
     result = cursor.fetchone()
     if not result:
-        return
+        return 0
     
     meal_credits, subscription_end = result
     
     # Only convert if credits are above threshold and enough for at least one day
     if meal_credits < AUTO_CONVERT_THRESHOLD or meal_credits < CREDITS_PER_DAY:
-        return
+        return 0
     
     # If user has more than MAX_CREDITS, force convert all possible days
     if meal_credits > MAX_CREDITS:
@@ -247,7 +744,7 @@ def auto_convert_credits_to_days(cursor, username):
         new_end_date = (datetime.strptime(subscription_end, '%Y-%m-%d') + 
                         timedelta(days=days_to_add)).strftime('%Y-%m-%d')
     else:
-        new_end_date = (datetime.now() + timedelta(days=days_to_add)).strftime('%Y-%m-%d')
+        new_end_date = (get_clock().today() + timedelta(days=days_to_add)).strftime('%Y-%m-%d')
     
     # Update user's subscription end date and deduct used credits
     cursor.execute(
@@ -257,6 +754,7 @@ def auto_convert_credits_to_days(cursor, username):
     
     # Record this automatic payment
     cursor.execute(
-        "INSERT INTO Payments (username, payment_date, days_added) VALUES (?, ?, ?)",
-        (username, datetime.now().strftime('%Y-%m-%d'), days_to_add)
-    )
\ No newline at end of file
+        "INSERT INTO Payments (username, payment_date, days_added, source) VALUES (?, ?, ?, 'credits')",
+        (username, get_clock().today_str(), days_to_add)
+    )
+    return days_to_add
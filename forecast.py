@@ -0,0 +1,136 @@
+"""
+Meal demand forecast for kitchen prep.
+
+Each subscriber's chance of taking a meal off is estimated per weekday and
+meal from their own history. Forecast_Stats holds exponentially decayed counts
+of meals served and taken off, so recent habits weigh most. Users with little
+history lean on the mess-wide rate for that weekday and meal.
+
+train() runs nightly. It decays the stored counts, adds only the days since
+the last run and then precomputes the expected lunch and dinner headcount of
+the next FORECAST_DAYS days into Forecasts. A date's expected offs are the sum
+of the off chances of every subscriber active on it, or the offs already filed
+if more have been, since most offs are filed some days ahead and are part of
+that sum. A closed meal has no headcount. /forecast only reads Forecasts.
+"""
+
+import time
+from datetime import date, timedelta
+from clock import get_clock
+from config import FORECAST_DAYS, FORECAST_HISTORY_DAYS, FORECAST_DECAY, FORECAST_PRIOR_WEIGHT
+from database import connect, write_transaction
+
+# strftime('%w') numbers weekdays from Sunday
+_WEEKDAY = "CAST(strftime('%w', d.date) AS INTEGER)"
+_FILED_OFF = '''EXISTS (
+    SELECT 1 FROM Off_Requests o WHERE o.date = d.date AND o.username = u.username AND o.meal IN (m.meal, 'both')
+)'''
+
+
+def _days_values(count):
+    return ", ".join(["(?, ?)"] * count)
+
+
+def trainable_through(clock=None):
+    """The last day whose offs can no longer change."""
+    clock = clock or get_clock()
+    today = clock.today()
+    return today if not clock.can_change('dinner', today.isoformat()) else today - timedelta(days=1)
+
+
+def train(through=None, horizon=FORECAST_DAYS):
+    """Fold the days up to through into the model and precompute the next horizon days.
+
+    Returns (days trained, forecast start date).
+    """
+    through = through or trainable_through()
+    with write_transaction() as cursor:
+        cursor.execute('SELECT trained_through FROM Forecast_State WHERE id = 1')
+        row = cursor.fetchone()
+        trained = through - timedelta(days=FORECAST_HISTORY_DAYS) if row is None else date.fromisoformat(row[0])
+        new_days = max(0, (through - trained).days)
+        if new_days:
+            # Age the old counts by the days passed, and each new day by its distance from through
+            cursor.execute(
+                'UPDATE Forecast_Stats SET served = served * :factor, offs = offs * :factor',
+                {'factor': FORECAST_DECAY ** new_days}
+            )
+            days = [((through - timedelta(days=age)).isoformat(), FORECAST_DECAY ** age) for age in range(new_days)]
+            cursor.execute(f'''
+                WITH Days (date, weight) AS (VALUES {_days_values(len(days))}),
+                     Meals (meal) AS (VALUES ('lunch'), ('dinner'))
+                INSERT INTO Forecast_Stats (username, weekday, meal, served, offs)
+                SELECT u.username, {_WEEKDAY}, m.meal, SUM(d.weight), SUM(d.weight * {_FILED_OFF})
+                FROM Days d
+                JOIN Users u ON d.date BETWEEN u.subscription_start AND u.subscription_end
+                CROSS JOIN Meals m
+                WHERE NOT EXISTS (SELECT 1 FROM Closures c WHERE c.date = d.date AND c.meal = m.meal)
+                GROUP BY u.username, 2, m.meal
+                ON CONFLICT (username, weekday, meal) DO UPDATE
+                SET served = served + excluded.served, offs = offs + excluded.offs
+            ''', [value for day in days for value in day])
+
+        start = through + timedelta(days=1)
+        dates = {f'd{i}': (start + timedelta(days=i)).isoformat() for i in range(horizon)}
+        cursor.execute('DELETE FROM Forecasts')
+        cursor.execute(f'''
+            WITH Dates (date) AS (VALUES {", ".join(f"(:{name})" for name in dates)}),
+                 Days AS MATERIALIZED (SELECT date, CAST(strftime('%w', date) AS INTEGER) AS weekday FROM Dates),
+                 Meals (meal, bit) AS (VALUES ('lunch', 1), ('dinner', 2)),
+                 Base AS MATERIALIZED (
+                     SELECT weekday, meal, SUM(offs) / SUM(served) AS rate
+                     FROM Forecast_Stats GROUP BY weekday, meal HAVING SUM(served) > 0
+                 ),
+                 -- Offs already filed in the horizon, as lunch (1) and dinner (2) bits per user and date
+                 Filed AS MATERIALIZED (
+                     SELECT username, date, MAX(CASE meal WHEN 'lunch' THEN 1 WHEN 'dinner' THEN 2 ELSE 3 END) AS bits
+                     FROM Off_Requests WHERE date BETWEEN :first AND :last GROUP BY username, date
+                 ),
+                 Slots AS (
+                     SELECT d.date, d.weekday, m.meal, u.username, COALESCE(o.bits & m.bit, 0) != 0 AS filed
+                     FROM Days d
+                     CROSS JOIN Meals m
+                     LEFT JOIN Users u ON d.date BETWEEN u.subscription_start AND u.subscription_end
+                     LEFT JOIN Filed o ON o.username = u.username AND o.date = d.date
+                 )
+            INSERT INTO Forecasts (date, meal, active, filed_offs, expected)
+            SELECT s.date, s.meal, COUNT(s.username), COALESCE(SUM(s.filed), 0),
+                   CASE WHEN EXISTS (SELECT 1 FROM Closures c WHERE c.date = s.date AND c.meal = s.meal) THEN NULL
+                   ELSE COUNT(s.username) - MAX(COALESCE(SUM(s.filed), 0), COALESCE(SUM(CASE WHEN s.username IS NOT NULL THEN
+                       (COALESCE(f.offs, 0) + :prior * COALESCE(b.rate, 0)) / (COALESCE(f.served, 0) + :prior)
+                   END), 0)) END
+            FROM Slots s
+            LEFT JOIN Forecast_Stats f ON f.username = s.username AND f.weekday = s.weekday AND f.meal = s.meal
+            LEFT JOIN Base b ON b.weekday = s.weekday AND b.meal = s.meal
+            GROUP BY s.date, s.meal
+        ''', {**dates, 'first': dates['d0'], 'last': dates[f'd{horizon - 1}'], 'prior': FORECAST_PRIOR_WEIGHT})
+        cursor.execute('''
+            INSERT INTO Forecast_State (id, trained_through, built_at) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET trained_through = excluded.trained_through, built_at = excluded.built_at
+        ''', (through.isoformat(), time.time()))
+    return new_days, start
+
+
+def get_forecast(days):
+    """Forecast rows (date, meal, active, filed offs, expected headcount or None if closed) of the
+    first days days after the last trained day, with the time they were computed; ([], None) before
+    the first training.
+
+    The nightly run trains through today once its dinner is past the cutoff, so its forecast
+    starts tomorrow.
+    """
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute('SELECT trained_through, built_at FROM Forecast_State WHERE id = 1')
+    row = cursor.fetchone()
+    if row is None:
+        conn.close()
+        return [], None
+    start = date.fromisoformat(row[0]) + timedelta(days=1)
+    cursor.execute('''
+        SELECT date, meal, active, filed_offs, expected FROM Forecasts
+        WHERE date BETWEEN ? AND ? ORDER BY date, meal DESC
+    ''', (start.isoformat(), (start + timedelta(days=days - 1)).isoformat()))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows, row[1]
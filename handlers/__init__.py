@@ -16,10 +16,16 @@ from .off_meal_handlers import (
     canceloff, cancel_off_handler
 )
 from .admin_handlers import (
-    add_user_command, list_users_command, view_offs_command,
-    update_payment_command, broadcast_command, show_database_command,
-    update_credits_command, convert_all_credits_command
+    add_user_command, import_users_command, list_users_command, find_user_command, view_offs_command,
+    update_payment_command, cache_stats_command, broadcast_command, show_database_command,
+    update_credits_command, convert_all_credits_command, closure_command, bulk_off_command,
+    month_report_command
 )
+from .backup_handlers import backup_command, backup_job
+from .analytics_handlers import trends_command, user_stats_command, forecast_command, snapshot_job, forecast_job
+from .reminder_handlers import expiry_reminder_job
+from .diagnostics_handlers import profile_command, slow_queries_command
+from .tenant_handlers import route_tenant, add_mess_command, mess_command
 
 # Export all handlers
 __all__ = [
@@ -34,7 +40,23 @@ __all__ = [
     'canceloff', 'cancel_off_handler',
     
     # Admin handlers
-    'add_user_command', 'list_users_command', 'view_offs_command',
-    'update_payment_command', 'broadcast_command', 'show_database_command',
-    'update_credits_command', 'convert_all_credits_command'
+    'add_user_command', 'import_users_command', 'list_users_command', 'find_user_command', 'view_offs_command',
+    'update_payment_command', 'cache_stats_command', 'broadcast_command', 'show_database_command',
+    'update_credits_command', 'convert_all_credits_command', 'closure_command', 'bulk_off_command',
+    'month_report_command',
+
+    # Backup handlers
+    'backup_command', 'backup_job',
+
+    # Analytics handlers
+    'trends_command', 'user_stats_command', 'forecast_command', 'snapshot_job', 'forecast_job',
+
+    # Reminder handlers
+    'expiry_reminder_job',
+
+    # Diagnostics handlers
+    'profile_command', 'slow_queries_command',
+
+    # Tenant handlers
+    'route_tenant', 'add_mess_command', 'mess_command'
 ]
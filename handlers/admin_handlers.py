@@ -5,16 +5,30 @@ These commands are restricted to the mess owner.
 
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import add_user, parse_off_dates, auto_convert_credits_to_days
-import pytz
+from database import (
+    connect, write_transaction, add_user, import_users, parse_off_dates, auto_convert_credits_to_days,
+    add_closure, add_bulk_off_requests, get_headcount, get_offs_on
+)
+from clock import get_clock
 from datetime import datetime, timedelta
-import sqlite3
+import csv
+import io
+import time
 import pandas as pd
-from config import CREDITS_PER_DAY, AUTO_CONVERT_THRESHOLD, MAX_CREDITS
+from config import (
+    CREDITS_PER_DAY, AUTO_CONVERT_THRESHOLD, MAX_CREDITS, CLOSURE_MAX_DAYS, BULK_OFF_MAX_DAYS, OUTBOX_BULK_PER_SECOND
+)
+from user_index import search_users, resolve_user
+from reports import month_report
+from response_cache import responses, viewoffs_key, invalidate_user
+from rendering import bold, escape, code_blocks, pack, reply_parts
+from tenants import is_owner
+from outbox import enqueue, enqueue_many, post
+from idempotency import remember_result
 
 async def add_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Add a new user to the system (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can add users.")
         return
     try:
@@ -68,13 +82,109 @@ async def add_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             f"Error: {str(e)}. Usage: /adduser <Name> <Mobile> <YYYY-MM-DD> [Off Dates]"
         )
 
+IMPORT_COLUMNS = ['name', 'mobile', 'start_date', 'end_date', 'off_dates']
+
+def _parse_import_rows(reader):
+    """Validate CSV rows one at a time, yielding (row number, parsed user or None, error)."""
+    for row_number, row in enumerate(reader, start=2):
+        name = (row.get('name') or '').strip()
+        mobile = (row.get('mobile') or '').strip()
+        start_date = (row.get('start_date') or '').strip()
+        end_date = (row.get('end_date') or '').strip() or start_date
+        off_dates_str = (row.get('off_dates') or '').strip()
+
+        if not name:
+            yield row_number, None, "Missing name."
+            continue
+        if not mobile.isdigit() or len(mobile) != 10:
+            yield row_number, None, f"Invalid mobile number '{mobile}'."
+            continue
+        try:
+            datetime.strptime(start_date, '%Y-%m-%d')
+            datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            yield row_number, None, "Dates must be in YYYY-MM-DD format."
+            continue
+        off_dates = parse_off_dates(off_dates_str)
+        if off_dates_str and not off_dates:
+            yield row_number, None, f"Could not parse off dates '{off_dates_str}'."
+            continue
+        yield row_number, (name, mobile, start_date, end_date, off_dates), None
+
+async def import_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Add users in bulk from an uploaded CSV file (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can add users.")
+        return
+
+    # The CSV can be sent with /importusers as its caption, or replied to with /importusers
+    document = update.message.document
+    if not document and update.message.reply_to_message:
+        document = update.message.reply_to_message.document
+    if not document:
+        await update.message.reply_text(
+            "Send a CSV file with the caption /importusers, or reply to one with /importusers.\n"
+            f"Columns: {', '.join(IMPORT_COLUMNS)} (end_date and off_dates are optional)\n"
+            "Example row: John Doe,9876543210,2025-05-01,2025-05-31,\"2025-05-10,2025-05-12 to 2025-05-14\""
+        )
+        return
+
+    telegram_file = await document.get_file()
+    data = await telegram_file.download_as_bytearray()
+    reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline=''))
+
+    # Validate while streaming, then write every valid row in one transaction
+    report = []
+    valid_rows = []
+    valid_users = []
+    try:
+        # Reading the header decodes the start of the file, which fails like any row would
+        fieldnames = reader.fieldnames
+        if not fieldnames or not {'name', 'mobile', 'start_date'} <= {f.strip().lower() for f in fieldnames}:
+            await update.message.reply_text("CSV header must include: name, mobile, start_date")
+            return
+        reader.fieldnames = [f.strip().lower() for f in fieldnames]
+        for row_number, user, error in _parse_import_rows(reader):
+            if error:
+                report.append((row_number, '', 'error', error))
+            else:
+                valid_rows.append(row_number)
+                valid_users.append(user)
+    except (UnicodeDecodeError, csv.Error) as e:
+        await update.message.reply_text(f"Could not read CSV file: {e}")
+        return
+
+    results = import_users(valid_users) if valid_users else []
+    for row_number, user, (username, error, skipped) in zip(valid_rows, valid_users, results):
+        if username:
+            detail = f"{user[0]} ({user[1]})"
+            if skipped:
+                detail += "; mess closed, not marked off: " + ", ".join(f"{date} {meal}" for date, meal in skipped)
+            report.append((row_number, username, 'added', detail))
+        else:
+            report.append((row_number, '', 'error', error))
+    report.sort()
+
+    added = sum(1 for row in report if row[2] == 'added')
+    summary = f"📥 Import finished: {added} added, {len(report) - added} failed."
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['row', 'username', 'status', 'detail'])
+    writer.writerows(report)
+    await update.message.reply_document(
+        io.BytesIO(output.getvalue().encode('utf-8')),
+        filename='import_report.csv',
+        caption=summary
+    )
+
 async def list_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """List all registered users with their details (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
         return
     
-    conn = sqlite3.connect('mess.db')
+    conn = connect()
     df = pd.read_sql_query("SELECT username, name, mobile, telegram_id, subscription_start, subscription_end FROM Users", conn)
     conn.close()
     
@@ -82,19 +192,47 @@ async def list_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("No users registered yet.")
         return
     
-    # Format the data into a readable message
-    user_list = "📋 **Registered Users**\n\n"
-    for index, row in df.iterrows():
-        user_list += f"• **{row['username']}** ({row['name']})\n"
-        user_list += f"  - Mobile: {row['mobile']}\n"
-        user_list += f"  - Telegram ID: {row['telegram_id'] or 'Not linked'}\n"
-        user_list += f"  - Subscription: {row['subscription_start']} to {row['subscription_end']}\n\n"
+    # One part per user, so no user's entry is split across messages
+    parts = [bold("📋 Registered Users"), ""]
+    for row in df.itertuples(index=False):
+        parts.append("\n".join([
+            f"• {bold(row.username)} ({escape(row.name)})",
+            f"  - Mobile: {escape(row.mobile)}",
+            f"  - Telegram ID: {row.telegram_id or 'Not linked'}",
+            f"  - Subscription: {row.subscription_start} to {row.subscription_end}",
+            "",
+        ]))
+    
+    await reply_parts(update.message, parts)
+
+async def find_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Find users by partial or misspelled username or name (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Usage: /finduser <name or username>\nExample: /finduser jon")
+        return
+    
+    query = ' '.join(context.args)
+    started = time.perf_counter()
+    matches = search_users(query, limit=10)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    if not matches:
+        await update.message.reply_text(f"No users matching '{query}'.")
+        return
     
-    await update.message.reply_text(user_list, parse_mode="Markdown")
+    lines = [f"🔎 Matches for '{query}':"]
+    for score, username, name in matches:
+        lines.append(f"• {username} ({name}) - {score:.0%}")
+    lines.append(f"\n({elapsed_ms:.2f} ms)")
+    await update.message.reply_text("\n".join(lines))
 
 async def view_offs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """View all off requests for a specific date (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
         return
     
@@ -104,8 +242,7 @@ async def view_offs_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     date_str = context.args[0].lower()
     if date_str == 'today':
-        tz = pytz.timezone('Asia/Kolkata')
-        date = datetime.now(tz).strftime('%Y-%m-%d')
+        date = get_clock().today_str()
     else:
         try:
             # Validate date format
@@ -114,43 +251,39 @@ async def view_offs_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD or 'today'")
             return
     
-    conn = sqlite3.connect('mess.db')
-    # Modified SQL query to only show each user once per meal type
-    df = pd.read_sql_query("""
-        SELECT DISTINCT o.username, u.name, o.meal 
-        FROM Off_Requests o 
-        JOIN Users u ON o.username = u.username
-        WHERE o.date = ?
-    """, conn, params=(date,))
-    conn.close()
-    
-    if df.empty:
-        await update.message.reply_text(f"No off requests for {date}.")
-        return
-    
-    # Group by meal type
-    lunch_offs = df[df['meal'].isin(['lunch', 'both'])]
-    dinner_offs = df[df['meal'].isin(['dinner', 'both'])]
-    
-    # Format the response
-    response = f"🗓️ **Off Requests for {date}**\n\n"
-    
-    if not lunch_offs.empty:
-        response += "**🥗 Lunch Offs:**\n"
-        for _, row in lunch_offs.iterrows():
-            response += f"• {row['name']} ({row['username']})\n"
-        response += "\n"
-    
-    if not dinner_offs.empty:
-        response += "**🍲 Dinner Offs:**\n"
-        for _, row in dinner_offs.iterrows():
-            response += f"• {row['name']} ({row['username']})\n"
-    
-    await update.message.reply_text(response, parse_mode="Markdown")
+    # Serve the rendered response from cache until an off request for this date changes
+    cached = responses.get(viewoffs_key(date))
+    if cached is None:
+        cached = _render_offs(date)
+        responses.put(viewoffs_key(date), cached)
+    parts, parse_mode = cached
+    # Headcount depends on every subscription, so it is computed fresh rather than cached
+    await reply_parts(update.message, [*parts, "", _render_headcount(date)], parse_mode=parse_mode)
+
+def _render_headcount(date):
+    """Plain-text headcount line for a date, safe in Markdown and plain replies"""
+    headcount = get_headcount(date)
+    parts = [f"{meal.capitalize()} {'closed' if count is None else count}" for meal, count in headcount.items()]
+    return "Headcount: " + ", ".join(parts)
+
+def _render_offs(date):
+    """Build the /viewoffs response for a date as (parts, parse_mode)"""
+    # Each user once per meal type; the headcount endpoint lists the same rows
+    offs = get_offs_on(date)
+    if not offs:
+        return (f"No off requests for {date}.",), None
+    
+    parts = [bold(f"🗓️ Off Requests for {date}"), ""]
+    for meal, title in (('lunch', "🥗 Lunch Offs:"), ('dinner', "🍲 Dinner Offs:")):
+        lines = [f"• {escape(name)} ({escape(username)})" for username, name, off in offs if off in (meal, 'both')]
+        if lines:
+            parts += [bold(title), *lines, ""]
+    
+    return tuple(parts[:-1]), "Markdown"
 
 async def update_payment_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Update a user's payment and subscription end date (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
         return
     
@@ -177,58 +310,68 @@ async def update_payment_command(update: Update, context: ContextTypes.DEFAULT_T
         await update.message.reply_text("Days must be a valid number.")
         return
     
-    # Check if user exists - try both with and without @ prefix
-    conn = sqlite3.connect('mess.db')
+    # Check if user exists - try both with and without @ prefix, ignoring case
+    conn = connect()
     cursor = conn.cursor()
-    cursor.execute("SELECT username, subscription_end, meal_credits FROM Users WHERE username = ? OR username = ?", 
+    cursor.execute("SELECT username FROM Users WHERE lower(username) IN (lower(?), lower(?))",
                  (username, username_clean))
-    user = cursor.fetchone()
-    
-    if not user:
-        # If still not found, try searching by partial username
-        cursor.execute("SELECT username, subscription_end, meal_credits FROM Users WHERE username LIKE ?",
-                     (f"%{username.replace('@', '')}%",))
-        user = cursor.fetchone()
-    
-    if not user:
-        conn.close()
-        await update.message.reply_text(f"User {username} not found. Please check the username and try again.")
-        return
-    
-    # Get the actual username from the database
-    actual_username, current_end, meal_credits = user
+    exact = [row[0] for row in cursor.fetchall()]
+    conn.close()
     
-    # Update subscription dates
-    if current_end:
-        new_end_date = (datetime.strptime(current_end, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+    if len(exact) == 1:
+        actual_username, matches = exact[0], []
+    elif exact:
+        # Usernames that differ only in case
+        actual_username, matches = None, [(1.0, match, '') for match in exact]
     else:
-        # If no end date set, use today as starting point
-        new_end_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
-    
-    payment_date = datetime.now().strftime('%Y-%m-%d')
-    
-    # Update user's subscription using the actual username from the database
-    cursor.execute("UPDATE Users SET subscription_end = ? WHERE username = ?", (new_end_date, actual_username))
-    
-    # Record the payment
-    cursor.execute(
-        "INSERT INTO Payments (username, payment_date, days_added) VALUES (?, ?, ?)",
-        (actual_username, payment_date, days)
-    )
+        # Only a clear fuzzy winner is credited; a payment never goes to a guess
+        actual_username, matches = resolve_user(username)
     
-    conn.commit()
-    conn.close()
+    if actual_username is None:
+        if not matches:
+            await update.message.reply_text(f"User {username} not found. Please check the username and try again.")
+            return
+        candidates = "\n".join(
+            f"• {match_username} ({name})" if name else f"• {match_username}" for _, match_username, name in matches
+        )
+        await update.message.reply_text(f"User {username} is ambiguous. Did you mean:\n{candidates}\nNo payment was recorded.")
+        return
+    payment_date = get_clock().today_str()
     
-    await update.message.reply_text(
-        f"✅ Payment recorded for {actual_username}:\n"
-        f"• {days} days added\n"
-        f"• New subscription end date: {new_end_date}\n"
-        f"• Current meal credits: {meal_credits}"
-    )
+    with write_transaction() as cursor:
+        # Reread the end date under the write lock so concurrent payments both count
+        cursor.execute("SELECT subscription_end, meal_credits FROM Users WHERE username = ?", (actual_username,))
+        current_end, meal_credits = cursor.fetchone()
+        
+        # Update subscription dates
+        if current_end:
+            new_end_date = (datetime.strptime(current_end, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+        else:
+            # If no end date set, use today as starting point
+            new_end_date = (get_clock().today() + timedelta(days=days)).strftime('%Y-%m-%d')
+        
+        # Update user's subscription using the actual username from the database
+        cursor.execute("UPDATE Users SET subscription_end = ? WHERE username = ?", (new_end_date, actual_username))
+        
+        # Record the payment
+        cursor.execute(
+            "INSERT INTO Payments (username, payment_date, days_added) VALUES (?, ?, ?)",
+            (actual_username, payment_date, days)
+        )
+        enqueue(
+            cursor, update.message.chat_id,
+            f"✅ Payment recorded for {actual_username}:\n"
+            f"• {days} days added\n"
+            f"• New subscription end date: {new_end_date}\n"
+            f"• Current meal credits: {meal_credits}"
+        )
+    invalidate_user(actual_username)
+    # A re-delivered /updatepayment must not add the days twice
+    remember_result(update, f"Payment recorded for {actual_username}")
 
 async def update_credits_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Update a user's meal credits (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
         return
     
@@ -247,35 +390,48 @@ async def update_credits_command(update: Update, context: ContextTypes.DEFAULT_T
         await update.message.reply_text("Credits must be a valid number.")
         return
     
-    # Check if user exists
-    conn = sqlite3.connect('mess.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT meal_credits FROM Users WHERE username = ?", (username,))
-    user = cursor.fetchone()
+    # Adjust in one statement so concurrent updates cannot overwrite each other
+    with write_transaction() as cursor:
+        cursor.execute(
+            "UPDATE Users SET meal_credits = MAX(0, COALESCE(meal_credits, 0) + ?) WHERE username = ? "
+            "RETURNING meal_credits",
+            (credits, username)
+        )
+        user = cursor.fetchone()
+        if user:
+            new_credits = user[0]
+            action = "added to" if credits > 0 else "deducted from"
+            enqueue(
+                cursor, update.message.chat_id,
+                f"✅ Meal credits updated for {username}:\n"
+                f"• {abs(credits)} credits {action} account\n"
+                f"• New meal credits balance: {new_credits}"
+            )
     
     if not user:
-        conn.close()
         await update.message.reply_text(f"User {username} not found.")
         return
+    invalidate_user(username)
+    remember_result(update, f"Meal credits updated for {username}")
+
+async def cache_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show response cache hit rate (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
     
-    current_credits = user[0] or 0
-    new_credits = max(0, current_credits + credits)
-    
-    # Update user's meal credits
-    cursor.execute("UPDATE Users SET meal_credits = ? WHERE username = ?", (new_credits, username))
-    conn.commit()
-    conn.close()
-    
-    action = "added to" if credits > 0 else "deducted from"
+    stats = responses.stats()
     await update.message.reply_text(
-        f"✅ Meal credits updated for {username}:\n"
-        f"• {abs(credits)} credits {action} account\n"
-        f"• New meal credits balance: {new_credits}"
+        "🗃️ Response cache:\n"
+        f"• Entries: {stats['size']}/{stats['maxsize']}\n"
+        f"• Hits: {stats['hits']}, misses: {stats['misses']}\n"
+        f"• Hit rate: {stats['hit_rate']:.1%}\n"
+        f"• Invalidations: {stats['evictions']}"
     )
 
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a broadcast message to all users with telegram_id (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
         return
     
@@ -285,35 +441,28 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     message = ' '.join(context.args)
     
-    # Get all users with telegram_id
-    conn = sqlite3.connect('mess.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id FROM Users WHERE telegram_id IS NOT NULL AND telegram_id != ''")
-    users = cursor.fetchall()
-    conn.close()
+    with write_transaction() as cursor:
+        # Get all users with telegram_id
+        cursor.execute("SELECT telegram_id FROM Users WHERE telegram_id IS NOT NULL AND telegram_id != ''")
+        users = cursor.fetchall()
+        
+        if users:
+            # Queue one message per user; the outbox sender paces and retries them, then tells
+            # the owner who could not be reached
+            text = bold("📢 Announcement from Mess Owner:") + f"\n\n{escape(message)}"
+            enqueue_many(cursor, [(user[0], text) for user in users], parse_mode="Markdown",
+                         per_second=OUTBOX_BULK_PER_SECOND, report_to=update.message.chat_id, label="Broadcast")
+            enqueue(cursor, update.message.chat_id,
+                    f"Message queued for {len(users)} users. You will be told of any it cannot reach.")
     
     if not users:
         await update.message.reply_text("No users with Telegram accounts found.")
         return
-    
-    # Send the message to each user
-    sent_count = 0
-    for user in users:
-        try:
-            await context.bot.send_message(
-                chat_id=user[0],
-                text=f"📢 **Announcement from Mess Owner:**\n\n{message}",
-                parse_mode="Markdown"
-            )
-            sent_count += 1
-        except Exception as e:
-            continue
-    
-    await update.message.reply_text(f"Message broadcast to {sent_count} users.")
+    remember_result(update, f"Message queued for {len(users)} users.")
 
 async def show_database_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show database contents for debugging (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
         return
     
@@ -327,17 +476,17 @@ async def show_database_command(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     table = context.args[0].lower()
-    conn = sqlite3.connect('mess.db')
+    conn = connect()
     
     if table == 'users':
         df = pd.read_sql_query("SELECT * FROM Users", conn)
-        title = "👥 **Users Table**"
+        title = bold("👥 Users Table")
     elif table == 'offs':
         df = pd.read_sql_query("SELECT * FROM Off_Requests ORDER BY date DESC", conn)
-        title = "📅 **Off Requests Table**"
+        title = bold("📅 Off Requests Table")
     elif table == 'payments':
         df = pd.read_sql_query("SELECT * FROM Payments ORDER BY payment_date DESC", conn)
-        title = "💰 **Payments Table**"
+        title = bold("💰 Payments Table")
     
     conn.close()
     
@@ -345,75 +494,203 @@ async def show_database_command(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text(f"No data in {table} table.")
         return
     
-    # Convert DataFrame to readable format
-    result = f"{title}\n\n```\n"
-    result += df.to_string(index=False)
-    result += "\n```"
-    
-    # If the message is too long, split it
-    if len(result) > 4000:
-        await update.message.reply_text("Data too large to display in a message. Sending as chunks...")
-        chunks = [result[i:i+4000] for i in range(0, len(result), 4000)]
-        for chunk in chunks:
-            await update.message.reply_text(chunk, parse_mode="Markdown")
-    else:
-        await update.message.reply_text(result, parse_mode="Markdown")
+    # Split between rows, with each message's part of the table fenced on its own
+    await reply_parts(update.message, code_blocks(df.to_string(index=False), heading=title))
 
 async def convert_all_credits_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Convert all users' meal credits to subscription days (owner only)"""
-    if str(update.message.from_user.id) != context.bot_data['owner_telegram_id']:
+    if not is_owner(update.message.from_user.id):
         await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
         return
     
-    conn = sqlite3.connect('mess.db')
-    cursor = conn.cursor()
-    
-    # Get all users with meal credits
-    cursor.execute("SELECT username FROM Users WHERE meal_credits >= ?", (CREDITS_PER_DAY,))
-    users = [row[0] for row in cursor.fetchall()]
-    
-    if not users:
-        await update.message.reply_text("No users with enough meal credits to convert.")
-        conn.close()
-        return
-    
-    # Process each user
-    conversions = []
-    for username in users:
-        # Save current state
-        cursor.execute("SELECT meal_credits, subscription_end FROM Users WHERE username = ?", (username,))
-        old_credits, old_end = cursor.fetchone()
+    with write_transaction() as cursor:
+        # Get all users with meal credits
+        cursor.execute("SELECT username FROM Users WHERE meal_credits >= ?", (CREDITS_PER_DAY,))
+        users = [row[0] for row in cursor.fetchall()]
+    
+        # Process each user
+        conversions = []
+        for username in users:
+            # Save current state
+            cursor.execute("SELECT meal_credits, subscription_end FROM Users WHERE username = ?", (username,))
+            old_credits, old_end = cursor.fetchone()
         
-        # Convert credits
-        auto_convert_credits_to_days(cursor, username)
+            # Convert credits
+            auto_convert_credits_to_days(cursor, username)
         
-        # Get new state
-        cursor.execute("SELECT meal_credits, subscription_end FROM Users WHERE username = ?", (username,))
-        new_credits, new_end = cursor.fetchone()
+            # Get new state
+            cursor.execute("SELECT meal_credits, subscription_end FROM Users WHERE username = ?", (username,))
+            new_credits, new_end = cursor.fetchone()
         
-        # Calculate days added
-        days_added = (datetime.strptime(new_end, '%Y-%m-%d') - 
-                     datetime.strptime(old_end, '%Y-%m-%d')).days if old_end and new_end else 0
+            # Calculate days added
+            days_added = (datetime.strptime(new_end, '%Y-%m-%d') - 
+                         datetime.strptime(old_end, '%Y-%m-%d')).days if old_end and new_end else 0
         
-        if days_added > 0:
-            conversions.append({
-                'username': username,
-                'credits_used': old_credits - new_credits,
-                'days_added': days_added,
-                'new_end': new_end
-            })
-    
-    conn.commit()
-    conn.close()
+            if days_added > 0:
+                conversions.append({
+                    'username': username,
+                    'credits_used': old_credits - new_credits,
+                    'days_added': days_added,
+                    'new_end': new_end
+                })
+    
+        if conversions:
+            # Prepare response messages
+            parts = [bold("✅ Credits converted to subscription days:"), ""]
+            parts += [
+                f"• {bold(c['username'])}: {c['credits_used']} credits → {c['days_added']} days\n"
+                f"  New end date: {c['new_end']}"
+                for c in conversions
+            ]
+            enqueue_many(cursor, [(update.message.chat_id, text) for text in pack(parts)], parse_mode="Markdown")
+        elif users:
+            enqueue(cursor, update.message.chat_id, "No credits were converted.")
     
-    if not conversions:
-        await update.message.reply_text("No credits were converted.")
+    if not users:
+        await update.message.reply_text("No users with enough meal credits to convert.")
         return
     
-    # Prepare response message
-    response = "✅ **Credits converted to subscription days:**\n\n"
     for c in conversions:
-        response += f"• **{c['username']}**: {c['credits_used']} credits → {c['days_added']} days\n"
-        response += f"  New end date: {c['new_end']}\n"
+        invalidate_user(c['username'])
+    remember_result(update, f"Credits converted for {len(conversions)} users.")
+
+async def closure_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Close the mess on a date or range and credit every active subscriber (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+    
+    args = [arg.lower() for arg in context.args]
+    meal = args.pop() if args and args[-1] in ('lunch', 'dinner', 'both') else 'both'
+    if len(args) == 3 and args[1] == 'to':
+        start_str, end_str = args[0], args[2]
+    elif len(args) == 1:
+        start_str = end_str = args[0]
+    else:
+        await update.message.reply_text(
+            "Usage: /closure <date> [lunch|dinner|both]\n"
+            "       /closure <start date> to <end date> [lunch|dinner|both]\n"
+            "Example: /closure 2025-10-20 to 2025-10-22"
+        )
+        return
+    
+    clock = get_clock()
+    start_date, end_date = clock.resolve_date(start_str), clock.resolve_date(end_str)
+    if not start_date or not end_date:
+        await update.message.reply_text("Invalid date. Use YYYY-MM-DD or 'today'.")
+        return
+    if end_date < start_date:
+        await update.message.reply_text("End date cannot be before start date.")
+        return
+    days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+    if days > CLOSURE_MAX_DAYS:
+        await update.message.reply_text(f"A closure can cover at most {CLOSURE_MAX_DAYS} days.")
+        return
+    
+    closed, users, credits, days_added = add_closure(start_date, end_date, meal)
+    period = start_date if start_date == end_date else f"{start_date} to {end_date}"
+    if not closed:
+        response = f"The mess is already closed for {meal} on {period}."
+    else:
+        response = (
+            f"🚫 Mess closed for {meal} on {period}:\n"
+            f"• {closed} meals closed\n"
+            f"• {credits} credits given to {users} subscribers\n"
+            f"• {days_added} subscription days added by auto-conversion"
+        )
+    post(update.message.chat_id, response)
+    remember_result(update, response)
+
+async def bulk_off_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Mark a meal off for several users, or all of them, over a date range (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+    
+    args = context.args
+    if len(args) == 5 and args[2].lower() == 'to':
+        start_str, end_str = args[1], args[3]
+    elif len(args) == 3:
+        start_str = end_str = args[1]
+    else:
+        args = []
+    meal = args[-1].lower() if args else None
+    if meal not in ('lunch', 'dinner', 'both'):
+        await update.message.reply_text(
+            "Usage: /bulkoff <usernames|all> <date> <lunch|dinner|both>\n"
+            "       /bulkoff <usernames|all> <start date> to <end date> <lunch|dinner|both>\n"
+            "Example: /bulkoff @John1,@Jane2 2025-10-20 to 2025-10-22 both"
+        )
+        return
+    
+    if args[0].lower() == 'all':
+        usernames = None
+    else:
+        usernames = [name if name.startswith('@') else f'@{name}' for name in args[0].split(',') if name]
     
-    await update.message.reply_text(response, parse_mode="Markdown")
+    clock = get_clock()
+    start_date, end_date = clock.resolve_date(start_str), clock.resolve_date(end_str)
+    if not start_date or not end_date:
+        await update.message.reply_text("Invalid date. Use YYYY-MM-DD or 'today'.")
+        return
+    if end_date < start_date:
+        await update.message.reply_text("End date cannot be before start date.")
+        return
+    days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+    if days > BULK_OFF_MAX_DAYS:
+        await update.message.reply_text(f"A bulk off can cover at most {BULK_OFF_MAX_DAYS} days.")
+        return
+    
+    period = start_date if start_date == end_date else f"{start_date} to {end_date}"
+    users, added, credits, days_added, skipped, unknown = add_bulk_off_requests(
+        usernames, start_date, end_date, meal, notify=f"The mess owner marked your {meal} off for {period}."
+    )
+    response = (
+        f"✅ Bulk off for {meal} on {period}:\n"
+        f"• {added} offs added for {users} users\n"
+        f"• {credits} credits given, {days_added} subscription days added by auto-conversion"
+    )
+    if skipped:
+        reasons = {}
+        for _, _, reason in skipped:
+            reasons[reason] = reasons.get(reason, 0) + 1
+        response += "\n• Skipped: " + ", ".join(f"{count} {reason}" for reason, count in reasons.items())
+    if unknown:
+        response += f"\n\n⚠️ Unknown users: {', '.join(unknown[:10])}"
+        if len(unknown) > 10:
+            response += f" ...and {len(unknown) - 10} more."
+    post(update.message.chat_id, response)
+    remember_result(update, response)
+
+async def month_report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the monthly settlement report of every user as a CSV file (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+    
+    month = context.args[0] if context.args else get_clock().today_str()[:7]
+    started = time.perf_counter()
+    try:
+        report = month_report(month)
+    except ValueError:
+        await update.message.reply_text("Usage: /monthreport [YYYY-MM]\nExample: /monthreport 2025-05")
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    if report.empty:
+        await update.message.reply_text(f"No subscribers or payments in {month}.")
+        return
+    
+    summary = (
+        f"📊 Settlement for {month}: {len(report)} users\n"
+        f"• {report['meals_consumed'].sum()} meals served, "
+        f"{report['lunch_offs'].sum() + report['dinner_offs'].sum()} off, {report['closed_meals'].sum()} closed\n"
+        f"• {report['credits_earned'].sum()} credits earned, {report['credits_converted'].sum()} converted\n"
+        f"• {report['days_purchased'].sum()} days purchased\n"
+        f"({elapsed_ms:.0f} ms)"
+    )
+    await update.message.reply_document(
+        io.BytesIO(report.to_csv(index=False).encode('utf-8')),
+        filename=f'settlement_{month}.csv',
+        caption=summary
+    )
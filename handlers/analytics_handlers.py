@@ -0,0 +1,171 @@
+"""
+Owner analytics commands and their nightly jobs for the Mess Management Bot.
+/trends and /userstats read the columnar snapshot (see snapshot.py), not the
+database; /forecast reads the precomputed forecast (see forecast.py).
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes
+from snapshot import WEEKDAYS, build_snapshot, load_snapshot
+from forecast import get_forecast, train
+from database import get_headcount
+from clock import get_clock
+from config import FORECAST_DAYS
+from tenants import get_tenant, is_owner, registry, use_tenant
+
+logger = logging.getLogger(__name__)
+
+async def snapshot_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Scheduled job: rebuild the attendance snapshot of every mess"""
+    for tenant in registry.tenants():
+        with use_tenant(tenant):
+            try:
+                await asyncio.to_thread(build_snapshot, tenant.snapshot_dir)
+            except Exception:
+                logger.exception("Snapshot of %s failed", tenant.name)
+
+async def forecast_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Scheduled job: train the forecast of every mess on the day just finished"""
+    for tenant in registry.tenants():
+        with use_tenant(tenant):
+            try:
+                await asyncio.to_thread(train)
+            except Exception:
+                logger.exception("Forecast training of %s failed", tenant.name)
+
+async def _current_snapshot():
+    """The mess's snapshot, built now if the nightly job has not made one yet"""
+    directory = get_tenant().snapshot_dir
+    snapshot = load_snapshot(directory)
+    if snapshot is None:
+        await asyncio.to_thread(build_snapshot, directory)
+        snapshot = load_snapshot(directory)
+    return snapshot
+
+def _percent(rate):
+    return '-' if rate is None else f"{rate:.1%}"
+
+def _footer(snapshot):
+    built = datetime.fromtimestamp(snapshot.built_at).strftime('%Y-%m-%d %H:%M')
+    return f"(snapshot of {built})"
+
+async def trends_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show lunch and dinner off rates by weekday and week (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+
+    try:
+        weeks = int(context.args[0]) if context.args else 8
+        if weeks < 1:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("Usage: /trends [weeks]\nExample: /trends 8")
+        return
+
+    snapshot = await _current_snapshot()
+    trends = snapshot.trends(weeks * 7)
+    overall = trends['overall']
+    lines = [
+        f"📈 Off trends, last {min(weeks * 7, snapshot.days)} days to {snapshot.last_day}",
+        f"Lunch off rate: {_percent(overall['lunch'])}, dinner: {_percent(overall['dinner'])}",
+        "",
+        "Busiest off days (lunch / dinner):",
+    ]
+    weekdays = trends['weekdays']
+    combined = [(day, sum(rates[day] or 0 for rates in weekdays.values())) for day in range(7)]
+    for day, _ in sorted(combined, key=lambda item: -item[1]):
+        lines.append(f"• {WEEKDAYS[day]}: {_percent(weekdays['lunch'][day])} / {_percent(weekdays['dinner'][day])}")
+    lines += ["", "Weekly (lunch / dinner):"]
+    for start, rates in trends['weeks']:
+        lines.append(f"• Week of {start}: {_percent(rates['lunch'])} / {_percent(rates['dinner'])}")
+    lines.append(_footer(snapshot))
+    await update.message.reply_text("\n".join(lines))
+
+async def user_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show one user's off figures, or the users who take the most meals off (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+
+    snapshot = await _current_snapshot()
+    period = f"{snapshot.first_day} to {snapshot.last_day}"
+
+    if not context.args:
+        top = snapshot.top_users()
+        if not top:
+            await update.message.reply_text("No subscribers in the snapshot yet.")
+            return
+        lines = [f"📊 Highest off rates, {period}:"]
+        for username, rate, offs in top:
+            lines.append(f"• {username}: {rate:.1%} ({offs} meals off)")
+        lines.append(_footer(snapshot))
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    username = context.args[0] if context.args[0].startswith('@') else f"@{context.args[0]}"
+    stats = snapshot.user_stats(username)
+    if stats is None:
+        await update.message.reply_text(f"User {username} is not in the snapshot. New users appear after the next nightly build.")
+        return
+
+    weekday_offs = stats['weekday_offs']
+    busiest = max(range(7), key=lambda day: weekday_offs[day])
+    lines = [
+        f"📊 {stats['username']}, {period}",
+        f"• Days with meals served: {stats['served_days']}",
+        f"• Lunch offs: {stats['lunch_offs']} ({_percent(stats['lunch_rate'])})",
+        f"• Dinner offs: {stats['dinner_offs']} ({_percent(stats['dinner_rate'])})",
+        "• Offs by weekday: " + ", ".join(f"{WEEKDAYS[day]} {count}" for day, count in enumerate(weekday_offs)),
+        f"• Most skipped day: {WEEKDAYS[busiest] if weekday_offs[busiest] else '-'}",
+        f"• Longest off streak: {stats['longest_streak']} days",
+        _footer(snapshot),
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+async def forecast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the expected lunch and dinner headcount of the coming days (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+
+    try:
+        days = int(context.args[0]) if context.args else 7
+        if not 1 <= days <= FORECAST_DAYS:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(f"Usage: /forecast [days]\nDays can be 1 to {FORECAST_DAYS}.")
+        return
+
+    today = get_clock().today_str()
+    rows, built_at = get_forecast(days)
+    if not rows or rows[0][0] < today:
+        # Nothing trained yet, or the nightly job has not run lately
+        await asyncio.to_thread(train)
+        rows, built_at = get_forecast(days)
+
+    clock = get_clock()
+    lines = ["🍽️ Expected headcount (subscribed, offs filed):"]
+    by_date = {}
+    for date, meal, active, filed, expected in rows:
+        by_date.setdefault(date, {})[meal] = (active, filed, expected)
+    for date, meals in by_date.items():
+        weekday = WEEKDAYS[datetime.strptime(date, '%Y-%m-%d').weekday()]
+        # Past its cutoff a meal's headcount is final, so it is counted rather than forecast
+        final = get_headcount(date) if not clock.can_change('lunch', date) else None
+        parts = []
+        for meal in ('lunch', 'dinner'):
+            active, filed, expected = meals[meal]
+            if expected is None:
+                parts.append(f"{meal} closed")
+            elif final and not clock.can_change(meal, date):
+                parts.append(f"{meal} {final[meal]} (final)")
+            else:
+                parts.append(f"{meal} ~{expected:.0f} ({active}, {filed})")
+        lines.append(f"• {weekday} {date}: " + ", ".join(parts))
+    built = datetime.fromtimestamp(built_at).strftime('%Y-%m-%d %H:%M')
+    lines.append(f"(forecast of {built}; offs filed since are not included)")
+    await update.message.reply_text("\n".join(lines))
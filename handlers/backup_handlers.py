@@ -0,0 +1,106 @@
+"""
+Database backup commands and the scheduled backup job for the Mess Management Bot.
+"""
+
+import asyncio
+import os
+import sqlite3
+from telegram import Update
+from telegram.ext import ContextTypes
+from backup import BackupError, create_backup, list_backups, restore_backup
+from config import BACKUP_SEND_TO_OWNER
+from database import init_database
+from tenants import get_tenant, is_owner, registry, use_tenant
+from response_cache import invalidate_mess
+from user_index import invalidate
+from outbox import post, discard_unsent
+
+def _restore(tenant, snapshot):
+    """Restore snapshot over the database of tenant and bring it up to date."""
+    restore_backup(snapshot, tenant.db_path)
+    with use_tenant(tenant):
+        # A snapshot taken by an older version lacks the newer tables and columns
+        init_database()
+        # Its waiting messages were sent, or superseded, before the restore
+        discard_unsent("Restored from a backup")
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Take, list or restore database snapshots (owner only)"""
+    if not is_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the mess owner can use this command.")
+        return
+
+    action = context.args[0].lower() if context.args else 'create'
+    tenant = get_tenant()
+
+    if action == 'list':
+        backups = list_backups(tenant.backup_dir)
+        if not backups:
+            await update.message.reply_text("No backups found.")
+            return
+        lines = [f"• {os.path.basename(path)} ({os.path.getsize(path) // 1024} KB)" for path in backups]
+        await update.message.reply_text("🗄️ Backups (newest first):\n" + "\n".join(lines))
+        return
+
+    if action == 'restore':
+        if len(context.args) < 2:
+            await update.message.reply_text("Usage: /backup restore <snapshot name from /backup list>")
+            return
+        # Only allow snapshots that live in the backup directory
+        backups = {os.path.basename(path): path for path in list_backups(tenant.backup_dir)}
+        snapshot = backups.get(context.args[1])
+        if not snapshot:
+            await update.message.reply_text(f"Snapshot {context.args[1]} not found. Use /backup list.")
+            return
+        try:
+            await asyncio.to_thread(_restore, tenant, snapshot)
+        except (BackupError, OSError, sqlite3.Error) as e:
+            await update.message.reply_text(f"❌ Restore failed: {e}")
+            return
+        # Nothing rendered from the old data may be served again, by this worker or any other
+        invalidate()
+        invalidate_mess()
+        await update.message.reply_text(f"✅ Restored and verified {context.args[1]}.")
+        return
+
+    if action != 'create':
+        await update.message.reply_text(
+            "Usage:\n"
+            "/backup - Take a snapshot and send it here\n"
+            "/backup list - List stored snapshots\n"
+            "/backup restore <name> - Restore a stored snapshot"
+        )
+        return
+
+    # Run the backup off the event loop so other updates keep being served
+    try:
+        path = await asyncio.to_thread(create_backup, tenant.db_path, tenant.backup_dir)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Backup failed: {e}")
+        return
+
+    with open(path, 'rb') as snapshot:
+        await update.message.reply_document(snapshot, filename=os.path.basename(path),
+                                            caption="✅ Backup verified and stored.")
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Scheduled job: snapshot every mess and optionally send each snapshot to its owners"""
+    for tenant in registry.tenants():
+        with use_tenant(tenant):
+            await _backup_tenant(context, tenant)
+
+async def _backup_tenant(context: ContextTypes.DEFAULT_TYPE, tenant) -> None:
+    """Take one scheduled snapshot of a mess and report failures to its owners"""
+    try:
+        path = await asyncio.to_thread(create_backup, tenant.db_path, tenant.backup_dir)
+    except Exception as e:
+        for owner_id in tenant.owners:
+            post(owner_id, f"❌ Scheduled backup of {tenant.name} failed: {e}")
+        return
+
+    if BACKUP_SEND_TO_OWNER:
+        for owner_id in tenant.owners:
+            with open(path, 'rb') as snapshot:
+                await context.bot.send_document(chat_id=owner_id, document=snapshot,
+                                                filename=os.path.basename(path),
+                                                caption=f"🗄️ Scheduled backup of {tenant.name}")
@@ -0,0 +1,118 @@
+"""
+Owner-only diagnostics commands for the Mess Management Bot.
+"""
+
+import os
+from telegram import Update
+from telegram.ext import ContextTypes
+from profiler import profiler
+from query_tracer import tracer
+from tenants import is_super_owner
+from rendering import pack
+from config import PROFILE_DIR, PROFILE_MAX_SECONDS, SLOW_QUERY_MS
+
+async def _send_profile_report(bot, chat_id) -> None:
+    """Stop the running profile session and send its report and pstats file"""
+    report, path = profiler.stop(PROFILE_DIR)
+    if report is None:
+        await bot.send_message(chat_id=chat_id, text="Profiling is not running.")
+        return
+    # One part per handler, so a message only breaks between handlers
+    for text in pack(report.split('\n\n'), separator='\n\n'):
+        await bot.send_message(chat_id=chat_id, text=text)
+    if path:
+        with open(path, 'rb') as stats_file:
+            await bot.send_document(chat_id=chat_id, document=stats_file, filename=os.path.basename(path),
+                                    caption="Open with: python -m pstats " + os.path.basename(path))
+
+async def _profile_timeout_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop a timed profile session and report to the owner who started it"""
+    await _send_profile_report(context.bot, context.job.chat_id)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Start or stop profiling of handler dispatch (owner only)"""
+    if not is_super_owner(update.message.from_user.id):
+        # Profiles and query stats cover every mess served by this process
+        await update.message.reply_text("Unauthorized: Only the bot owner can use this command.")
+        return
+    
+    action = context.args[0].lower() if context.args else ''
+    
+    if action == 'start':
+        seconds = None
+        if len(context.args) > 1:
+            try:
+                seconds = int(context.args[1])
+            except ValueError:
+                await update.message.reply_text("Seconds must be a valid number.")
+                return
+            if not 0 < seconds <= PROFILE_MAX_SECONDS:
+                await update.message.reply_text(f"Seconds must be between 1 and {PROFILE_MAX_SECONDS}.")
+                return
+        
+        if not profiler.start(context.application):
+            await update.message.reply_text("Profiling is already running. Use /profile stop first.")
+            return
+        
+        if seconds:
+            context.job_queue.run_once(_profile_timeout_job, seconds, chat_id=update.message.chat_id,
+                                       name='profile')
+            await update.message.reply_text(f"⏱️ Profiling started for {seconds} seconds.")
+        else:
+            await update.message.reply_text("⏱️ Profiling started. Use /profile stop to get the report.")
+        return
+    
+    if action == 'stop':
+        # A manual stop replaces any pending timed stop
+        for job in context.job_queue.get_jobs_by_name('profile'):
+            job.schedule_removal()
+        await _send_profile_report(context.bot, update.message.chat_id)
+        return
+    
+    status = "running" if profiler.active else "not running"
+    await update.message.reply_text(
+        f"Profiling is {status}.\n"
+        "Usage: /profile start [seconds] or /profile stop"
+    )
+
+def _shorten(sql, limit=160):
+    return sql if len(sql) <= limit else sql[:limit - 1] + "…"
+
+async def slow_queries_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List the slowest traced SQL statements and full-table scans (owner only)"""
+    if not is_super_owner(update.message.from_user.id):
+        # Profiles and query stats cover every mess served by this process
+        await update.message.reply_text("Unauthorized: Only the bot owner can use this command.")
+        return
+    
+    if context.args and context.args[0].lower() == 'reset':
+        tracer.reset()
+        await update.message.reply_text("Query statistics cleared.")
+        return
+    
+    worst = tracer.worst()
+    scans = tracer.full_scans()
+    if not worst:
+        await update.message.reply_text(f"No statements slower than {SLOW_QUERY_MS} ms so far.")
+        return
+    
+    # One part per statement with its plan, so a message only breaks between statements
+    parts = [f"🐢 Statements slower than {SLOW_QUERY_MS} ms (worst first):"]
+    for stats in worst:
+        lines = [
+            f"• {_shorten(stats.sql)}",
+            f"  params {stats.shape}, {stats.calls} calls ({stats.slow_calls} slow), "
+            f"max {stats.max * 1000:.1f} ms, avg {stats.avg * 1000:.1f} ms, {stats.rows / stats.calls:.0f} rows/call"
+        ]
+        lines.extend(f"  plan: {detail}" for detail in stats.plan or [])
+        parts.append("\n".join(lines))
+    
+    if scans:
+        lines = ["⚠️ Full-table scans:"]
+        for stats in scans:
+            tables = ", ".join(detail for detail in stats.plan if detail.startswith("SCAN"))
+            lines.append(f"• {tables}: {_shorten(stats.sql, 100)}")
+        parts.append("\n".join(lines))
+    
+    for text in pack(parts, separator='\n\n'):
+        await update.message.reply_text(text)
@@ -4,10 +4,13 @@ Handlers for managing meal off requests in the Mess Management Bot.
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from database import check_mobile_by_telegram_id, add_off_request, get_user_offs, delete_off_request
+from database import (
+    check_mobile_by_telegram_id, add_off_request, add_bulk_off_requests, get_user_offs, delete_off_request
+)
 from utils import check_thresholds
-import pytz
-from datetime import datetime, timedelta
+from idempotency import remember_result
+from clock import get_clock
+from datetime import datetime
 from . import OFF_DATE, OFF_MEAL, CANCEL_OFF
 
 async def offmess(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -43,8 +46,7 @@ async def _handle_date_range(update: Update, context: ContextTypes.DEFAULT_TYPE,
     # Validate end date
     try:
         if end_date_str == 'today':
-            tz = pytz.timezone('Asia/Kolkata')
-            end_date = datetime.now(tz).strftime('%Y-%m-%d')
+            end_date = get_clock().today_str()
         else:
             # Validate date format
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').strftime('%Y-%m-%d')
@@ -72,7 +74,7 @@ async def _handle_date_range(update: Update, context: ContextTypes.DEFAULT_TYPE,
         
     if not buttons:
         await update.message.reply_text(
-            "Too late to off start date's meals (past 11 AM for lunch, 5 PM for dinner).\n"
+            f"Too late to off start date's meals (past {get_clock().cutoff_text()}).\n"
             "Please try with a different start date."
         )
         return OFF_DATE
@@ -102,7 +104,7 @@ async def _handle_single_date(update: Update, context: ContextTypes.DEFAULT_TYPE
         buttons.append([InlineKeyboardButton("Both", callback_data='both')])
     
     if not buttons:
-        await update.message.reply_text("Too late to off this date's meals (past 11 AM for lunch, 5 PM for dinner).")
+        await update.message.reply_text(f"Too late to off this date's meals (past {get_clock().cutoff_text()}).")
         return ConversationHandler.END
     
     keyboard = InlineKeyboardMarkup(buttons)
@@ -118,64 +120,53 @@ async def off_meal_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     
     # Check if it's a date range request
     if 'date_range' in context.user_data:
-        return await _process_date_range_off(query, context, username, meal)
+        return await _process_date_range_off(update, context, username, meal)
     else:
         # Handle single date
-        return await _process_single_date_off(query, context, username, meal)
+        return await _process_single_date_off(update, context, username, meal)
 
-async def _process_date_range_off(query, context, username, meal):
+async def _process_date_range_off(update, context, username, meal):
     """Process off requests for a date range"""
+    query = update.callback_query
     start_date, end_date = context.user_data['date_range']
     
-    # Calculate all dates in the range
-    start = datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.strptime(end_date, '%Y-%m-%d')
-    
-    # Process each date in the range
-    success_count = 0
-    error_messages = []
-    current_date = start
-    
-    while current_date <= end:
-        date_str = current_date.strftime('%Y-%m-%d')
-        success, message = add_off_request(username, date_str, meal)
-        
-        if success:
-            success_count += 1
+    def confirm(result):
+        _, added, _, _, skipped, _ = result
+        error_messages = [f"{date}: {reason}" for _, date, reason in skipped]
+        # Prepare response message
+        if added > 0:
+            response = f"✅ Mess off confirmed for {meal} on {added} days from {start_date} to {end_date}."
+            if error_messages:
+                response += "\n\n⚠️ Some dates could not be processed:"
         else:
-            error_messages.append(f"{date_str}: {message}")
-        
-        current_date += timedelta(days=1)
-    
-    # Prepare response message
-    if success_count > 0:
-        response = f"✅ Mess off confirmed for {meal} on {success_count} days from {start_date} to {end_date}."
-        if error_messages:
-            response += "\n\n⚠️ Some dates could not be processed:"
-            for error in error_messages[:5]:  # Show at most 5 errors
-                response += f"\n• {error}"
-            if len(error_messages) > 5:
-                response += f"\n• ...and {len(error_messages) - 5} more."
-    else:
-        response = "❌ Could not process any dates in the range."
-        if error_messages:
-            response += " Reasons:"
-            for error in error_messages[:5]:
-                response += f"\n• {error}"
-            if len(error_messages) > 5:
-                response += f"\n• ...and {len(error_messages) - 5} more."
-    
-    await query.message.reply_text(response)
+            response = "❌ Could not process any dates in the range."
+            if error_messages:
+                response += " Reasons:"
+        for error in error_messages[:5]:  # Show at most 5 errors
+            response += f"\n• {error}"
+        if len(error_messages) > 5:
+            response += f"\n• ...and {len(error_messages) - 5} more."
+        responses.append(response)
+        # The result replaces the meal prompt, whose buttons are spent
+        return query.message.chat_id, response, None, query.message.message_id
+    
+    # The whole range and its confirmation commit together, or not at all
+    responses = []
+    add_bulk_off_requests([username], start_date, end_date, meal, confirm=confirm)
+    remember_result(update, responses[0])
     return ConversationHandler.END
 
-async def _process_single_date_off(query, context, username, meal):
+async def _process_single_date_off(update, context, username, meal):
     """Process off request for a single date"""
+    query = update.callback_query
     date = context.user_data['date']
-    success, message = add_off_request(username, date, meal)
-    if success:
-        await query.message.reply_text(f"Mess off confirmed for {meal} on {date}.")
-    else:
-        await query.message.reply_text(f"Error: {message}")
+    confirmation = f"Mess off confirmed for {meal} on {date}."
+    # The confirmation is queued with the off request itself and replaces the meal prompt
+    notify = (query.message.chat_id, confirmation, None, query.message.message_id)
+    success, message = add_off_request(username, date, meal, notify=notify)
+    remember_result(update, confirmation if success else f"Error: {message}")
+    if not success:
+        await query.edit_message_text(f"Error: {message}")
     return ConversationHandler.END
 
 async def canceloff(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -191,22 +182,16 @@ async def canceloff(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await update.message.reply_text("You have no active off requests.")
         return ConversationHandler.END
     
-    tz = pytz.timezone('Asia/Kolkata')
-    now = datetime.now(tz)
-    current_hour = now.hour
+    clock = get_clock()
     buttons = []
     for off_id, date, meal in offs:
-        off_date = datetime.strptime(date, '%Y-%m-%d')
-        if off_date.date() > now.date() or (
-            off_date.date() == now.date() and (
-                (meal in ['lunch', 'both'] and current_hour < 11) or
-                (meal in ['dinner', 'both'] and current_hour < 17)
-            )
-        ):
+        # A 'both' off stays cancellable while either of its meals can still be changed
+        meals = ['lunch', 'dinner'] if meal == 'both' else [meal]
+        if any(clock.can_change(m, date) for m in meals):
             buttons.append([InlineKeyboardButton(f"{date} {meal}", callback_data=str(off_id))])
     
     if not buttons:
-        await update.message.reply_text("No off requests can be cancelled (past thresholds: 11 AM lunch, 5 PM dinner).")
+        await update.message.reply_text(f"No off requests can be cancelled (past thresholds: {clock.cutoff_text()}).")
         return ConversationHandler.END
     
     keyboard = InlineKeyboardMarkup(buttons)
@@ -220,6 +205,7 @@ async def cancel_off_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     off_id = int(query.data)
     
     # The delete_off_request function now handles deducting meal credits
-    delete_off_request(off_id)
-    await query.message.reply_text("Off request cancelled successfully.")
+    notify = (query.message.chat_id, "Off request cancelled successfully.", None, query.message.message_id)
+    delete_off_request(off_id, notify=notify)
+    remember_result(update, "Off request cancelled successfully.")
     return ConversationHandler.END
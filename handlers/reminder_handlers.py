@@ -0,0 +1,79 @@
+"""
+Subscription expiry reminders for the Mess Management Bot.
+Every day users whose subscription is about to end, or ended a few days ago,
+are reminded, and each mess's owners get one digest of them.
+"""
+
+import logging
+from datetime import date, timedelta
+from telegram.ext import ContextTypes
+from database import write_transaction, claim_expiry_reminders
+from clock import get_clock
+from config import EXPIRY_REMINDER_DAYS, EXPIRY_GRACE_DAYS, OUTBOX_BULK_PER_SECOND
+from rendering import bold, escape, pack
+from tenants import registry, use_tenant
+from outbox import enqueue_many
+
+logger = logging.getLogger(__name__)
+
+def _days(count):
+    return f"{count} day{'s' if count != 1 else ''}"
+
+def _reminder(name, subscription_end, days_left):
+    """The reminder a user gets, by days left on the subscription"""
+    if days_left > 0:
+        return (f"⏳ Hi {name}, your mess subscription ends on {subscription_end} ({_days(days_left)} left). "
+                "Please renew with the mess owner to keep your meals.")
+    if days_left == 0:
+        return f"⏳ Hi {name}, your mess subscription ends today. Please renew with the mess owner to keep your meals."
+    return (f"⚠️ Hi {name}, your mess subscription ended on {subscription_end}. "
+            "Please renew with the mess owner to get your meals again.")
+
+def _digest(tenant, today, users):
+    """The owners' digest of the users reminded, as packed Markdown messages"""
+    expired, expiring = [], []
+    for username, name, telegram_id, subscription_end, days_left in users:
+        if days_left < 0:
+            when = f"ended {subscription_end}"
+        else:
+            when = f"ends {subscription_end} ({_days(days_left)} left)" if days_left else "ends today"
+        unreachable = "" if telegram_id else ", not on Telegram"
+        (expired if days_left < 0 else expiring).append(f"• {escape(name)} ({escape(username)}): {when}{unreachable}")
+    parts = [bold(f"📅 Subscriptions to renew in {tenant.name}, {today}"), ""]
+    if expiring:
+        parts += [bold(f"Ending within {_days(EXPIRY_REMINDER_DAYS)}:"), *expiring, ""]
+    if expired:
+        parts += [bold(f"Ended in the last {_days(EXPIRY_GRACE_DAYS)}:"), *expired, ""]
+    parts.append("Users on Telegram were sent a reminder.")
+    return pack(parts)
+
+def send_expiry_reminders(tenant, today=None):
+    """Queue today's reminders of the current mess and its owners' digest; returns the users reminded"""
+    today = today or get_clock().today()
+    first = (today - timedelta(days=EXPIRY_GRACE_DAYS)).isoformat()
+    last = (today + timedelta(days=EXPIRY_REMINDER_DAYS)).isoformat()
+    with write_transaction() as cursor:
+        users = [
+            (*row, (date.fromisoformat(row[3]) - today).days)
+            for row in claim_expiry_reminders(cursor, first, last, today.isoformat())
+        ]
+        if not users:
+            return []
+        reminders = [
+            (telegram_id, _reminder(name, subscription_end, days_left))
+            for _, name, telegram_id, subscription_end, days_left in users if telegram_id
+        ]
+        # Marked as reminded in the same transaction, so each user gets one reminder a day
+        enqueue_many(cursor, reminders, per_second=OUTBOX_BULK_PER_SECOND)
+        digest = _digest(tenant, today, users)
+        enqueue_many(cursor, [(owner_id, text) for owner_id in tenant.owners for text in digest], parse_mode="Markdown")
+    return users
+
+async def expiry_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Scheduled job: remind the users of every mess whose subscription is ending or just ended"""
+    for tenant in registry.tenants():
+        with use_tenant(tenant):
+            try:
+                send_expiry_reminders(tenant)
+            except Exception:
+                logger.exception("Expiry reminders of %s failed", tenant.name)
@@ -0,0 +1,87 @@
+"""
+Mess routing and management commands for running several messes in one bot.
+"""
+
+import re
+from telegram import Update
+from telegram.ext import ContextTypes
+from database import init_database
+from tenants import registry, get_tenant, set_tenant, use_tenant, is_super_owner
+
+TENANT_ID_PATTERN = re.compile(r'[a-z0-9_-]{1,32}')
+
+async def route_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Resolve the mess an update belongs to before any other handler runs"""
+    user = update.effective_user
+    if not user:
+        set_tenant(None)
+        return
+    # A mess picked with /start <mess> or /mess wins over the stored membership
+    selected = context.user_data.get('tenant_id')
+    tenant = registry.get(selected) if selected else None
+    set_tenant(tenant or registry.resolve(user.id))
+
+def select_tenant(context: ContextTypes.DEFAULT_TYPE, tenant) -> None:
+    """Route the caller's following updates, and the rest of this one, to tenant"""
+    context.user_data['tenant_id'] = tenant.tenant_id
+    set_tenant(tenant)
+
+async def add_mess_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Register a new mess with its own database and owners (bot owner only)"""
+    if not is_super_owner(update.message.from_user.id):
+        await update.message.reply_text("Unauthorized: Only the bot owner can use this command.")
+        return
+
+    if len(context.args) < 3:
+        await update.message.reply_text(
+            "Usage: /addmess <mess_id> <owner_telegram_id>[,<owner_telegram_id>...] <Name>\n"
+            "Example: /addmess north 123456789 North Campus Mess"
+        )
+        return
+
+    tenant_id = context.args[0].lower()
+    if not TENANT_ID_PATTERN.fullmatch(tenant_id):
+        await update.message.reply_text("Mess id must be 1-32 lowercase letters, digits, '-' or '_'.")
+        return
+    if registry.get(tenant_id):
+        await update.message.reply_text(f"Mess {tenant_id} already exists.")
+        return
+
+    owners = [owner.strip() for owner in context.args[1].split(',') if owner.strip()]
+    if not all(owner.isdigit() for owner in owners):
+        await update.message.reply_text("Owner IDs must be numeric Telegram user IDs.")
+        return
+
+    tenant = registry.add_tenant(tenant_id, ' '.join(context.args[2:]), owners)
+    with use_tenant(tenant):
+        init_database()
+
+    await update.message.reply_text(
+        f"✅ Mess {tenant.name} ({tenant_id}) created.\n"
+        f"Members join with: /start {tenant_id}\n"
+        f"Owners switch to it with: /mess {tenant_id}"
+    )
+
+async def mess_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the current mess or switch to another mess the caller owns"""
+    telegram_id = update.message.from_user.id
+    if not context.args:
+        current = get_tenant()
+        owned = registry.tenants() if is_super_owner(telegram_id) else registry.owned_by(telegram_id)
+        lines = [f"Current mess: {current.name} ({current.tenant_id})"]
+        if owned:
+            lines.append("\nMesses you manage:")
+            lines.extend(f"• {tenant.tenant_id} - {tenant.name}" for tenant in owned)
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    tenant = registry.get(context.args[0].lower())
+    if not tenant:
+        await update.message.reply_text(f"Mess {context.args[0]} not found.")
+        return
+    if str(telegram_id) not in tenant.owners and not is_super_owner(telegram_id):
+        await update.message.reply_text("Unauthorized: You do not manage this mess.")
+        return
+
+    select_tenant(context, tenant)
+    await update.message.reply_text(f"Switched to {tenant.name} ({tenant.tenant_id}).")
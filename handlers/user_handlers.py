@@ -4,14 +4,27 @@ User authentication and basic user commands for the Mess Management Bot.
 
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from database import check_mobile, update_telegram_id, check_mobile_by_telegram_id
-import sqlite3
+from database import connect, check_mobile, update_telegram_id, check_mobile_by_telegram_id, get_closures
 from datetime import datetime
+from clock import get_clock
 from . import MOBILE
 from config import CREDITS_PER_DAY  # Import the configuration variable
+from response_cache import responses, status_key
+from rendering import bold, escape, pack
+from tenants import registry, get_tenant, set_tenant, is_owner
+from .tenant_handlers import select_tenant
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start conversation and request mobile number for registration"""
+    # /start <mess_id> (e.g. from a t.me/<bot>?start=<mess_id> link) joins that mess, once the
+    # mobile number is verified in it; until then the caller's updates stay routed as before
+    context.user_data.pop('pending_tenant', None)
+    if context.args:
+        tenant = registry.get(context.args[0].lower())
+        if not tenant:
+            await update.message.reply_text("Unknown mess. Ask your mess owner for the correct link.")
+            return ConversationHandler.END
+        context.user_data['pending_tenant'] = tenant.tenant_id
     await update.message.reply_text("Please enter your mobile number to activate your account.")
     return MOBILE
 
@@ -21,14 +34,21 @@ async def mobile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not mobile.isdigit() or len(mobile) != 10:
         await update.message.reply_text("Please enter a valid 10-digit mobile number.")
         return MOBILE
+    pending = registry.get(context.user_data.pop('pending_tenant', None))
+    if pending:
+        # The number is looked up in the mess being joined
+        set_tenant(pending)
     user = check_mobile(mobile)
     if user:
         username, name, telegram_id = user
         if telegram_id:
             await update.message.reply_text(f"You are already registered as {username} ({name}).")
         else:
-            update_telegram_id(mobile, str(update.message.from_user.id))
-            await update.message.reply_text(f"Welcome, {username} ({name})! Use /help for commands.")
+            update_telegram_id(mobile, str(update.message.from_user.id),
+                               notify=(update.message.chat_id, f"Welcome, {username} ({name})! Use /help for commands."))
+            registry.add_member(update.message.from_user.id, get_tenant().tenant_id)
+            if pending:
+                select_tenant(context, pending)
         return ConversationHandler.END
     else:
         await update.message.reply_text("Mobile number not found. Contact the mess owner to be added.")
@@ -36,12 +56,12 @@ async def mobile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show help message with available commands based on user role"""
-    is_owner = str(update.message.from_user.id) == context.bot_data.get('owner_telegram_id', '')
+    owner = is_owner(update.message.from_user.id)
     
     user_commands = (
         "🍽️ *Mess Management Bot Help* 🍽️\n\n"
         "*User Commands:*\n"
-        "• /start - Activate your account with your mobile number\n"
+        "• /start [mess] - Activate your account with your mobile number\n"
         "• /offmess - Request to skip meals on specific dates\n"
         "• /canceloff - Cancel a previously requested meal off\n"
         "• /status - View your subscription status and upcoming offs\n"
@@ -54,18 +74,32 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     owner_commands = (
         "*Owner Commands:*\n"
         "• /adduser <Name> <Mobile> <Start Date> [Off Dates] - Add a new user\n"
+        "• /importusers - Add users in bulk from a CSV file (send as caption or reply)\n"
         "• /listusers - List all registered users\n"
+        "• /finduser <query> - Find users by partial name or username\n"
         "• /viewoffs <date> - See all users who are off on a specific date\n"
         "• /updatepayment <username> <days> - Add days to a user's subscription\n"
         "• /updatecredits <username> <credits> - Manually adjust user's meal credits\n"
         "• /convertallcredits - Convert all users' credits to subscription days\n"
+        "• /closure <date> [to <date>] [meal] - Close the mess and credit all active subscribers\n"
+        "• /bulkoff <usernames|all> <date> [to <date>] <meal> - Mark a meal off for several users\n"
+        "• /monthreport [YYYY-MM] - Get the monthly settlement report as a CSV file\n"
+        "• /trends [weeks] - Lunch and dinner off rates by weekday and week\n"
+        "• /userstats [username] - Off figures of a user, or the highest off rates\n"
+        "• /forecast [days] - Expected lunch and dinner headcount of the coming days\n"
         "• /broadcast <message> - Send a message to all registered users\n"
-        "• /showdb <table> - Show database tables (users, offs, payments)\n\n"
+        "• /showdb <table> - Show database tables (users, offs, payments)\n"
+        "• /cachestats - Show response cache hit rate\n"
+        "• /backup [list|restore <name>] - Back up or restore the database\n"
+        "• /profile start [seconds] | stop - Profile handlers and get a hotspot report\n"
+        "• /slowqueries [reset] - Show slow SQL statements and full-table scans\n"
+        "• /mess [mess] - Show or switch the mess you are managing\n"
+        "• /addmess <mess> <owner IDs> <Name> - Add a mess with its own database (bot owner)\n\n"
     )
     
     coming_soon = "*Coming Soon:*\n• User status tracking\n• Attendance reporting"
     
-    help_text = user_commands + (owner_commands if is_owner else "") + coming_soon
+    help_text = user_commands + (owner_commands if owner else "") + coming_soon
     
     await update.message.reply_text(help_text, parse_mode="Markdown")
 
@@ -77,9 +111,17 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     username = user[0]
+    today = get_clock().today()
+    
+    # Serve the rendered response from cache until the user's data changes
+    cached = responses.get(status_key(username, today))
+    if cached is not None:
+        for text in cached:
+            await update.message.reply_text(text, parse_mode="Markdown")
+        return
     
     # Get user details
-    conn = sqlite3.connect('mess.db')
+    conn = connect()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT name, subscription_start, subscription_end, meal_credits 
@@ -99,34 +141,49 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     cursor.execute("""
         SELECT date, meal 
         FROM Off_Requests 
-        WHERE username = ? AND date >= date('now') 
+        WHERE username = ? AND date >= ? 
         ORDER BY date
-    """, (username,))
+    """, (username, today.strftime('%Y-%m-%d')))
     off_days = cursor.fetchall()
     conn.close()
+    closures = get_closures(today.strftime('%Y-%m-%d'))
+    closed = set(closures)
     
     # Format subscription info
-    today = datetime.now().date()
     sub_end_date = datetime.strptime(sub_end, '%Y-%m-%d').date() if sub_end else None
     days_left = (sub_end_date - today).days if sub_end_date else 0
     
     # Create response message
-    response = f"📊 **Status for {name}** (@{username})\n\n"
+    parts = [f"📊 {bold(f'Status for {name}')} ({escape(username)})", ""]
     
     if sub_start and sub_end:
         subscription_status = "Active ✅" if days_left > 0 else "Expired ❌"
-        response += f"**Subscription:** {subscription_status}\n"
-        response += f"**Period:** {sub_start} to {sub_end}\n"
-        response += f"**Days remaining:** {max(0, days_left)}\n"
-        response += f"**Meal credits:** {meal_credits}\n\n"
+        parts += [
+            f"{bold('Subscription:')} {subscription_status}",
+            f"{bold('Period:')} {sub_start} to {sub_end}",
+            f"{bold('Days remaining:')} {max(0, days_left)}",
+            f"{bold('Meal credits:')} {meal_credits}",
+            "",
+        ]
     else:
-        response += "**Subscription:** Not active\n\n"
+        parts += [f"{bold('Subscription:')} Not active", ""]
     
-    if off_days:
-        response += "**Upcoming Off Days:**\n"
-        for date, meal in off_days:
-            response += f"• {date}: {meal.capitalize()}\n"
+    # Closed meals are credited to everyone, so an off on one no longer counts
+    off_lines = []
+    for date, meal in off_days:
+        meals = [m for m in (['lunch', 'dinner'] if meal == 'both' else [meal]) if (date, m) not in closed]
+        if meals:
+            off_lines.append(f"• {date}: {'Both' if len(meals) == 2 else meals[0].capitalize()}")
+    if off_lines:
+        parts += [bold("Upcoming Off Days:"), *off_lines]
     else:
-        response += "**Upcoming Off Days:** None\n"
+        parts.append(f"{bold('Upcoming Off Days:')} None")
+    
+    if closures:
+        parts += ["", bold("Mess Closed:")]
+        parts += [f"• {date}: {meal.capitalize()}" for date, meal in closures[:10]]
     
-    await update.message.reply_text(response, parse_mode="Markdown")
+    messages = tuple(pack(parts))
+    responses.put(status_key(username, today), messages)
+    for text in messages:
+        await update.message.reply_text(text, parse_mode="Markdown")
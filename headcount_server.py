@@ -0,0 +1,111 @@
+"""
+Read-only headcount endpoint for kitchen screens.
+
+GET /headcount/<YYYY-MM-DD|today>[/<lunch|dinner>][?mess=<tenant id>] returns
+the date's headcount and off list per meal as JSON, from the same queries as
+/viewoffs. Bodies are cached per date in the response cache, which the off
+request write paths already invalidate, and carry an ETag: a screen polling
+with If-None-Match gets 304 Not Modified until the date's offs or the
+subscriptions change, so most polls touch neither SQLite nor the network.
+"""
+
+import hashlib
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from clock import get_clock
+from database import get_headcount, get_offs_on
+from metrics import Counter
+from response_cache import responses, headcount_key
+from tenants import get_tenant, registry, use_tenant
+
+MEALS = ('lunch', 'dinner')
+
+REQUESTS = Counter('mess_headcount_requests_total', 'Headcount endpoint requests by status.')
+
+
+def render_headcount(date):
+    """The JSON bodies of a date, whole and per meal, as {variant: (body, etag)}."""
+    headcount = get_headcount(date)
+    offs = get_offs_on(date)
+    meals = {}
+    for meal in MEALS:
+        meals[meal] = {
+            'closed': headcount[meal] is None,
+            'headcount': headcount[meal],
+            'offs': [{'username': username, 'name': name} for username, name, off in offs if off in (meal, 'both')],
+        }
+    mess = get_tenant().tenant_id
+    variants = {None: {'mess': mess, 'date': date, 'meals': meals}}
+    for meal in MEALS:
+        variants[meal] = {'mess': mess, 'date': date, 'meal': meal, **meals[meal]}
+    rendered = {}
+    for variant, document in variants.items():
+        body = json.dumps(document, ensure_ascii=False).encode('utf-8')
+        rendered[variant] = (body, '"' + hashlib.sha1(body).hexdigest() + '"')
+    return rendered
+
+
+def _cached_headcount(date):
+    generation = responses.generation
+    cached = responses.get(headcount_key(date))
+    if cached is None:
+        # Rendered on the server thread while the bot may invalidate the date; a stale body is not kept
+        cached = render_headcount(date)
+        responses.put(headcount_key(date), cached, generation)
+    return cached
+
+
+class _HeadcountHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if not 2 <= len(parts) <= 3 or parts[0] != 'headcount' or parts[2:] not in ([], ['lunch'], ['dinner']):
+            self._error(404, 'Unknown path')
+            return
+        date = get_clock().today_str() if parts[1] == 'today' else parts[1]
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            self._error(404, 'Invalid date, use YYYY-MM-DD or today')
+            return
+        mess = parse_qs(url.query).get('mess')
+        tenant = registry.get(mess[0]) if mess else registry.default
+        if tenant is None:
+            self._error(404, 'Unknown mess')
+            return
+
+        with use_tenant(tenant):
+            body, etag = _cached_headcount(date)[parts[2] if len(parts) == 3 else None]
+        if etag in self.headers.get('If-None-Match', '').replace(' ', '').split(','):
+            REQUESTS.inc(status='304')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+        REQUESTS.inc(status='200')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # Screens must revalidate each poll, which costs a 304 while nothing changed
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        REQUESTS.inc(status=str(status))
+        self.send_error(status, message)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_headcount_server(host, port):
+    """Serve /headcount on host:port from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), _HeadcountHandler)
+    threading.Thread(target=server.serve_forever, name='headcount-server', daemon=True).start()
+    return server
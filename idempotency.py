@@ -0,0 +1,110 @@
+"""
+Idempotency cache for incoming updates.
+
+Telegram delivers an update again when the bot was slow to acknowledge it,
+and a double tap on an inline button sends two callback queries for the same
+button. skip_duplicates runs before every other handler and stops an update
+whose update_id, callback query id or tapped button was already handled;
+a duplicate tap is answered from the recorded result, without touching the
+mess database.
+
+Every update is remembered in memory for IDEMPOTENCY_TTL_SECONDS. Handlers
+that change state also call remember_result(), which keeps the result in the
+shared state database for IDEMPOTENCY_RETENTION_HOURS, so duplicates are
+still recognised after a restart or by another scale-out worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from telegram.ext import ApplicationHandlerStop
+from config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_RETENTION_HOURS
+from metrics import Counter
+from shared_state import store
+
+DUPLICATES = Counter('mess_duplicate_updates_total', 'Duplicate updates stopped, by the tier that recognised them.')
+
+# Shown on a duplicate tap when the first one has not recorded a result (yet)
+ALREADY_RECEIVED = "Already received."
+
+
+def update_keys(update):
+    """Keys identifying an update: its id and, for button taps, the query and the button tapped."""
+    keys = [f'update:{update.update_id}']
+    query = update.callback_query
+    if query:
+        keys.append(f'callback:{query.id}')
+        if query.message:
+            keys.append(f'tap:{query.message.chat.id}:{query.message.message_id}:{query.data}')
+    return keys
+
+
+class IdempotencyCache:
+    """Short-lived in-memory tier in front of the results kept in the state database."""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL_SECONDS, maxsize=IDEMPOTENCY_CACHE_SIZE, state_store=store):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.state_store = state_store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, keys, now=None):
+        """Return (tier, result) for keys seen before, else (None, None)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and entry[0] > now:
+                    return 'memory', entry[1]
+        result = self.state_store.find_result(keys)
+        if result is not None:
+            self.add(keys, result, now)
+            return 'store', result
+        return None, None
+
+    def add(self, keys, result=None, now=None):
+        """Remember keys in memory, with the result if one is known."""
+        expires = (time.time() if now is None else now) + self.ttl
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (expires, result)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def remember(self, keys, result):
+        """Record the result of a state-changing update in both tiers."""
+        self.add(keys, result)
+        self.state_store.save_result(keys, result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = IdempotencyCache()
+
+
+def remember_result(update, result):
+    """Record what a state-changing update did, so a duplicate is answered with it."""
+    cache.remember(update_keys(update), result)
+
+
+async def skip_duplicates(update, context) -> None:
+    """Stop updates that were already handled before any other handler runs"""
+    keys = update_keys(update)
+    tier, result = cache.lookup(keys)
+    if tier is None:
+        cache.add(keys)
+        return
+    DUPLICATES.inc(tier=tier)
+    if update.callback_query:
+        # Callback answers are shown as a short notification
+        await update.callback_query.answer(result[:200] if result else ALREADY_RECEIVED)
+    raise ApplicationHandlerStop
+
+
+async def prune_results_job(context) -> None:
+    """Scheduled job: drop update results older than the retention period"""
+    store.prune_results(IDEMPOTENCY_RETENTION_HOURS * 3600)
@@ -0,0 +1,343 @@
+"""
+Metrics for the Mess Management Bot, served in Prometheus text format.
+
+Covers handler latency, database.py call timings and row counts, Telegram
+Bot API call latency, errors and round trips per command, and the depth of
+the update queue. The
+endpoint is a small HTTP server on a background thread, see
+start_metrics_server.
+"""
+
+import contextvars
+import functools
+import sqlite3
+import threading
+import time
+import httpx
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram.ext import CommandHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Name of the handler or database function currently running, used to label row counts
+current_operation = contextvars.ContextVar('current_operation', default='other')
+# Bot API round trips made by the handler invocation currently running, as a one-item list
+current_api_calls = contextvars.ContextVar('current_api_calls', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, registry=None):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, optionally split by labels."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, registry=None):
+        super().__init__(name, help_text, registry)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(key)} {value}' for key, value in items]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, or is read from a function at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, registry=None):
+        super().__init__(name, help_text, registry)
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        value = self._function() if self._function else self._value
+        return [f'{self.name} {value}']
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, optionally split by labels."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help_text, registry)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return series[2] if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self._series.items()]
+        lines = []
+        for key, counts, total, n in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {n}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {n}')
+        return lines
+
+
+REGISTRY = []
+
+HANDLER_LATENCY = Histogram('mess_handler_duration_seconds', 'Time spent in each bot handler.')
+HANDLER_CALLS = Counter('mess_handler_calls_total', 'Handler invocations by outcome.')
+DB_LATENCY = Histogram('mess_db_call_duration_seconds', 'Time spent in each database.py function.')
+DB_ROWS = Counter('mess_db_rows_total', 'Rows fetched or changed, by the operation that ran the query.')
+API_LATENCY = Histogram('mess_telegram_api_duration_seconds', 'Telegram Bot API call latency by method.')
+API_ERRORS = Counter('mess_telegram_api_errors_total', 'Failed Telegram Bot API calls by method and error.')
+API_CALLS = Counter('mess_telegram_api_calls_total', 'Telegram Bot API round trips by the handler that made them and method.')
+HANDLER_API_CALLS = Histogram(
+    'mess_handler_api_calls', 'Telegram Bot API round trips per handler invocation.', buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+)
+UPDATE_QUEUE_DEPTH = Gauge('mess_update_queue_depth', 'Updates waiting to be processed.')
+
+
+def render_metrics(registry=None):
+    """Render all metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+############
+# DATABASE #
+############
+
+class MeteredCursor(sqlite3.Cursor):
+    """Cursor that counts rows fetched and changed against the current operation."""
+
+    def _count(self, rows):
+        if rows:
+            DB_ROWS.inc(rows, operation=current_operation.get())
+
+    def execute(self, sql, parameters=()):
+        super().execute(sql, parameters)
+        self._count(max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        super().executemany(sql, seq_of_parameters)
+        self._count(max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+
+class MeteredConnection(sqlite3.Connection):
+    """Connection whose cursors are MeteredCursors, including those made by execute()."""
+
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+
+def track_db(func):
+    """Record the duration of a database.py function and label the rows it touches.
+
+    Only for functions that open their own connection or transaction; a helper run on a
+    caller's cursor is timed as part of its caller.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = current_operation.set(func.__name__)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - start, function=func.__name__)
+            current_operation.reset(token)
+    return wrapper
+
+
+############
+# HANDLERS #
+############
+
+def _wrap_callback(callback, name):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = current_operation.set(name)
+        calls = [0]
+        calls_token = current_api_calls.set(calls)
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            return await callback(update, context)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+            HANDLER_CALLS.inc(handler=name, status=status)
+            HANDLER_API_CALLS.observe(calls[0], handler=name)
+            current_api_calls.reset(calls_token)
+            current_operation.reset(token)
+    return wrapper
+
+
+def _iter_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for child in handler.entry_points + handler.fallbacks:
+            yield from _iter_handler(child)
+        for state_handlers in handler.states.values():
+            for child in state_handlers:
+                yield from _iter_handler(child)
+        return
+    # Commands are labelled by command name, everything else by callback name
+    if isinstance(handler, CommandHandler):
+        yield handler, sorted(handler.commands)[0]
+    else:
+        yield handler, handler.callback.__name__
+
+
+def iter_handlers(application):
+    """Yield (handler, label) for every handler with a callback, including conversation states."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            yield from _iter_handler(handler)
+
+
+def instrument_handlers(application):
+    """Time every registered handler callback, including conversation states."""
+    for handler, name in iter_handlers(application):
+        handler.callback = _wrap_callback(handler.callback, name)
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+
+
+################
+# TELEGRAM API #
+################
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest that records latency, errors and round trips per Bot API method.
+
+    keepalive_connections idle connections are kept open for keepalive_seconds, so
+    bursts of sends reuse them instead of opening a new TLS connection each.
+    """
+
+    def __init__(self, connection_pool_size=256, keepalive_connections=None, keepalive_seconds=5.0, **kwargs):
+        limits = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=keepalive_connections,
+            keepalive_expiry=keepalive_seconds,
+        )
+        super().__init__(connection_pool_size, httpx_kwargs={'limits': limits}, **kwargs)
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        API_CALLS.inc(handler=current_operation.get(), method=api_method)
+        calls = current_api_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        start = time.perf_counter()
+        try:
+            status_code, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        except Exception as e:
+            API_ERRORS.inc(method=api_method, error=type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - start, method=api_method)
+        if status_code >= 400:
+            API_ERRORS.inc(method=api_method, error=str(status_code))
+        return status_code, payload
+
+
+###############
+# HTTP SERVER #
+###############
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host, port):
+    """Serve /metrics on host:port from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,327 @@
+"""
+Durable outbox for outgoing bot messages.
+
+Handlers queue a message in the Outbox table of the mess database with
+enqueue(), using the cursor of the transaction that makes the change the
+message reports, so the message exists exactly when the change does. A
+background sender drains the table in batches and retries timeouts, flood
+waits and network errors with exponential backoff, so neither a slow Bot API
+nor a restart loses a confirmation. Delivery is at least once: a sender that
+dies mid-send leaves its claim to expire and the message is sent again.
+
+The sender sends at most OUTBOX_MAX_PER_SECOND messages a second across all
+messes, which keeps the bot under Telegram's flood limits, and wakes up when
+the next scheduled message is due.
+
+Messages to one chat are delivered in the order they were queued, except that
+a paced bulk message not yet due does not hold back later replies. A message
+queued with edit_message_id replaces the text of that earlier bot message
+instead, so a prompt whose buttons were just answered becomes the reply rather
+than staying behind it; if it can no longer be edited, it is sent as new.
+
+A bulk send queued with report_to, such as a broadcast, tells that chat which
+of its messages could not be delivered once every one has been sent or given up.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from config import (
+    OUTBOX_BATCH_SIZE, OUTBOX_POLL_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF_SECONDS,
+    OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_CLAIM_SECONDS, OUTBOX_MAX_PER_SECOND, OUTBOX_FAILED_RETENTION_DAYS
+)
+from metrics import Counter, Histogram, current_operation
+from rendering import pack
+from tenants import get_tenant, pool, registry, use_tenant
+
+OUTBOX_MESSAGES = Counter('mess_outbox_messages_total', 'Outbox send attempts by outcome (sent, retried, failed).')
+OUTBOX_DELAY = Histogram('mess_outbox_delivery_seconds', 'Time from queueing a message to its delivery.')
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(cursor, chat_id, text, parse_mode=None, edit_message_id=None):
+    """Queue a message in the transaction of cursor; it is sent once that transaction commits."""
+    _insert(cursor, [(chat_id, text, edit_message_id)], parse_mode)
+
+
+def enqueue_many(cursor, messages, parse_mode=None, per_second=None, report_to=None, label='Bulk message'):
+    """Queue (chat_id, text) pairs in the transaction of cursor.
+
+    per_second spreads the first attempts of a large batch, e.g. a broadcast, so it
+    goes out at that rate. Until its turn comes a paced message does not hold back
+    other messages, including later replies to the same chat. If report_to is
+    given, that chat is told under label which messages could not be delivered.
+    """
+    messages = [(chat_id, text, None) for chat_id, text in messages]
+    batch_id = None
+    if report_to is not None and messages:
+        cursor.execute('INSERT INTO Outbox_Batches (report_chat_id, label, total) VALUES (?, ?, ?)',
+                       (str(report_to), label, len(messages)))
+        batch_id = cursor.lastrowid
+    _insert(cursor, messages, parse_mode, per_second, batch_id)
+
+
+def _insert(cursor, messages, parse_mode, per_second=None, batch_id=None):
+    now = time.time()
+    spacing = 1 / per_second if per_second else 0
+    cursor.executemany('''
+        INSERT INTO Outbox (chat_id, text, parse_mode, edit_message_id, created_at, next_attempt_at, batch_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(str(chat_id), text, parse_mode, edit_message_id, now, now + i * spacing, batch_id)
+          for i, (chat_id, text, edit_message_id) in enumerate(messages)])
+    sender.wake()
+
+
+def post(chat_id, text, parse_mode=None, edit_message_id=None):
+    """Queue a message on its own, for notices that go with no database change."""
+    with pool.transaction(get_tenant().db_path) as cursor:
+        enqueue(cursor, chat_id, text, parse_mode, edit_message_id)
+
+
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else value
+
+
+def _backoff(attempts):
+    delay = min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    # Jitter keeps retries of messages that failed together from arriving together
+    return delay * random.uniform(0.5, 1.0)
+
+
+# Messages per round of the sender; small rounds keep any one second near OUTBOX_MAX_PER_SECOND
+_ROUND_SIZE = max(1, OUTBOX_MAX_PER_SECOND // 10)
+
+
+class OutboxSender:
+    """Background task delivering the outbox of every mess."""
+
+    def __init__(self):
+        self._task = None
+        self._loop = None
+        self._wake = None
+
+    def start(self, bot):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(bot), name='outbox_sender')
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = self._loop = self._wake = None
+
+    def wake(self):
+        """Have the sender look for new messages now; safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self, bot):
+        # Label the sender's Bot API calls, which no handler makes
+        current_operation.set('outbox')
+        while True:
+            self._wake.clear()
+            started = time.monotonic()
+            sent, wait = 0, OUTBOX_POLL_SECONDS
+            for tenant in registry.tenants():
+                # A mess whose database fails, e.g. locked or mid-restore, must not hold up the others
+                with use_tenant(tenant):
+                    try:
+                        sent += await self.drain(bot, limit=_ROUND_SIZE - sent)
+                        wait = min(wait, self._seconds_to_next())
+                    except Exception:
+                        logger.exception("Outbox round of %s failed", tenant.name)
+            if sent:
+                # Stretch the round to the time its messages are allowed to take
+                await asyncio.sleep(max(0, sent / OUTBOX_MAX_PER_SECOND - (time.monotonic() - started)))
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(wait, 0.01))
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, bot, now=None, limit=OUTBOX_BATCH_SIZE):
+        """Send up to limit due messages of the current mess; returns how many were attempted."""
+        now = time.time() if now is None else now
+        if limit <= 0:
+            return 0
+        batch = self._claim(now, min(limit, OUTBOX_BATCH_SIZE))
+        if not batch:
+            return 0
+        outcomes = await asyncio.gather(*(self._send(bot, *message) for message in batch))
+        self._record(batch, outcomes)
+        return len(batch)
+
+    @staticmethod
+    def _claim(now, limit):
+        with pool.transaction(get_tenant().db_path) as cursor:
+            # Only the oldest unsent message of each chat is due, which keeps each chat in order;
+            # a paced message that was never attempted and is not due yet does not count
+            return cursor.execute('''
+                UPDATE Outbox SET claimed_until = :claim
+                WHERE id IN (
+                    SELECT id FROM Outbox o
+                    WHERE failed_at IS NULL AND next_attempt_at <= :now
+                      AND (claimed_until IS NULL OR claimed_until <= :now)
+                      AND NOT EXISTS (SELECT 1 FROM Outbox e
+                                      WHERE e.chat_id = o.chat_id AND e.id < o.id AND e.failed_at IS NULL
+                                        AND (e.attempts > 0 OR e.next_attempt_at <= :now))
+                    ORDER BY id LIMIT :limit
+                )
+                RETURNING id, chat_id, text, parse_mode, attempts, created_at, edit_message_id
+            ''', {'claim': now + OUTBOX_CLAIM_SECONDS, 'now': now, 'limit': limit}).fetchall()
+
+    @staticmethod
+    def _seconds_to_next():
+        """Seconds until the next message of the current mess is due; infinity if none is waiting."""
+        conn = pool.acquire(get_tenant().db_path)
+        try:
+            due = conn.execute('''
+                SELECT MIN(MAX(next_attempt_at, COALESCE(claimed_until, 0))) FROM Outbox WHERE failed_at IS NULL
+            ''').fetchone()[0]
+        finally:
+            conn.close()
+        return float('inf') if due is None else due - time.time()
+
+    @staticmethod
+    async def _edit(bot, chat_id, message_id, text, parse_mode):
+        """Replace the text of an earlier message; False if it can no longer be edited."""
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode=parse_mode)
+        except BadRequest as e:
+            # A retried edit that already went through leaves the text unchanged
+            return 'not modified' in e.message.lower()
+        return True
+
+    @classmethod
+    async def _send(cls, bot, message_id, chat_id, text, parse_mode, attempts, created_at, edit_message_id):
+        """Send one message; returns (outcome, retry delay, error)."""
+        try:
+            if edit_message_id is None or not await cls._edit(bot, chat_id, edit_message_id, text, parse_mode):
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        except RetryAfter as e:
+            return 'retried', _seconds(e.retry_after), str(e)
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot, deleted chat or unparsable text: sending again cannot help
+            return 'failed', None, str(e)
+        except Exception as e:
+            if attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+                return 'failed', None, str(e)
+            return 'retried', _backoff(attempts + 1), str(e)
+        OUTBOX_DELAY.observe(time.time() - created_at)
+        return 'sent', None, None
+
+    @staticmethod
+    def _record(batch, outcomes):
+        now = time.time()
+        sent, retried, failed = [], [], []
+        for (message_id, *_), (outcome, delay, error) in zip(batch, outcomes):
+            OUTBOX_MESSAGES.inc(outcome=outcome)
+            if outcome == 'sent':
+                sent.append((message_id,))
+            elif outcome == 'retried':
+                retried.append((now + delay, error, message_id))
+            else:
+                failed.append((now, error, message_id))
+                logger.warning("Outbox message %d failed: %s", message_id, error)
+        with pool.transaction(get_tenant().db_path) as cursor:
+            ids = [message_id for message_id, *_ in batch]
+            cursor.execute(
+                f"SELECT DISTINCT batch_id FROM Outbox WHERE batch_id IS NOT NULL AND id IN ({','.join('?' * len(ids))})",
+                ids
+            )
+            batch_ids = [row[0] for row in cursor.fetchall()]
+            cursor.executemany('DELETE FROM Outbox WHERE id = ?', sent)
+            cursor.executemany('''
+                UPDATE Outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?, claimed_until = NULL
+                WHERE id = ?
+            ''', retried)
+            cursor.executemany('''
+                UPDATE Outbox SET attempts = attempts + 1, failed_at = ?, last_error = ?, claimed_until = NULL
+                WHERE id = ?
+            ''', failed)
+            for batch_id in batch_ids:
+                _report_batch(cursor, batch_id)
+
+
+def _report_batch(cursor, batch_id):
+    """Once no message of the batch is waiting, queue its report of undelivered messages and drop it."""
+    cursor.execute('SELECT 1 FROM Outbox WHERE batch_id = ? AND failed_at IS NULL LIMIT 1', (batch_id,))
+    if cursor.fetchone():
+        return
+    cursor.execute('DELETE FROM Outbox_Batches WHERE id = ? RETURNING report_chat_id, label, total', (batch_id,))
+    batch = cursor.fetchone()
+    if batch is None:
+        return
+    report_chat_id, label, total = batch
+    # Outbox lives in the mess database, so failed chats are named from its Users
+    cursor.execute('''
+        SELECT o.chat_id, u.name, u.username, o.last_error FROM Outbox o
+        LEFT JOIN Users u ON u.telegram_id = o.chat_id
+        WHERE o.batch_id = ? ORDER BY o.id
+    ''', (batch_id,))
+    failed = cursor.fetchall()
+    if not failed:
+        return
+    lines = [f"⚠️ {label}: {len(failed)} of {total} messages could not be delivered."]
+    lines += [f"• {f'{name} ({username})' if username else chat_id}: {error}" for chat_id, name, username, error in failed]
+    for text in pack(lines):
+        _insert(cursor, [(report_chat_id, text, None)], None)
+
+
+sender = OutboxSender()
+
+
+def discard_unsent(reason):
+    """Mark every waiting message of the current mess failed with reason, e.g. after a restore
+    brought back messages already sent; returns how many."""
+    with pool.transaction(get_tenant().db_path) as cursor:
+        cursor.execute(
+            'UPDATE Outbox SET failed_at = ?, last_error = ?, claimed_until = NULL WHERE failed_at IS NULL',
+            (time.time(), reason)
+        )
+        discarded = cursor.rowcount
+        # Their bulk sends will never complete, so none is reported
+        cursor.execute('DELETE FROM Outbox_Batches')
+    return discarded
+
+
+def prune_failed(older_than=OUTBOX_FAILED_RETENTION_DAYS * 86400):
+    """Delete messages of the current mess given up more than older_than seconds ago; returns how many.
+
+    Messages of a bulk send still waiting for its report are kept until it is made.
+    """
+    with pool.transaction(get_tenant().db_path) as cursor:
+        cursor.execute('''
+            DELETE FROM Outbox WHERE failed_at < ?
+              AND (batch_id IS NULL OR batch_id NOT IN (SELECT id FROM Outbox_Batches))
+        ''', (time.time() - older_than,))
+        return cursor.rowcount
+
+
+async def prune_outbox_job(context) -> None:
+    """Scheduled job: drop messages of every mess that were given up past the retention period"""
+    for tenant in registry.tenants():
+        with use_tenant(tenant):
+            try:
+                prune_failed()
+            except Exception:
+                logger.exception("Outbox prune of %s failed", tenant.name)
+
+
+async def start_sender(application) -> None:
+    """Application post_init hook: start delivering the outbox."""
+    sender.start(application.bot)
+
+
+async def stop_sender(application) -> None:
+    """Application post_stop hook: stop the sender; undelivered messages wait for the next start."""
+    await sender.stop()
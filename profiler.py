@@ -0,0 +1,134 @@
+"""
+On-demand cProfile sessions aggregated per handler.
+
+While a session runs, every handler callback is wrapped so its calls are
+recorded into a cProfile.Profile of its own. Stopping the session restores
+the original callbacks, so there is no overhead while profiling is off.
+
+Only one profile can be enabled at a time, and handlers interleave at their
+awaits, so a handler's profile is enabled only while its coroutine runs a step
+on the event loop and disabled whenever it suspends. Concurrent handlers are
+all profiled without picking up each other's calls. What a handler waits on,
+such as Bot API round trips or work sent to another thread with
+asyncio.to_thread, counts in its wall time but not in its hotspots. From
+Python 3.12 cProfile also records other threads, so calls of a worker thread
+that run during a step can show up in the profile of that step's handler.
+"""
+
+import cProfile
+import functools
+import os
+import pstats
+import time
+from metrics import iter_handlers
+
+
+class _Suspend:
+    """Awaitable that passes what a driven coroutine yielded on to the event loop."""
+
+    def __init__(self, yielded):
+        self.yielded = yielded
+
+    def __await__(self):
+        return (yield self.yielded)
+
+
+async def _profile_steps(coro, profile):
+    """Run coro with profile enabled only while coro itself is running."""
+    value, error = None, None
+    while True:
+        profile.enable()
+        try:
+            yielded = coro.send(value) if error is None else coro.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profile.disable()
+        try:
+            value, error = await _Suspend(yielded), None
+        except GeneratorExit:
+            coro.close()
+            raise
+        except BaseException as e:
+            # e.g. cancellation, which the handler gets to handle where it is suspended
+            value, error = None, e
+
+
+class HandlerProfiler:
+    """Profiles handler callbacks of an Application between start() and stop()."""
+
+    def __init__(self):
+        self.started_at = None
+        self._profiles = {}
+        self._calls = {}
+        self._wall = {}
+        self._originals = []
+
+    @property
+    def active(self):
+        return self.started_at is not None
+
+    def _wrap(self, callback, name):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            start = time.perf_counter()
+            try:
+                return await _profile_steps(callback(update, context), profile)
+            finally:
+                self._calls[name] = self._calls.get(name, 0) + 1
+                self._wall[name] = self._wall.get(name, 0.0) + time.perf_counter() - start
+        return wrapper
+
+    def start(self, application, exclude=('profile',)):
+        """Start profiling every handler of application except those labelled in exclude."""
+        if self.active:
+            return False
+        self._profiles, self._calls, self._wall = {}, {}, {}
+        for handler, name in iter_handlers(application):
+            if name in exclude:
+                continue
+            self._originals.append((handler, handler.callback))
+            handler.callback = self._wrap(handler.callback, name)
+        self.started_at = time.time()
+        return True
+
+    def stop(self, output_dir, top=8):
+        """Restore the original callbacks and return (report text, pstats path or None)."""
+        if not self.active:
+            return None, None
+        for handler, callback in self._originals:
+            handler.callback = callback
+        self._originals = []
+        duration = time.time() - self.started_at
+        self.started_at = None
+
+        if not self._profiles:
+            return f"Profiled {duration:.0f}s: no handlers were called.", None
+
+        lines = [f"⏱️ Profile of {duration:.0f}s, slowest handlers first:"]
+        for name in sorted(self._wall, key=self._wall.get, reverse=True):
+            calls, wall = self._calls[name], self._wall[name]
+            lines.append(f"\n{name}: {calls} calls, {wall * 1000:.1f} ms total, {wall * 1000 / calls:.1f} ms avg")
+            lines.extend(self._hotspots(self._profiles[name], top))
+
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, time.strftime('profile-%Y%m%d-%H%M%S.pstats'))
+        combined = pstats.Stats(*self._profiles.values())
+        combined.dump_stats(path)
+        return '\n'.join(lines), path
+
+    @staticmethod
+    def _hotspots(profile, top):
+        """Format the functions with the highest own time in profile."""
+        stats = pstats.Stats(profile).stats
+        ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+        lines = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in ranked:
+            # Built-in functions are reported with '~' as their file
+            label = function if filename == '~' else f"{function} ({os.path.basename(filename)}:{line})"
+            lines.append(f"  {own * 1000:7.2f} ms own, {cumulative * 1000:7.2f} ms cum, {calls:5d}x {label}")
+        return lines
+
+
+profiler = HandlerProfiler()
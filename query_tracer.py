@@ -0,0 +1,182 @@
+"""
+Slow-query tracer for the database connection layer.
+
+Every statement run through database.connect() is recorded with its
+parameter shape, duration and row count, aggregated per statement text.
+Statements slower than SLOW_QUERY_MS get their EXPLAIN QUERY PLAN captured
+so /slowqueries can show the worst offenders and any full-table scans.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from config import SLOW_QUERY_MS
+from metrics import MeteredConnection, MeteredCursor
+
+MAX_STATEMENTS = 500
+
+
+def normalize_sql(sql):
+    """Collapse whitespace so the same statement always aggregates under one key."""
+    return ' '.join(sql.split())
+
+
+def parameter_shape(parameters):
+    """Describe bound parameters by type only, e.g. '(str, int)' or '{date: str}'."""
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+
+def is_full_scan(plan):
+    """Whether a query plan scans a whole table rather than searching an index."""
+    return any(re.match(r'SCAN \S+$', detail) for detail in plan)
+
+
+class StatementStats:
+    """Aggregated timings for one statement text."""
+
+    def __init__(self, sql, shape):
+        self.sql = sql
+        self.shape = shape
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow_calls = 0
+        self.plan = None
+
+    @property
+    def avg(self):
+        return self.total / self.calls if self.calls else 0.0
+
+
+class QueryTracer:
+    """Collects StatementStats and captures plans for slow statements."""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, max_statements=MAX_STATEMENTS):
+        self.threshold = threshold_ms / 1000
+        self.max_statements = max_statements
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, connection, sql, parameters, shape, duration, rows):
+        """Add a measurement; capture the query plan the first time the statement is slow."""
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_statements:
+                    return
+                stats = self._stats[key] = StatementStats(key, shape)
+            stats.calls += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            stats.rows += rows
+            slow = duration >= self.threshold
+            if slow:
+                stats.slow_calls += 1
+            needs_plan = slow and stats.plan is None
+        if needs_plan:
+            stats.plan = self._explain(connection, sql, parameters)
+
+    def add_time(self, connection, sql, parameters, duration, rows, elapsed):
+        """Attribute fetch time and rows to a recorded statement whose call has taken elapsed so far."""
+        with self._lock:
+            stats = self._stats.get(normalize_sql(sql))
+            if stats is None:
+                return
+            stats.total += duration
+            stats.rows += rows
+            stats.max = max(stats.max, elapsed + duration)
+            # The call becomes slow once its fetches push it over the threshold
+            crossed = elapsed < self.threshold <= elapsed + duration
+            if crossed:
+                stats.slow_calls += 1
+            needs_plan = crossed and stats.plan is None
+        if needs_plan:
+            stats.plan = self._explain(connection, sql, parameters)
+
+    @staticmethod
+    def _explain(connection, sql, parameters):
+        # A plain cursor, so the EXPLAIN itself is not traced
+        try:
+            cursor = sqlite3.Cursor(connection)
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+            return [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            return [f'EXPLAIN failed: {e}']
+
+    def worst(self, limit=10):
+        """Statements with slow calls, slowest first."""
+        with self._lock:
+            slow = [stats for stats in self._stats.values() if stats.slow_calls]
+        return sorted(slow, key=lambda stats: stats.max, reverse=True)[:limit]
+
+    def full_scans(self):
+        """Explained statements whose plan includes a full-table scan."""
+        with self._lock:
+            return [stats for stats in self._stats.values() if stats.plan and is_full_scan(stats.plan)]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+tracer = QueryTracer()
+
+
+class TracedCursor(MeteredCursor):
+    """MeteredCursor that also reports each statement to the tracer."""
+
+    _sql = None
+    _parameters = ()
+    _elapsed = 0.0
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._elapsed = time.perf_counter() - start
+        tracer.record(self.connection, sql, parameters, parameter_shape(parameters),
+                      self._elapsed, max(self.rowcount, 0))
+        self._sql = sql
+        self._parameters = parameters
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        shape = f"{len(seq_of_parameters)} x {parameter_shape(seq_of_parameters[0])}" if seq_of_parameters else '0 x ()'
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        # Plans are explained with the first row's parameters
+        tracer.record(self.connection, sql, seq_of_parameters[0] if seq_of_parameters else (), shape,
+                      time.perf_counter() - start, max(self.rowcount, 0))
+        self._sql = None
+        return self
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        if self._sql is not None:
+            duration = time.perf_counter() - start
+            rows = len(result) if isinstance(result, list) else int(result is not None)
+            tracer.add_time(self.connection, self._sql, self._parameters, duration, rows, self._elapsed)
+            self._elapsed += duration
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class TracedConnection(MeteredConnection):
+    """Connection whose cursors are TracedCursors."""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
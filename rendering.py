@@ -0,0 +1,97 @@
+"""
+Message rendering for the Mess Management Bot.
+
+Replies use Telegram's legacy Markdown parse mode. Text that comes from users
+(names, usernames, mobile numbers) goes through escape() or an entity helper,
+so a name like "chef_raj" cannot open an entity that never closes and make
+Telegram reject the whole message.
+
+A reply is built as a list of parts, each a line or block whose entities are
+complete, and pack() joins them into as few messages as fit under Telegram's
+length limit, splitting only between parts. Long tables go through
+code_blocks(), which splits between lines and fences every piece.
+"""
+
+from telegram.constants import MessageLimit
+from telegram.helpers import escape_markdown
+
+MESSAGE_LIMIT = MessageLimit.MAX_TEXT_LENGTH
+FENCE = '```'
+
+
+def length(text):
+    """Length as Telegram counts it, in UTF-16 code units, so an emoji counts twice."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def escape(text):
+    """text with its Markdown characters escaped, for use outside an entity."""
+    return escape_markdown(str(text), version=1)
+
+
+def bold(text):
+    """text in bold. Nothing can be escaped inside a legacy Markdown entity, so asterisks are dropped."""
+    return f"*{str(text).replace('*', '')}*"
+
+
+def _cut(line, limit):
+    """Pieces of a single line of at most limit characters."""
+    pieces, start, size = [], 0, 0
+    for end, char in enumerate(line):
+        units = length(char)
+        if size + units > limit:
+            pieces.append(line[start:end])
+            start, size = end, 0
+        size += units
+    return pieces + [line[start:]]
+
+
+def pack(parts, limit=MESSAGE_LIMIT, separator='\n'):
+    """Join parts with separator into the fewest messages of at most limit characters.
+
+    Messages only break between parts. A part longer than limit by itself is
+    split between its lines, and a line longer than limit is cut, so such parts
+    must be plain text.
+    """
+    messages, current, size = [], [], 0
+    for part in parts:
+        pieces = [part] if length(part) <= limit else [
+            piece for line in part.split('\n') for piece in _cut(line, limit)
+        ]
+        for piece in pieces:
+            added = length(piece) + (length(separator) if current else 0)
+            if current and size + added > limit:
+                messages.append(separator.join(current))
+                current, size, added = [], 0, length(piece)
+            current.append(piece)
+            size += added
+    if current:
+        messages.append(separator.join(current))
+    return messages
+
+
+def code_blocks(text, heading=None, limit=MESSAGE_LIMIT):
+    """text as fenced code blocks of whole lines, each fitting in one message with its fences.
+
+    The first block starts with heading, if given. Backticks in text would end
+    the block early, so they are replaced with quotes.
+    """
+    room = limit - 2 * length(FENCE) - 2
+    prefix = f"{heading}\n\n{FENCE}" if heading else FENCE
+    first_room = room - (length(prefix) - length(FENCE))
+    blocks, current, size = [], [], 0
+    for line in text.replace('`', "'").split('\n'):
+        for piece in _cut(line, first_room):
+            if current and size + length(piece) + 1 > (room if blocks else first_room):
+                blocks.append(f"{prefix}\n" + '\n'.join(current) + f"\n{FENCE}")
+                prefix, current, size = FENCE, [], 0
+            current.append(piece)
+            size += length(piece) + 1
+    blocks.append(f"{prefix}\n" + '\n'.join(current) + f"\n{FENCE}")
+    return blocks
+
+
+async def reply_parts(message, parts, parse_mode="Markdown"):
+    """Reply to message with parts packed into as few messages as possible."""
+    for text in pack(parts):
+        await message.reply_text(text, parse_mode=parse_mode)
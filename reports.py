@@ -0,0 +1,91 @@
+"""
+Monthly settlement report.
+
+month_report() reads Users, Off_Requests, Payments and the month's closure
+credits in one bulk query each and derives every per-user figure with pandas
+column operations, so a report over thousands of users takes milliseconds
+instead of one Python iteration per user and day.
+"""
+
+import calendar
+import pandas as pd
+from config import CREDITS_PER_DAY
+from database import connect
+
+COLUMNS = [
+    'username', 'name', 'days_subscribed', 'meals_consumed', 'lunch_offs', 'dinner_offs', 'closed_meals',
+    'credits_earned', 'credits_converted', 'days_converted', 'days_purchased', 'credit_balance'
+]
+
+
+def month_bounds(month):
+    """Return the first and last date of a 'YYYY-MM' month; raises ValueError if malformed."""
+    year, number = (int(part) for part in month.split('-'))
+    if len(month) != 7 or not 1 <= number <= 12:
+        raise ValueError(f"Invalid month: {month}")
+    last_day = calendar.monthrange(year, number)[1]
+    return f'{year:04d}-{number:02d}-01', f'{year:04d}-{number:02d}-{last_day:02d}'
+
+
+def month_report(month):
+    """Per-user settlement figures for a 'YYYY-MM' month, as a DataFrame with COLUMNS.
+
+    credit_balance is the balance now, not at the end of the month. Days converted from
+    credits are only told apart from purchased days for payments recorded with a source.
+    closed_meals counts the closure credits add_closure recorded, so a user added or
+    extended after a closure is not counted for it.
+    """
+    first, last = month_bounds(month)
+    conn = connect()
+    users = pd.read_sql_query('''
+        SELECT username, name, subscription_start, subscription_end, COALESCE(meal_credits, 0) AS credit_balance
+        FROM Users
+        WHERE (subscription_start <= :last AND subscription_end >= :first)
+           OR username IN (SELECT username FROM Payments WHERE payment_date BETWEEN :first AND :last)
+        ORDER BY username
+    ''', conn, params={'first': first, 'last': last})
+    offs = pd.read_sql_query(
+        'SELECT username, date, meal FROM Off_Requests WHERE date BETWEEN ? AND ?', conn, params=(first, last)
+    )
+    payments = pd.read_sql_query('''
+        SELECT username, source, SUM(days_added) AS days FROM Payments
+        WHERE payment_date BETWEEN ? AND ? GROUP BY username, source
+    ''', conn, params=(first, last))
+    closure_credits = pd.read_sql_query(
+        'SELECT username, COUNT(*) AS meals FROM Closure_Credits WHERE date BETWEEN ? AND ? GROUP BY username',
+        conn, params=(first, last)
+    )
+    conn.close()
+
+    # Subscribed part of the month; ISO date strings compare and clip like dates
+    starts = users['subscription_start'].fillna(last)
+    starts = starts.where(starts >= first, first)
+    ends = users['subscription_end'].fillna(first)
+    ends = ends.where(ends <= last, last)
+    days = (pd.to_datetime(ends) - pd.to_datetime(starts)).dt.days + 1
+    users['days_subscribed'] = days.clip(lower=0).astype(int)
+    users['window_start'], users['window_end'] = starts, ends
+
+    # Offs inside each user's subscribed window, one row per user and date
+    offs['lunch'] = offs['meal'].isin(['lunch', 'both'])
+    offs['dinner'] = offs['meal'].isin(['dinner', 'both'])
+    offs = offs.groupby(['username', 'date'], as_index=False)[['lunch', 'dinner']].any()
+    offs = offs.merge(users[['username', 'window_start', 'window_end']], on='username')
+    offs = offs[(offs['date'] >= offs['window_start']) & (offs['date'] <= offs['window_end'])]
+
+    per_user = offs.groupby('username')[['lunch', 'dinner']].sum()
+    per_user = per_user.reindex(users['username'], fill_value=0).to_numpy(dtype=int)
+    users['lunch_offs'], users['dinner_offs'] = per_user[:, 0], per_user[:, 1]
+    # Closed meals as credited by add_closure; a meal already off then was credited as an off instead
+    closed = closure_credits.set_index('username')['meals'].reindex(users['username'], fill_value=0)
+    users['closed_meals'] = closed.to_numpy(dtype=int)
+
+    users['credits_earned'] = users['lunch_offs'] + users['dinner_offs'] + users['closed_meals']
+    users['meals_consumed'] = 2 * users['days_subscribed'] - users['credits_earned']
+
+    days_by_source = payments.pivot_table(index='username', columns='source', values='days', aggfunc='sum')
+    days_by_source = days_by_source.reindex(index=users['username'], columns=['payment', 'credits'], fill_value=0)
+    days_by_source = days_by_source.fillna(0).to_numpy(dtype=int)
+    users['days_purchased'], users['days_converted'] = days_by_source[:, 0], days_by_source[:, 1]
+    users['credits_converted'] = users['days_converted'] * CREDITS_PER_DAY
+    return users[COLUMNS]
@@ -0,0 +1,147 @@
+"""
+LRU cache of rendered bot responses.
+
+/viewoffs responses and headcount endpoint bodies are cached per date and
+/status responses per user and day, all within the current mess. Write paths call invalidate_offs or invalidate_user so only the affected
+entries are evicted, or invalidate_mess after a change to every user.
+"""
+
+import threading
+from collections import OrderedDict
+from clock import get_clock
+from config import RESPONSE_CACHE_SIZE
+from tenants import get_tenant
+
+
+class ResponseCache:
+    """A small thread-safe LRU cache that counts hits and misses."""
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped by every eviction, so a value rendered from data read before one is not stored
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        """Cache value under key, unless generation is given and an eviction happened since it was read.
+
+        A reader on another thread reads generation before the data it renders,
+        so an invalidation that lands while it renders cannot be undone by its put.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, key):
+        """Remove key if present."""
+        with self._lock:
+            self.generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.evictions += 1
+
+    def evict_where(self, predicate):
+        """Remove every key for which predicate(key) is true."""
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the hit rate."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+responses = ResponseCache()
+
+
+def viewoffs_key(date):
+    return ('viewoffs', get_tenant().tenant_id, date)
+
+
+def headcount_key(date):
+    return ('headcount', get_tenant().tenant_id, date)
+
+
+def status_key(username, day=None):
+    # /status shows days remaining, so entries are also keyed by the day they were rendered
+    return ('status', get_tenant().tenant_id, username, day or get_clock().today())
+
+
+# Called as listener(kind, *args) after each invalidation, e.g. to tell other workers
+listeners = []
+
+
+def _notify(kind, *args):
+    for listener in listeners:
+        listener(kind, *args)
+
+
+def apply_invalidation(kind, *args):
+    """Evict the entries for an invalidation without notifying listeners."""
+    if kind == 'offs':
+        username, date = args
+        responses.evict(viewoffs_key(date))
+        responses.evict(headcount_key(date))
+        responses.evict(status_key(username))
+    elif kind == 'user':
+        responses.evict(status_key(args[0]))
+        # A subscription change moves the headcount of any date it covers
+        tenant_id = get_tenant().tenant_id
+        responses.evict_where(lambda key: key[0] == 'headcount' and key[1] == tenant_id)
+    elif kind == 'mess':
+        tenant_id = get_tenant().tenant_id
+        responses.evict_where(lambda key: key[1] == tenant_id)
+
+
+def invalidate_offs(username, date):
+    """Evict entries affected by an off request change for username on date."""
+    apply_invalidation('offs', username, date)
+    _notify('offs', username, date)
+
+
+def invalidate_user(username):
+    """Evict entries affected by a change to the user's subscription or credits."""
+    apply_invalidation('user', username)
+    _notify('user', username)
+
+
+def invalidate_mess():
+    """Evict every entry of the current mess, e.g. after a change to all its users."""
+    apply_invalidation('mess')
+    _notify('mess')
@@ -0,0 +1,196 @@
+"""
+Scale-out mode: several bot workers behind one webhook router.
+
+Telegram delivers every update to the router's webhook, which forwards it to
+worker (user id % workers), so each user's conversation always lands on the
+same worker. Workers keep conversations in the shared state database, tell
+each other about cache invalidations, and run scheduled jobs only while they
+hold the job's lease (see shared_state.py). Run one router and N workers:
+
+    python scaleout.py worker --index 0 --workers 2
+    python scaleout.py worker --index 1 --workers 2
+    python scaleout.py router --workers 2 --webhook-url https://example.com/telegram
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import httpx
+from telegram import Bot, Update
+from telegram.ext import TypeHandler
+from bot import BOT_TOKEN, OWNER_TELEGRAM_ID, build_application
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WORKER_HOST, WORKER_BASE_PORT,
+    STATE_FLUSH_SECONDS, INVALIDATION_RETENTION_SECONDS
+)
+from database import init_database
+from outbox import start_sender, stop_sender
+from shared_state import (
+    SQLitePersistence, default_worker_name, enable_shared_invalidation, leader_only,
+    prune_invalidations_job, set_worker_name, sync_shared_state
+)
+from tenants import registry, use_tenant
+
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+logger = logging.getLogger(__name__)
+
+
+def user_id_of(update):
+    """The id of the user (or, failing that, the chat) an update dict comes from."""
+    for value in update.values():
+        if isinstance(value, dict):
+            for field in ('from', 'user', 'chat'):
+                sender = value.get(field)
+                if isinstance(sender, dict) and 'id' in sender:
+                    return sender['id']
+    return 0
+
+
+def shard_for(update, workers):
+    """Index of the worker that handles an update dict."""
+    return user_id_of(update) % workers
+
+
+def worker_url(index):
+    return f'http://{WORKER_HOST}:{WORKER_BASE_PORT + index}/update'
+
+
+async def _serve_http(host, port, handle):
+    """Serve HTTP/1.1 with keep-alive; handle(method, path, headers, body) returns (status, body)."""
+    async def serve_connection(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await handle(method, path, headers, body)
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n'.encode('latin-1') + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(serve_connection, host, port)
+
+
+async def _wait_for_shutdown():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+##########
+# WORKER #
+##########
+
+async def run_worker(index, workers, token=BOT_TOKEN, owner_telegram_id=OWNER_TELEGRAM_ID, base_url=None):
+    """Handle the updates of shard index until SIGINT/SIGTERM."""
+    set_worker_name(default_worker_name(index))
+    application = build_application(token, owner_telegram_id, base_url=base_url,
+                                    persistence=SQLitePersistence(update_interval=STATE_FLUSH_SECONDS))
+    # Before routing, catch up with invalidations published by the other workers
+    application.add_handler(TypeHandler(Update, sync_shared_state), group=-2)
+    application.job_queue.run_repeating(
+        leader_only(prune_invalidations_job, 'prune_invalidations', ttl=INVALIDATION_RETENTION_SECONDS),
+        interval=INVALIDATION_RETENTION_SECONDS / 2, name='prune_invalidations'
+    )
+    enable_shared_invalidation()
+
+    for tenant in registry.tenants():
+        with use_tenant(tenant):
+            init_database()
+
+    async def handle(method, path, headers, body):
+        if method != 'POST' or path != '/update':
+            return '404 Not Found', b'{}'
+        data = json.loads(body)
+        if shard_for(data, workers) != index:
+            logger.warning("Update %s belongs to another worker", data.get('update_id'))
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return '200 OK', b'{}'
+
+    await application.initialize()
+    await application.start()
+    await start_sender(application)
+    server = await _serve_http(WORKER_HOST, WORKER_BASE_PORT + index, handle)
+    print(f"Worker {index}/{workers} listening on {worker_url(index)}")
+    try:
+        await _wait_for_shutdown()
+    finally:
+        server.close()
+        await stop_sender(application)
+        await application.stop()
+        await application.shutdown()
+
+
+##########
+# ROUTER #
+##########
+
+async def run_router(workers, webhook_url=None, token=BOT_TOKEN, secret=WEBHOOK_SECRET):
+    """Receive Telegram's webhook calls and forward each update to its worker until SIGINT/SIGTERM."""
+    if webhook_url:
+        async with Bot(token) as bot:
+            await bot.set_webhook(webhook_url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+
+    client = httpx.AsyncClient(timeout=10, limits=httpx.Limits(max_keepalive_connections=4 * workers))
+
+    async def handle(method, path, headers, body):
+        if method != 'POST' or path != WEBHOOK_PATH:
+            return '404 Not Found', b'{}'
+        if secret and headers.get('x-telegram-bot-api-secret-token') != secret:
+            return '403 Forbidden', b'{}'
+        shard = shard_for(json.loads(body), workers)
+        try:
+            response = await client.post(worker_url(shard), content=body)
+        except httpx.HTTPError as e:
+            # A non-2xx reply makes Telegram deliver the update again later
+            logger.warning("Worker %d unavailable: %s", shard, e)
+            return '502 Bad Gateway', b'{}'
+        return ('200 OK', b'{}') if response.status_code == 200 else ('502 Bad Gateway', b'{}')
+
+    server = await _serve_http(WEBHOOK_HOST, WEBHOOK_PORT, handle)
+    print(f"Router listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH} for {workers} workers")
+    try:
+        await _wait_for_shutdown()
+    finally:
+        server.close()
+        await client.aclose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bot as a webhook router and sharded workers")
+    subparsers = parser.add_subparsers(dest='role', required=True)
+    worker_parser = subparsers.add_parser('worker', help="Handle one shard of the updates")
+    worker_parser.add_argument('--index', type=int, required=True)
+    worker_parser.add_argument('--workers', type=int, required=True)
+    worker_parser.add_argument('--base-url', help="Bot API server to use, e.g. a local telegram-bot-api")
+    router_parser = subparsers.add_parser('router', help="Receive the webhook and forward updates to workers")
+    router_parser.add_argument('--workers', type=int, required=True)
+    router_parser.add_argument('--webhook-url', help="Register this public URL as the bot's webhook")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.role == 'worker':
+        asyncio.run(run_worker(args.index, args.workers, base_url=args.base_url))
+    else:
+        asyncio.run(run_router(args.workers, args.webhook_url))
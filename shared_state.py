@@ -0,0 +1,365 @@
+"""
+State shared between bot workers in scale-out mode.
+
+A single SQLite file (STATE_DB) holds what would otherwise live in one
+process's memory:
+
+    * conversation state and user/chat data, through SQLitePersistence
+    * job leases, so a scheduled job runs on one worker only (leader_only)
+    * an invalidation log, so a cache entry evicted on one worker is evicted
+      on every worker (see enable_shared_invalidation)
+    * results of handled updates, so duplicates are recognised after a restart
+      or on another worker (see idempotency.py)
+
+A single bot.py process uses the leases and update results only; leases
+always succeed there.
+"""
+
+import functools
+import pickle
+import socket
+import sqlite3
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+from config import STATE_DB, INVALIDATION_RETENTION_SECONDS
+import response_cache
+import user_index
+from tenants import registry, get_tenant, use_tenant
+
+# Identity of this process when holding leases; stable per worker slot so a restarted
+# worker takes its own lease back immediately
+worker_name = 'worker-0'
+
+
+def set_worker_name(name):
+    global worker_name
+    worker_name = name
+
+
+class StateStore:
+    """The shared SQLite state database."""
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self._initialized = False
+
+    def connect(self):
+        # Several processes write here, so wait for the lock instead of failing
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            self._create_tables(conn)
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS Leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS Invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                origin TEXT NOT NULL,
+                tenant_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                args BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS Conversations (
+                name TEXT NOT NULL,
+                key BLOB NOT NULL,
+                state BLOB NOT NULL,
+                PRIMARY KEY (name, key)
+            );
+            CREATE TABLE IF NOT EXISTS User_Data (
+                user_id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS Chat_Data (
+                chat_id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS Update_Results (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_update_results_created ON Update_Results (created_at);
+        ''')
+
+    ##########
+    # LEASES #
+    ##########
+
+    def acquire_lease(self, name, holder, ttl, now=None):
+        """Take or renew the lease on name for ttl seconds; False if another holder has it."""
+        now = time.time() if now is None else now
+        conn = self.connect()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO Leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE Leases.holder = excluded.holder OR Leases.expires_at <= ?
+            ''', (name, holder, now + ttl, now))
+            conn.commit()
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def release_lease(self, name, holder):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM Leases WHERE name = ? AND holder = ?', (name, holder))
+            conn.commit()
+        finally:
+            conn.close()
+
+    #################
+    # INVALIDATIONS #
+    #################
+
+    def publish(self, origin, tenant_id, kind, args):
+        conn = self.connect()
+        try:
+            conn.execute(
+                'INSERT INTO Invalidations (created_at, origin, tenant_id, kind, args) VALUES (?, ?, ?, ?, ?)',
+                (time.time(), origin, tenant_id, kind, pickle.dumps(args))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def last_seq(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM Invalidations').fetchone()[0]
+        finally:
+            conn.close()
+
+    def invalidations_since(self, seq):
+        """Return [(seq, origin, tenant_id, kind, args)] published after seq, oldest first."""
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                'SELECT seq, origin, tenant_id, kind, args FROM Invalidations WHERE seq > ? ORDER BY seq', (seq,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(seq, origin, tenant_id, kind, pickle.loads(args)) for seq, origin, tenant_id, kind, args in rows]
+
+    def prune_invalidations(self, retention=INVALIDATION_RETENTION_SECONDS):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM Invalidations WHERE created_at < ?', (time.time() - retention,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+    ##################
+    # UPDATE RESULTS #
+    ##################
+
+    def save_result(self, keys, result):
+        """Record the result of a handled update under each of its keys."""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.executemany('INSERT OR REPLACE INTO Update_Results (key, result, created_at) VALUES (?, ?, ?)',
+                             [(key, result, now) for key in keys])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def find_result(self, keys):
+        """Return the result recorded under any of keys, or None."""
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                f'SELECT result FROM Update_Results WHERE key IN ({", ".join("?" * len(keys))}) LIMIT 1', keys
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def prune_results(self, retention):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM Update_Results WHERE created_at < ?', (time.time() - retention,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+store = StateStore()
+
+
+def leader_only(job, name, ttl):
+    """Wrap a job callback so that, of all workers, only the lease holder runs it.
+
+    ttl should exceed the job's interval so the holder keeps the lease between runs;
+    if the holder stops, another worker takes over once the lease expires.
+    """
+    @functools.wraps(job)
+    async def wrapper(context):
+        if not store.acquire_lease(name, worker_name, ttl):
+            return
+        await job(context)
+    return wrapper
+
+
+async def prune_invalidations_job(context) -> None:
+    """Scheduled job: drop invalidations every worker has had time to apply"""
+    store.prune_invalidations()
+
+
+###############
+# PERSISTENCE #
+###############
+
+class SQLitePersistence(BasePersistence):
+    """Conversation states and user/chat data kept in the shared state database.
+
+    Updates are sharded by user, so each user's data is only written by one
+    worker at a time and is picked up from here when shards move or restart.
+    bot_data stays per process since it only holds startup configuration.
+    """
+
+    def __init__(self, state_store=store, update_interval=5):
+        super().__init__(store_data=PersistenceInput(bot_data=False, callback_data=False),
+                         update_interval=update_interval)
+        self.state_store = state_store
+
+    def _load(self, table, column):
+        conn = self.state_store.connect()
+        try:
+            rows = conn.execute(f'SELECT {column}, data FROM {table}').fetchall()
+        finally:
+            conn.close()
+        return {key: pickle.loads(data) for key, data in rows}
+
+    def _write(self, sql, parameters):
+        conn = self.state_store.connect()
+        try:
+            conn.execute(sql, parameters)
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def get_user_data(self):
+        return self._load('User_Data', 'user_id')
+
+    async def get_chat_data(self):
+        return self._load('Chat_Data', 'chat_id')
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        conn = self.state_store.connect()
+        try:
+            rows = conn.execute('SELECT key, state FROM Conversations WHERE name = ?', (name,)).fetchall()
+        finally:
+            conn.close()
+        return {pickle.loads(key): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            self._write('DELETE FROM Conversations WHERE name = ? AND key = ?', (name, pickle.dumps(key)))
+        else:
+            self._write('INSERT OR REPLACE INTO Conversations (name, key, state) VALUES (?, ?, ?)',
+                        (name, pickle.dumps(key), pickle.dumps(new_state)))
+
+    async def update_user_data(self, user_id, data):
+        self._write('INSERT OR REPLACE INTO User_Data (user_id, data) VALUES (?, ?)', (user_id, pickle.dumps(data)))
+
+    async def update_chat_data(self, chat_id, data):
+        self._write('INSERT OR REPLACE INTO Chat_Data (chat_id, data) VALUES (?, ?)', (chat_id, pickle.dumps(data)))
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._write('DELETE FROM User_Data WHERE user_id = ?', (user_id,))
+
+    async def drop_chat_data(self, chat_id):
+        self._write('DELETE FROM Chat_Data WHERE chat_id = ?', (chat_id,))
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+#############################
+# CROSS-WORKER INVALIDATION #
+#############################
+
+_last_seq = 0
+
+
+def _publish(kind, *args):
+    store.publish(worker_name, get_tenant().tenant_id, kind, args)
+
+
+def enable_shared_invalidation():
+    """Publish this worker's cache invalidations and registry changes to the other workers."""
+    global _last_seq
+    _last_seq = store.last_seq()
+    response_cache.listeners.append(_publish)
+    user_index.listeners.append(_publish)
+    registry.listeners.append(_publish)
+
+
+def _apply(kind, args):
+    if kind == 'indexed':
+        user_index.apply_indexed(*args)
+    elif kind == 'reindex':
+        user_index.apply_invalidate()
+    else:
+        response_cache.apply_invalidation(kind, *args)
+
+
+async def sync_shared_state(update, context) -> None:
+    """Apply invalidations published by other workers before handling an update"""
+    global _last_seq
+    entries = store.invalidations_since(_last_seq)
+    if not entries:
+        return
+    if entries[0][0] > _last_seq + 1:
+        # Entries were pruned before this worker saw them, so drop everything cached
+        response_cache.responses.clear()
+        user_index.invalidate_all()
+        registry.reload()
+    for seq, origin, tenant_id, kind, args in entries:
+        _last_seq = seq
+        if origin == worker_name:
+            continue
+        if kind == 'tenants':
+            registry.reload()
+            continue
+        tenant = registry.get(tenant_id)
+        if tenant:
+            with use_tenant(tenant):
+                _apply(kind, args)
+
+
+def default_worker_name(index):
+    """Lease holder name for worker slot index on this host."""
+    return f"{socket.gethostname()}:worker-{index}"
@@ -0,0 +1,209 @@
+"""
+Columnar attendance snapshot for owner analytics.
+
+A nightly job turns Users, Off_Requests and Closures into NumPy arrays in the
+mess's snapshot directory: a users x days bitmap of offs (one bit for lunch,
+one for dinner), each user's subscribed day range and the closed meals per
+day. /trends and /userstats memory-map those files instead of querying
+SQLite, so each answer is a few vectorized reductions over the bitmap.
+
+Every build goes to a new directory and CURRENT is switched to it atomically,
+so readers never see a half-written snapshot.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import date, timedelta
+import numpy as np
+from clock import get_clock
+from config import SNAPSHOT_DAYS
+from database import connect
+
+LUNCH, DINNER = 1, 2
+MEAL_BITS = {'lunch': LUNCH, 'dinner': DINNER, 'both': LUNCH | DINNER}
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+CURRENT = 'CURRENT'
+
+
+def _day_indexes(values, first_day, missing):
+    """Day offsets from first_day of ISO date strings; missing for NULL dates."""
+    dates = np.array([value or missing for value in values], dtype='datetime64[D]')
+    return (dates - np.datetime64(first_day, 'D')).astype(np.int32)
+
+
+def build_snapshot(directory, days=SNAPSHOT_DAYS, today=None):
+    """Write a snapshot of the current mess covering the days up to today; returns its path."""
+    today = today or get_clock().today()
+    first_day = today - timedelta(days=days - 1)
+    last = today.isoformat()
+    conn = connect()
+    users = conn.execute('SELECT username, subscription_start, subscription_end FROM Users ORDER BY username').fetchall()
+    offs = conn.execute(
+        'SELECT username, date, meal FROM Off_Requests WHERE date BETWEEN ? AND ?', (first_day.isoformat(), last)
+    ).fetchall()
+    closures = conn.execute(
+        'SELECT date, meal FROM Closures WHERE date BETWEEN ? AND ?', (first_day.isoformat(), last)
+    ).fetchall()
+    conn.close()
+
+    usernames = np.array([row[0] for row in users], dtype=str)
+    # A user with no subscription dates is never subscribed: start after the window, end before it
+    starts = _day_indexes([row[1] for row in users], first_day, '9999-12-31')
+    ends = _day_indexes([row[2] for row in users], first_day, '0001-01-01')
+
+    bitmap = np.zeros((len(users), days), dtype=np.uint8)
+    if offs:
+        names, dates, meals = (np.array(column, dtype=str) for column in zip(*offs))
+        rows = np.searchsorted(usernames, names).clip(max=max(len(users) - 1, 0))
+        known = (usernames[rows] == names) if len(users) else np.zeros(len(names), dtype=bool)
+        columns = _day_indexes(dates, first_day, last)
+        bits = np.select([meals == 'lunch', meals == 'dinner'], [LUNCH, DINNER], LUNCH | DINNER).astype(np.uint8)
+        np.bitwise_or.at(bitmap, (rows[known], columns[known]), bits[known])
+
+    closed = np.zeros(days, dtype=np.uint8)
+    for closed_date, meal in closures:
+        closed[(date.fromisoformat(closed_date) - first_day).days] |= MEAL_BITS[meal]
+
+    name = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, name)
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'offs.npy'), bitmap)
+    np.save(os.path.join(path, 'starts.npy'), starts)
+    np.save(os.path.join(path, 'ends.npy'), ends)
+    np.save(os.path.join(path, 'closed.npy'), closed)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'first_day': first_day.isoformat(), 'days': days, 'built_at': time.time(),
+                   'users': usernames.tolist()}, f)
+
+    pointer = os.path.join(directory, CURRENT)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+    # Keep the previous snapshot for readers that still have it open
+    for old in sorted(entry for entry in os.listdir(directory) if entry != CURRENT and not entry.endswith('.tmp'))[:-2]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return path
+
+
+class Snapshot:
+    """Memory-mapped snapshot arrays with the analytics computed from them."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.first_day = date.fromisoformat(meta['first_day'])
+        self.days = meta['days']
+        self.built_at = meta['built_at']
+        self.users = meta['users']
+        self.index = {username.lower(): row for row, username in enumerate(self.users)}
+        self.offs = np.load(os.path.join(path, 'offs.npy'), mmap_mode='r')
+        self.starts = np.load(os.path.join(path, 'starts.npy'), mmap_mode='r')
+        self.ends = np.load(os.path.join(path, 'ends.npy'), mmap_mode='r')
+        self.closed = np.load(os.path.join(path, 'closed.npy'), mmap_mode='r')
+
+    @property
+    def last_day(self):
+        return self.first_day + timedelta(days=self.days - 1)
+
+    def _window(self, days, rows=slice(None)):
+        """Offs, the columns of the last days days and, per meal, which user-days were served."""
+        days = min(days or self.days, self.days)
+        columns = np.arange(self.days - days, self.days)
+        offs = np.asarray(self.offs[rows, self.days - days:])
+        subscribed = (columns >= self.starts[rows, None]) & (columns <= self.ends[rows, None])
+        served = {
+            meal: subscribed & ((self.closed[columns] & bit) == 0)
+            for meal, bit in (('lunch', LUNCH), ('dinner', DINNER))
+        }
+        return offs, columns, served
+
+    def _weekdays(self, columns):
+        return (self.first_day.weekday() + columns) % 7
+
+    def trends(self, days):
+        """Off rates over the last days days: overall, per weekday and per week, for lunch and dinner.
+
+        Returns {'overall': {meal: rate}, 'weekdays': {meal: 7 rates},
+        'weeks': [(week start, {meal: rate})]}; rates are None where nothing was served.
+        """
+        offs, columns, served = self._window(days)
+        weekdays = self._weekdays(columns)
+        weeks = (columns - columns[0]) // 7
+        result = {'overall': {}, 'weekdays': {}, 'weeks': []}
+        per_week = {}
+        for meal, bit in (('lunch', LUNCH), ('dinner', DINNER)):
+            off = ((offs & bit) != 0) & served[meal]
+            off_days, served_days = off.sum(axis=0), served[meal].sum(axis=0)
+            result['overall'][meal] = _rate(off_days.sum(), served_days.sum())
+            result['weekdays'][meal] = _rates(
+                np.bincount(weekdays, off_days, minlength=7), np.bincount(weekdays, served_days, minlength=7)
+            )
+            per_week[meal] = _rates(np.bincount(weeks, off_days), np.bincount(weeks, served_days))
+        for week in range(len(per_week['lunch'])):
+            start = self.first_day + timedelta(days=int(columns[0]) + week * 7)
+            result['weeks'].append((start, {meal: rates[week] for meal, rates in per_week.items()}))
+        return result
+
+    def user_stats(self, username):
+        """Off figures of one user over the whole snapshot, or None if the user is not in it."""
+        row = self.index.get(username.lower())
+        if row is None:
+            return None
+        offs, columns, served = self._window(self.days, slice(row, row + 1))
+        offs, served = offs[0], {meal: mask[0] for meal, mask in served.items()}
+        stats = {'username': self.users[row], 'served_days': int((served['lunch'] | served['dinner']).sum())}
+        for meal, bit in (('lunch', LUNCH), ('dinner', DINNER)):
+            off = ((offs & bit) != 0) & served[meal]
+            stats[f'{meal}_offs'] = int(off.sum())
+            stats[f'{meal}_rate'] = _rate(off.sum(), served[meal].sum())
+        any_off = offs != 0
+        stats['weekday_offs'] = np.bincount(self._weekdays(columns)[any_off], minlength=7).tolist()
+        stats['longest_streak'] = _longest_run(any_off)
+        return stats
+
+    def top_users(self, limit=10, min_days=7):
+        """Users with the highest share of served meals taken off, as (username, rate, offs)."""
+        offs, columns, served = self._window(self.days)
+        off_meals = sum((((offs & bit) != 0) & served[meal]).sum(axis=1) for meal, bit in (('lunch', LUNCH), ('dinner', DINNER)))
+        served_meals = served['lunch'].sum(axis=1) + served['dinner'].sum(axis=1)
+        eligible = np.flatnonzero(served_meals >= 2 * min_days)
+        rates = off_meals[eligible] / served_meals[eligible]
+        best = eligible[np.argsort(-rates, kind='stable')[:limit]]
+        return [(self.users[row], float(off_meals[row] / served_meals[row]), int(off_meals[row])) for row in best]
+
+
+def _rate(off, served):
+    return float(off / served) if served else None
+
+
+def _rates(off, served):
+    return [_rate(o, s) for o, s in zip(off, served)]
+
+
+def _longest_run(mask):
+    """Length of the longest run of True in a 1-d boolean array."""
+    if not mask.any():
+        return 0
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return int((np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)).max())
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_snapshot(directory):
+    """The current snapshot in directory, reopened only when a newer one was built; None if none exists."""
+    try:
+        with open(os.path.join(directory, CURRENT)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    with _lock:
+        loaded = _loaded.get(directory)
+        if loaded is None or loaded[0] != name:
+            loaded = _loaded[directory] = (name, Snapshot(os.path.join(directory, name)))
+        return loaded[1]
@@ -0,0 +1,366 @@
+"""
+Multi-mess tenancy for a single bot process.
+
+Each mess (tenant) has its own owners and its own database file. Messes and
+their members are kept in a small registry database. route_tenant (see
+handlers/tenant_handlers.py) resolves the mess of every update from the
+caller's membership and stores it in a context variable, so database.connect()
+and the caches pick the right mess without a tenant argument on every call.
+With no messes registered the bot is a single mess on mess.db, as before.
+
+Connections are reused through an LRU-bounded pool, so dozens of messes
+share a fixed number of open file handles. Writes go through
+ConnectionPool.transaction(), which takes the write lock up front and
+retries while another writer holds it.
+"""
+
+import contextlib
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    TENANTS_DB, TENANT_DB_DIR, TENANT_POOL_SIZE, BACKUP_DIR, SNAPSHOT_DIR,
+    DB_BUSY_TIMEOUT_MS, DB_WRITE_RETRIES, DB_RETRY_BACKOFF_SECONDS, DB_WRITE_MAX_WAIT_MS
+)
+from metrics import Counter, Gauge, Histogram
+from query_tracer import TracedConnection
+
+DEFAULT_TENANT_ID = 'default'
+
+
+class Tenant:
+    """A mess with its own database file and owners."""
+
+    def __init__(self, tenant_id, name, db_path, owners=()):
+        self.tenant_id = tenant_id
+        self.name = name
+        self.db_path = db_path
+        self.owners = frozenset(owners)
+
+    @property
+    def backup_dir(self):
+        # The default mess keeps its snapshots where they have always been
+        if self.tenant_id == DEFAULT_TENANT_ID:
+            return BACKUP_DIR
+        return os.path.join(BACKUP_DIR, self.tenant_id)
+
+    @property
+    def snapshot_dir(self):
+        return os.path.join(SNAPSHOT_DIR, self.tenant_id)
+
+
+############
+# REGISTRY #
+############
+
+class TenantRegistry:
+    """Messes, their owners and which mess each Telegram user belongs to."""
+
+    def __init__(self, path=TENANTS_DB, db_dir=TENANT_DB_DIR):
+        self.path = path
+        self.db_dir = db_dir
+        self.default = Tenant(DEFAULT_TENANT_ID, 'Default mess', 'mess.db')
+        self._tenants = {}
+        self._members = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        # Called as listener('tenants') after each change, e.g. to tell other workers
+        self.listeners = []
+
+    def configure(self, owner_telegram_id, db_path='mess.db'):
+        """Set the owner and database of the default mess, whose owner also manages all messes."""
+        owners = [str(owner_telegram_id)] if owner_telegram_id else []
+        self.default = Tenant(DEFAULT_TENANT_ID, 'Default mess', db_path, owners)
+
+    def _load(self):
+        if self._loaded:
+            return
+        conn = sqlite3.connect(self.path)
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS Tenants (
+                tenant_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                db_path TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS Tenant_Owners (
+                tenant_id TEXT NOT NULL,
+                telegram_id TEXT NOT NULL,
+                PRIMARY KEY (tenant_id, telegram_id),
+                FOREIGN KEY (tenant_id) REFERENCES Tenants(tenant_id)
+            );
+            CREATE TABLE IF NOT EXISTS Tenant_Members (
+                telegram_id TEXT PRIMARY KEY,
+                tenant_id TEXT NOT NULL,
+                FOREIGN KEY (tenant_id) REFERENCES Tenants(tenant_id)
+            );
+        ''')
+        owners = {}
+        for tenant_id, telegram_id in conn.execute('SELECT tenant_id, telegram_id FROM Tenant_Owners'):
+            owners.setdefault(tenant_id, []).append(telegram_id)
+        self._tenants = {
+            tenant_id: Tenant(tenant_id, name, db_path, owners.get(tenant_id, ()))
+            for tenant_id, name, db_path in conn.execute('SELECT tenant_id, name, db_path FROM Tenants')
+        }
+        self._members = dict(conn.execute('SELECT telegram_id, tenant_id FROM Tenant_Members'))
+        conn.close()
+        self._loaded = True
+
+    def reload(self):
+        """Reread the registry on next use, e.g. after another process changed it."""
+        with self._lock:
+            self._loaded = False
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener('tenants')
+
+    def get(self, tenant_id):
+        """Return the mess with tenant_id, or None."""
+        if tenant_id == DEFAULT_TENANT_ID:
+            return self.default
+        with self._lock:
+            self._load()
+            return self._tenants.get(tenant_id)
+
+    def tenants(self):
+        """All messes, the default one first."""
+        with self._lock:
+            self._load()
+            return [self.default] + [self._tenants[key] for key in sorted(self._tenants)]
+
+    def add_tenant(self, tenant_id, name, owners):
+        """Register a new mess and return it; its database file lives in db_dir."""
+        tenant = Tenant(tenant_id, name, os.path.join(self.db_dir, f'{tenant_id}.db'), owners)
+        os.makedirs(self.db_dir, exist_ok=True)
+        with self._lock:
+            self._load()
+            conn = sqlite3.connect(self.path)
+            try:
+                conn.execute('INSERT INTO Tenants (tenant_id, name, db_path) VALUES (?, ?, ?)',
+                             (tenant.tenant_id, tenant.name, tenant.db_path))
+                conn.executemany('INSERT INTO Tenant_Owners (tenant_id, telegram_id) VALUES (?, ?)',
+                                 [(tenant_id, owner) for owner in tenant.owners])
+                conn.commit()
+            finally:
+                conn.close()
+            self._tenants[tenant_id] = tenant
+        self._notify()
+        return tenant
+
+    def add_member(self, telegram_id, tenant_id):
+        """Route telegram_id to tenant_id from now on."""
+        telegram_id = str(telegram_id)
+        with self._lock:
+            self._load()
+            if self._members.get(telegram_id) == tenant_id:
+                return
+            conn = sqlite3.connect(self.path)
+            try:
+                conn.execute('''
+                    INSERT INTO Tenant_Members (telegram_id, tenant_id) VALUES (?, ?)
+                    ON CONFLICT(telegram_id) DO UPDATE SET tenant_id = excluded.tenant_id
+                ''', (telegram_id, tenant_id))
+                conn.commit()
+            finally:
+                conn.close()
+            self._members[telegram_id] = tenant_id
+        self._notify()
+
+    def owned_by(self, telegram_id):
+        """Messes that telegram_id owns, the default one first."""
+        telegram_id = str(telegram_id)
+        return [tenant for tenant in self.tenants() if telegram_id in tenant.owners]
+
+    def resolve(self, telegram_id):
+        """The mess telegram_id is a member of, else the first one they own, else the default."""
+        telegram_id = str(telegram_id)
+        with self._lock:
+            self._load()
+            tenant = self._tenants.get(self._members.get(telegram_id))
+        if tenant:
+            return tenant
+        owned = self.owned_by(telegram_id)
+        return owned[0] if owned else self.default
+
+
+registry = TenantRegistry()
+
+# Mess of the update being handled; None means the default mess
+current_tenant = contextvars.ContextVar('current_tenant', default=None)
+
+
+def get_tenant():
+    tenant = current_tenant.get()
+    return registry.default if tenant is None else tenant
+
+
+def set_tenant(tenant):
+    """Make tenant current for the rest of the running update."""
+    current_tenant.set(tenant)
+
+
+@contextlib.contextmanager
+def use_tenant(tenant):
+    """Run a block, e.g. a scheduled job, against tenant's database."""
+    token = current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        current_tenant.reset(token)
+
+
+def is_owner(telegram_id):
+    """Whether telegram_id owns the current mess; the bot owner manages every mess."""
+    return str(telegram_id) in get_tenant().owners or is_super_owner(telegram_id)
+
+
+def is_super_owner(telegram_id):
+    """Whether telegram_id owns the default mess and so manages the whole bot."""
+    return str(telegram_id) in registry.default.owners
+
+
+###################
+# CONNECTION POOL #
+###################
+
+class PooledConnection(TracedConnection):
+    """TracedConnection that returns to its pool on close() instead of closing."""
+
+    _pool = None
+    _idle = False
+    _busy_timeout_ms = DB_BUSY_TIMEOUT_MS
+
+    def set_busy_timeout(self, ms):
+        """Wait at most ms for a lock held by another connection."""
+        ms = max(0, int(ms))
+        if ms != self._busy_timeout_ms:
+            self.execute(f'PRAGMA busy_timeout = {ms}')
+            self._busy_timeout_ms = ms
+
+    def close(self):
+        if self._pool is None:
+            return super().close()
+        if self._idle:
+            return
+        # Same outcome as closing: anything not committed is discarded
+        if self.in_transaction:
+            self.rollback()
+        self._pool.release(self)
+
+
+class ConnectionPool:
+    """Idle connections per database file, closing those of the least recently used files first."""
+
+    def __init__(self, max_idle=TENANT_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = OrderedDict()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, db_path):
+        key = os.path.abspath(db_path)
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                conn = connections.pop()
+                self._idle.move_to_end(key)
+                self._count -= 1
+                conn._idle = False
+                return conn
+        # Connections may be handed to another thread later, but only after being released
+        conn = sqlite3.connect(key, timeout=DB_BUSY_TIMEOUT_MS / 1000, factory=PooledConnection,
+                               check_same_thread=False)
+        conn._pool = self
+        conn._key = key
+        return conn
+
+    def release(self, conn):
+        to_close = []
+        with self._lock:
+            conn._idle = True
+            self._idle.setdefault(conn._key, []).append(conn)
+            self._idle.move_to_end(conn._key)
+            self._count += 1
+            while self._count > self.max_idle:
+                key, connections = next(iter(self._idle.items()))
+                to_close.append(connections.pop(0))
+                self._count -= 1
+                if not connections:
+                    del self._idle[key]
+        for stale in to_close:
+            sqlite3.Connection.close(stale)
+
+    def close_idle(self, db_path=None):
+        """Close idle connections to db_path, or to every file, e.g. before deleting it."""
+        with self._lock:
+            if db_path is None:
+                closing = [conn for connections in self._idle.values() for conn in connections]
+                self._idle.clear()
+            else:
+                closing = self._idle.pop(os.path.abspath(db_path), [])
+            self._count -= len(closing)
+        for conn in closing:
+            sqlite3.Connection.close(conn)
+
+    def idle_count(self):
+        return self._count
+
+    @contextlib.contextmanager
+    def transaction(self, db_path):
+        """Run a block as one write transaction on db_path and commit it, yielding a cursor.
+
+        BEGIN IMMEDIATE takes the write lock before the block reads anything, so a
+        read-then-write block cannot interleave with another writer. Taking the lock and
+        committing are retried with exponential backoff while the database is locked;
+        an exception in the block rolls everything back.
+
+        Handlers call this on the event loop, where every wait for the lock holds up all
+        other updates, so waits and pauses together are capped at DB_WRITE_MAX_WAIT_MS
+        and the write then fails with "database is locked".
+        """
+        conn = self.acquire(db_path)
+        deadline = time.monotonic() + DB_WRITE_MAX_WAIT_MS / 1000
+        try:
+            start = time.perf_counter()
+            _retry_while_busy(conn, deadline, conn.execute, 'BEGIN IMMEDIATE')
+            LOCK_WAIT.observe(time.perf_counter() - start)
+            yield conn.cursor()
+            _retry_while_busy(conn, deadline, conn.commit)
+        finally:
+            conn.set_busy_timeout(DB_BUSY_TIMEOUT_MS)
+            conn.close()
+
+
+def _is_busy(error):
+    return (getattr(error, 'sqlite_errorcode', None) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+            or 'database is locked' in str(error))
+
+
+def _retry_while_busy(conn, deadline, operation, *args):
+    for attempt in range(DB_WRITE_RETRIES + 1):
+        try:
+            return operation(*args)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            pause = DB_RETRY_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.0)
+            remaining = deadline - time.monotonic() - pause
+            if attempt == DB_WRITE_RETRIES or remaining <= 0:
+                LOCK_BUSY.inc(outcome='gave_up')
+                raise
+            LOCK_BUSY.inc(outcome='retried')
+            time.sleep(pause)
+            # The next attempt waits for the lock only as long as the deadline leaves
+            conn.set_busy_timeout(min(DB_BUSY_TIMEOUT_MS, remaining * 1000))
+
+
+pool = ConnectionPool()
+
+POOL_IDLE = Gauge('mess_db_pool_idle_connections', 'Open database connections waiting in the pool.')
+POOL_IDLE.set_function(pool.idle_count)
+LOCK_WAIT = Histogram('mess_db_lock_wait_seconds', 'Time write transactions waited for the database write lock.')
+LOCK_BUSY = Counter('mess_db_busy_total', 'Write attempts that found the database locked, by outcome (retried, gave_up).')
@@ -0,0 +1,187 @@
+"""
+In-memory search index over usernames and names.
+
+Users are indexed by the trigrams of their username and name, plus a sorted
+list of name tokens for prefix lookups, so /finduser and the username fallback
+in /updatepayment can rank fuzzy matches without scanning the Users table.
+"""
+
+import bisect
+import heapq
+import math
+import sqlite3
+from collections import defaultdict
+from tenants import get_tenant
+
+# Fraction of the query's trigrams a user must share to be considered a match
+MIN_SHARED_FRACTION = 0.3
+# A fuzzy match is only taken as the user meant when it scores at least this
+# and beats the runner-up by the margin; anything less is listed for the owner
+RESOLVE_MIN_SCORE = 0.85
+RESOLVE_MARGIN = 0.2
+
+
+def _normalize(text):
+    return ' '.join(text.lower().replace('@', ' ').split())
+
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class UserIndex:
+    """Trigram and prefix index of users, keyed by username."""
+
+    def __init__(self, users=()):
+        self._names = {}
+        self._keys = {}
+        self._grams = {}
+        self._postings = defaultdict(set)
+        self._tokens = []
+        for username, name in users:
+            self.add(username, name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, username, name):
+        """Index a user, replacing any previous entry for the username."""
+        if username in self._names:
+            self.remove(username)
+        text = _normalize(f'{username} {name}')
+        grams = _trigrams(text)
+        self._names[username] = name
+        self._keys[username] = _normalize(username)
+        self._grams[username] = grams
+        for gram in grams:
+            self._postings[gram].add(username)
+        for token in set(text.split()):
+            bisect.insort(self._tokens, (token, username))
+
+    def remove(self, username):
+        """Drop a user from the index."""
+        name = self._names.pop(username, None)
+        if name is None:
+            return
+        del self._keys[username]
+        for gram in self._grams.pop(username):
+            self._postings[gram].discard(username)
+        for token in set(_normalize(f'{username} {name}').split()):
+            i = bisect.bisect_left(self._tokens, (token, username))
+            if i < len(self._tokens) and self._tokens[i] == (token, username):
+                del self._tokens[i]
+
+    def _prefix_matches(self, prefix):
+        i = bisect.bisect_left(self._tokens, (prefix,))
+        while i < len(self._tokens) and self._tokens[i][0].startswith(prefix):
+            yield self._tokens[i][1]
+            i += 1
+
+    def search(self, query, limit=5):
+        """Return up to limit (score, username, name) tuples, best match first.
+
+        Scores are in [0, 1]: exact username matches score 1, token prefix
+        matches get a boost, and everything else is ranked by trigram overlap.
+        """
+        text = _normalize(query)
+        if not text:
+            return []
+        query_grams = _trigrams(text)
+
+        # A user sharing at least min_shared trigrams must appear in one of the
+        # (len - min_shared + 1) rarest posting lists, so common trigrams are skipped
+        rarest = sorted(query_grams, key=lambda gram: len(self._postings.get(gram, ())))
+        min_shared = max(1, math.ceil(len(query_grams) * MIN_SHARED_FRACTION))
+        candidates = set()
+        for gram in rarest[:len(rarest) - min_shared + 1]:
+            candidates.update(self._postings.get(gram, ()))
+
+        prefixed = set()
+        for token in text.split():
+            prefixed.update(self._prefix_matches(token))
+
+        scored = []
+        query_size = len(query_grams)
+        for username in candidates | prefixed:
+            if self._keys[username] == text:
+                score = 1.0
+            else:
+                grams = self._grams[username]
+                overlap = len(query_grams & grams)
+                score = overlap / (query_size + len(grams) - overlap)
+                if username in prefixed:
+                    score = min(0.99, score + 0.5)
+            scored.append((score, username))
+
+        best = heapq.nsmallest(limit, scored, key=lambda match: (-match[0], match[1]))
+        return [(score, username, self._names[username]) for score, username in best if score >= 0.1]
+
+
+_indexes = {}
+
+
+def get_index():
+    """Return the current mess's index, building it from its database on first use."""
+    tenant = get_tenant()
+    index = _indexes.get(tenant.tenant_id)
+    if index is None:
+        conn = sqlite3.connect(tenant.db_path)
+        users = conn.execute('SELECT username, name FROM Users').fetchall()
+        conn.close()
+        index = _indexes[tenant.tenant_id] = UserIndex(users)
+    return index
+
+
+def apply_invalidate():
+    """Force the current mess's index to be rebuilt on next use, without notifying listeners."""
+    _indexes.pop(get_tenant().tenant_id, None)
+
+
+def invalidate_all():
+    """Force every mess's index to be rebuilt on next use."""
+    _indexes.clear()
+
+
+# Called as listener('indexed', username, name) after each new user and listener('reindex') when
+# the current mess's index is dropped, e.g. to tell other workers
+listeners = []
+
+
+def invalidate():
+    """Force the current mess's index to be rebuilt on next use, e.g. after a restore."""
+    apply_invalidate()
+    for listener in listeners:
+        listener('reindex')
+
+
+def apply_indexed(username, name):
+    """Add a user to the current mess's index if it has been built, without notifying listeners."""
+    index = _indexes.get(get_tenant().tenant_id)
+    if index is not None:
+        index.add(username, name)
+
+
+def index_user(username, name):
+    """Add a new user to the current mess's index if it has been built."""
+    apply_indexed(username, name)
+    for listener in listeners:
+        listener('indexed', username, name)
+
+
+def search_users(query, limit=5):
+    """Rank users matching query by username and name."""
+    return get_index().search(query, limit)
+
+
+def resolve_user(query, limit=5):
+    """Return (username, matches): the one user query clearly names, or None and the candidates to offer."""
+    matches = search_users(query, limit)
+    exact = [match for match in matches if match[0] == 1.0]
+    if exact:
+        return (exact[0][1] if len(exact) == 1 else None), matches
+    if matches and matches[0][0] >= RESOLVE_MIN_SCORE and (
+        len(matches) == 1 or matches[0][0] - matches[1][0] >= RESOLVE_MARGIN
+    ):
+        return matches[0][1], matches
+    return None, matches
@@ -1,18 +1,10 @@
-from datetime import datetime, timedelta
-import pytz
+from clock import get_clock
 
 def check_thresholds(date_str):
-    tz = pytz.timezone('Asia/Kolkata')
-    now = datetime.now(tz)
-    if date_str.lower() == 'today':
-        target_date = now.strftime('%Y-%m-%d')
-    else:
-        try:
-            target_date = datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y-%m-%d')
-        except ValueError:
-            return None, False, False
-    current_hour = now.hour
-    is_same_day = target_date == now.strftime('%Y-%m-%d')
-    lunch_allowed = not is_same_day or current_hour < 11
-    dinner_allowed = not is_same_day or current_hour < 17
+    clock = get_clock()
+    target_date = clock.resolve_date(date_str)
+    if not target_date:
+        return None, False, False
+    lunch_allowed = clock.can_change('lunch', target_date)
+    dinner_allowed = clock.can_change('dinner', target_date)
     return target_date, lunch_allowed, dinner_allowed
\ No newline at end of file